@@ -19,12 +19,16 @@ from stumpy import Histogram
 from argparse import ArgumentParser
 from collections import defaultdict
 from fitting.gaussian import GaussianModel, GaussianModelCoulomb
+from fitting.objective import Gauss3DResidual, Gauss3DLogLikelihood
+from fitting.precision import compare_precision
 from pionpion import Femtolist, Analysis
 from pionpion.root_helpers import get_root_object
 from pionpion.q3d import Q3D
+from pionpion.histogram import ArrayHistogram
+from pionpion.rootview import to_root_histogram
+from pionpion.cache import default_cache
 from pionpion.fit import (
     fitfunc_qinv,
-    fitfunc_3d,
 )
 
 TSTART = time.monotonic()
@@ -58,6 +62,23 @@ def arguments():
                         nargs='?',
                         default=None,
                         help="Root filename to write results")
+    parser.add_argument("--loglike",
+                        action='store_true',
+                        help="Fit the 3D numerator/denominator by log-likelihood "
+                             "instead of the chi-square of the ratio")
+    parser.add_argument("--float32",
+                        action='store_true',
+                        help="Evaluate chi-square fits in single precision")
+    parser.add_argument("--check-precision",
+                        action='store_true',
+                        help="Fit in both single and double precision and report the "
+                             "deviation of the radii (the fit of the chosen precision "
+                             "is used)")
+    parser.add_argument("--fold",
+                        choices=sorted(Q3D.FOLD_MODES),
+                        default=None,
+                        help="Merge the 3D histograms into the independent part of "
+                             "q-space before fitting")
     return parser.parse_args()
 
 
@@ -106,7 +127,7 @@ args = arguments()
 
 # file = TFile(args.filename, 'READ')
 # femtolist = get_root_object(file, ['femtolist', 'PWG2FEMTO.femtolist'])
-femtolist = Femtolist(args.filename)
+femtolist = Femtolist(args.filename, cache=default_cache)
 
 
 if femtolist == None:
@@ -180,7 +201,8 @@ def do_qinv_analysis(num, den, cf_title="CF; q (GeV); CF(q)", output_imagename='
     FIT_Y = ModelClass().eval(qinv_fit.params, x=FIT_X)
 
     # Repeat without Coulomb interaction
-    qinv_fit_nocoulomb = minimize(GaussianModel.as_resid, qinv_params, args=(x, ratio, errors))
+    qinv_fit_nocoulomb = minimize(GaussianModel.as_resid, qinv_params, args=(x, ratio, errors),
+                                  Dfun=GaussianModel.as_resid_jacobian)
     report_fit(qinv_fit_nocoulomb)
     FIT_Y_NO_COULOMB = GaussianModel().eval(qinv_fit_nocoulomb.params, x=FIT_X)
 
@@ -325,14 +347,25 @@ for analysis in femtolist:
 
 
     hist_3d = Q3D(q3d_num, q3d_den)
+    if args.fold:
+        hist_3d = hist_3d.fold(args.fold)
 
     domains_ranges = (-0.01, 0.01), (-0.01, 0.01), (-0.0, 0.007) #1, 0.01)
     # domains_ranges = (-.09, 0.09), (-.09, 0.09), (-.09, 0.09)
-    xx, yy, zz = np.meshgrid(*(a.bin_centers for a in hist_3d.num.axes))
-    q_domain = np.stack([xx.flatten(), yy.flatten(), zz.flatten()]).T
-    ratio = hist_3d.ratio.data.flatten()
-    ratio_err = hist_3d.ratio.errors.flatten()
-    print('q_domain', q_domain.shape, 'ratio', ratio.shape, ratio_err.shape)
+    # fit only the informative bins
+    # (bins with empty numerator carry information in the log-likelihood)
+    domain = hist_3d.fit_domain(exclude_zero_error=not args.loglike)
+    q_domain, ratio, ratio_err = domain.q, domain.ratio, domain.errors
+    print('q_domain', q_domain.shape, 'of', hist_3d.num.data.size, 'bins')
+    precision_check = None
+    if args.loglike:
+        objective = Gauss3DLogLikelihood.from_domain(domain)
+    elif args.check_precision:
+        precision_check = compare_precision(q_domain, ratio, ratio_err, q3d_params)
+        print(precision_check.report())
+    else:
+        objective = Gauss3DResidual(q_domain, ratio, ratio_err,
+                                    dtype=np.float32 if args.float32 else np.float64)
 
     # domains_ranges = (1, -2), (1, -2), (1, -1)
     # slices = hist_3d.num.get_slice(*domains_ranges)
@@ -341,15 +374,17 @@ for analysis in femtolist:
     print("------")
     t = time.monotonic()
     TIMESTART = time.monotonic()
-    fit_res = minimize(fitfunc_3d, q3d_params, args=(q_domain, (ratio, ratio_err)))
+    if precision_check is not None:
+        # reuse the fits of the check
+        fit_res = precision_check.reduced if args.float32 else precision_check.reference
+        TIME_DELTA = precision_check.times[1 if args.float32 else 0]
+    else:
+        fit_res = minimize(objective, q3d_params, epsfcn=objective.epsfcn)
+        TIME_DELTA = time.monotonic() - TIMESTART
     print(":::::", fit_res)
-    TIME_DELTA = time.monotonic() - TIMESTART
     report_fit(fit_res)
     print("fitting time %0.3fs (%0.3f ms/call)" % (TIME_DELTA, TIME_DELTA * 1e3 / fit_res.nfev))
 
-    fit_domain = q_domain
-    best_fit = fitfunc_3d(fit_res.params, fit_domain).reshape(hist_3d.num.shape)
-
     # slices
     s = hist_3d.num.get_slice(*domains_ranges)
 
@@ -363,15 +398,15 @@ for analysis in femtolist:
 
     qout = hist_3d.projection_out(y_slice=domains_ranges[1], z_slice=domains_ranges[2]) # / y_width / z_width / fit_res.params['norm']
     qout_err = hist_3d.projection_out_error(y_slice=domains_ranges[1], z_slice=domains_ranges[2]) # / y_width / z_width
-    fit_qout = best_fit[:, s[1], s[2]].sum(axis=(1, 2)) / y_width / z_width # / fit_res.params['norm']
+    fit_qout = hist_3d.project_model(fit_res.params, 0, (s[1], s[2]))[1] / y_width / z_width # / fit_res.params['norm']
 
     qside = hist_3d.projection_side(x_slice=domains_ranges[0], z_slice=domains_ranges[2]) / x_width / z_width
     qside_err = hist_3d.projection_side_error(*domains_ranges[:2])
-    fit_qside = best_fit[s[0], :, s[2]].sum(axis=(0, 2)) / x_width / z_width
+    fit_qside = hist_3d.project_model(fit_res.params, 1, (s[0], s[2]))[1] / x_width / z_width
 
     qlong = hist_3d.projection_long(x_slice=domains_ranges[0], y_slice=domains_ranges[1])
     qlong_err = hist_3d.projection_long_error(*domains_ranges[:2])
-    fit_qlong = best_fit[s[0], s[1], :].sum(axis=(0, 1)) / x_width / y_width
+    fit_qlong = hist_3d.project_model(fit_res.params, 2, (s[0], s[1]))[1] / x_width / y_width
 
     f, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2) # , sharex='col', sharey='row')
 
@@ -421,6 +456,22 @@ for analysis in femtolist:
     qlong = hist_3d.projection_long(*domains_ranges[:2])
     # print(qlong)
 
+    # q_out-q_side correlation functions of slabs of 2 * zdist + 1 q_long
+    # bins around q_long = 0, all from one pass over num and den
+    projections_2d = hist_3d.projections_2d(widths=range(1, 4), planes=('out_side', ))
+    out_side_edges = [hist_3d.ratio.x_axis.edges, hist_3d.ratio.y_axis.edges]
+    for zdist in range(1, 4):
+        projection = projections_2d['out_side', zdist]
+        out_side = (ArrayHistogram(projection.num, edges=out_side_edges)
+                    / ArrayHistogram(projection.den, edges=out_side_edges))
+        # empty bins are zero (as TH1::Divide)
+        out_side.data = projection.ratio
+        out_side.errors = np.where(projection.den != 0, out_side.errors, 0.0)
+        out_side.title = "q_{out} q_{side} (%d q_{long} bins around 0)" % (2 * zdist + 1)
+        out_side = to_root_histogram(out_side, "out_side_z%02d" % zdist)
+        print(":::out_side: %s" % out_side)
+        out_side.Write()
+
 
     kt_binned = analysis['KT_Q3D']
     for kt_bin in kt_binned:
@@ -432,42 +483,22 @@ for analysis in femtolist:
             print("  Could not find num/den pair")
             continue
         hist_3d = Q3D(q3d_num, q3d_den)
+        if args.fold:
+            hist_3d = hist_3d.fold(args.fold)
 
-        fit_res = minimize(fitfunc_3d, q3d_params, args=(q_domain, (ratio, ratio_err)))
-
-        domains_ranges = (-.05, 0.05), (-.05, 0.05), (-.05, 0.05)
-        xx, yy, zz = np.meshgrid(*(hist_3d.num.axes[i].bin_centers for i in range(3)))
-        q_domain = np.stack([xx.flatten(), yy.flatten(), zz.flatten()]).T
-        ratio = hist_3d.ratio.data.flatten()
-        ratio_err = hist_3d.ratio.errors.flatten()
+        if args.loglike:
+            domain = hist_3d.fit_domain(exclude_zero_error=False)
+            objective = Gauss3DLogLikelihood.from_domain(domain)
+        else:
+            domain = hist_3d.fit_domain()
+            objective = Gauss3DResidual(domain.q, domain.ratio, domain.errors,
+                                        dtype=np.float32 if args.float32 else np.float64)
+        fit_res = minimize(objective, q3d_params, epsfcn=objective.epsfcn)
 
     continue
 
     # hist_3d.ratio._ptr.Write()
-    out_side_num, out_side_den = hist_3d.num._ptr, hist_3d.den._ptr
-
-    zz = hist_3d.ratio._ptr.GetZaxis().FindBin(0.0)
-
-
-    for zdist in range(1, 4):
-        zrange = zz - zdist, zz + zdist
-        out_side_num.GetZaxis().SetRange(*zrange)
-        out_side_den.GetZaxis().SetRange(*zrange)
-
-        out_side = out_side_num.Project3D("yx")
-        out_side.Divide(out_side_den.Project3D("yx"))
-        print(":::out_side: %s" % out_side)
-
-        # out_side_cnvs = ROOT.TCanvas("out_side")
-        # out_side.SetStats(False)
-        # out_side.Draw("colz")
-        # out_side_cnvs.Draw()
-        # out_side_cnvs.SaveAs("OUTSIDEz%02d.eps" % zdist)
-        out_side.Write()
-
-        # input()
-    out_side_num.GetZaxis().SetRange()
-    out_side_den.GetZaxis().SetRange()
+    # (the q_out-q_side slabs are written above, see projections_2d)
     # out_side_num = hist_3d.num.project_2d(0, 1, (-0.03, 0.03), bounds_x=(0.0, None))
     # out_side_den = hist_3d.den.project_2d(0, 1, (-0.03, 0.03), bounds_x=(0.0, None))
     # # print(out_side_num.shape)
@@ -516,7 +547,7 @@ for analysis in femtolist:
     ratio = hist_3d.ratio_data[slices].flatten()[error_mask]
 
     TIMESTART = time.monotonic()
-    fit_res = minimize(fitfunc_3d, q3d_params, args=(dom, (ratio, ratio_err)))
+    fit_res = minimize(Gauss3DResidual(dom, ratio, ratio_err), q3d_params)
     print(":::::", fit_res)
     TIME_DELTA = time.monotonic() - TIMESTART
     report_fit(fit_res)
@@ -533,13 +564,16 @@ for analysis in femtolist:
     # hist_3d.ratio._ptr.Scale(1.0 / fit_res.params['norm'])
     # hist_3d.ratio_data = hist_3d.ratio_data / fit_res.params['norm']
 
+    # Q3D.ratio is an ArrayHistogram - ROOT projections need a TH3 copy
+    ratio_root = to_root_histogram(hist_3d.ratio, "ratio")
+
     out_side_cnvs = ROOT.TCanvas("out_side")
     print('>>>>', out_side_cnvs)
-    zz = hist_3d.ratio._ptr.GetZaxis().FindBin(0.0)
+    zz = ratio_root.GetZaxis().FindBin(0.0)
     zdist = 3
-    hist_3d.ratio._ptr.GetZaxis().SetRange(zz - zdist, zz + zdist)
+    ratio_root.GetZaxis().SetRange(zz - zdist, zz + zdist)
     # hist_3d.ratio._ptr.GetZaxis().SetRange(zmin, zmax)
-    out_side = hist_3d.ratio._ptr.Project3D("yx")
+    out_side = ratio_root.Project3D("yx")
     out_side.Write()
     out_side.SetStats(False)
     # out_side.Draw("colz")
@@ -569,22 +603,13 @@ for analysis in femtolist:
         qout.Scale(.5)
 
     # qout.SetTitle("q_{out};; CF(q_{out})")
-    best_fit_X = hist_3d.ratio.x_axis[xmin:xmax]
-    best_fit_Y = hist_3d.ratio.y_axis[ymin:ymax]
-    best_fit_Z = hist_3d.ratio.z_axis[zmin:zmax]
-    print(best_fit_X , best_fit_Y, best_fit_Z)
+    x_window, y_window, z_window = slice(xmin, xmax), slice(ymin, ymax), slice(zmin, zmax)
 
     qo_X = np.linspace(-0.6, 0.6, 200)
     qs_X = np.linspace(-0.6, 0.6, 200)
     ql_X = np.linspace(-0.8, 0.8, 200)
 
-    best_fit_Domain = np.array([[[x, y, z]
-                                  for y in best_fit_Y
-                                  for z in best_fit_Z
-                                  ] for x in qo_X])
-    best_fit_qout = np.array([fitfunc_3d(fit_res.params, x)
-                              for x in best_fit_Domain])
-    qo_Y = np.sum(best_fit_qout, axis=1) * norm_scale_factor
+    qo_Y = hist_3d.project_model(fit_res.params, 0, (y_window, z_window), samples=qo_X)[1] * norm_scale_factor
     assert qo_Y.shape == qo_X.shape
 
     qo_graph = ROOT.TGraph(len(qo_X), qo_X, qo_Y)
@@ -593,16 +618,10 @@ for analysis in femtolist:
 
     norm_scale_factor = 1.0 / ((xmax - xmin) * (zmax - zmin)) / fit_res.params['norm']
 
-    best_fit_Domain = np.array([[[x, y, z]
-                                  for x in best_fit_X
-                                  for z in best_fit_Z
-                                  ] for y in qs_X])
-    best_fit_qout = np.array([fitfunc_3d(fit_res.params, x)
-                              for x in best_fit_Domain])
-    qs_Y = np.sum(best_fit_qout, axis=1) * norm_scale_factor
+    qs_Y = hist_3d.project_model(fit_res.params, 1, (x_window, z_window), samples=qs_X)[1] * norm_scale_factor
     assert qs_X.shape == qs_Y.shape
 
-    qside = hist_3d.ratio._ptr.ProjectionY("qside", xmin, xmax-1, zmin, zmax-1)
+    qside = ratio_root.ProjectionY("qside", xmin, xmax-1, zmin, zmax-1)
     qside.SetStats(False)
     qside.Scale(norm_scale_factor)
     qside.SetTitle("q_{side};; CF(q_{side})")
@@ -619,18 +638,12 @@ for analysis in femtolist:
 
     norm_scale_factor = 1.0 / ((xmax - xmin) * (ymax - ymin)) / fit_res.params['norm']
 
-    best_fit_Domain = np.array([[[x, y, z]
-                                  for x in best_fit_X
-                                  for y in best_fit_Y
-                                  ] for z in ql_X])
-    best_fit_qout = np.array([fitfunc_3d(fit_res.params, x)
-                              for x in best_fit_Domain])
-    ql_Y = np.sum(best_fit_qout, axis=1) * norm_scale_factor
+    ql_Y = hist_3d.project_model(fit_res.params, 2, (x_window, y_window), samples=ql_X)[1] * norm_scale_factor
     assert ql_X.shape == ql_Y.shape
 
 
 
-    qlong = hist_3d.ratio._ptr.ProjectionZ("qlong", xmin, xmax-1, ymin, ymax-1)
+    qlong = ratio_root.ProjectionZ("qlong", xmin, xmax-1, ymin, ymax-1)
     qlong.SetStats(False)
     qlong.SetTitle("q_{long};; CF(q_{long})")
     qlong.Scale(norm_scale_factor)
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+#
+# post_analysis/export_femtolist.py
+#
+"""
+Export the histograms of a femtolist into a directory of numpy arrays, which
+may be read back without ROOT by pionpion.store.StoreFemtolist.
+"""
+
+import sys
+from argparse import ArgumentParser
+from pionpion.store import export_femtolist
+
+
+def argument_parser():
+    parser = ArgumentParser('export_femtolist.py')
+    parser.add_argument("filename", help="ROOT file containing the femtolist")
+    parser.add_argument("output",
+                        nargs='?',
+                        default=None,
+                        help="Destination directory, defaults to the input "
+                             "filename with '.store' replacing the extension")
+    parser.add_argument("--overwrite",
+                        action='store_true',
+                        help="Overwrite an existing store")
+    return parser
+
+
+def main(argv):
+    args = argument_parser().parse_args(argv)
+
+    if args.output is None:
+        args.output = args.filename.rpartition('.')[0] + '.store'
+
+    manifest = export_femtolist(args.filename, args.output, overwrite=args.overwrite)
+    print("Wrote", manifest)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,227 @@
+#
+# post_analysis/fitting/batch.py
+#
+"""
+Simultaneous least-squares fitting of many 1D correlation functions.
+
+All correlation functions (e.g. every kT bin of every centrality) are
+stacked into padded 2D arrays with a mask of valid bins, and a
+Levenberg-Marquardt step is taken for every fit at once using the analytic
+partial derivatives of the model (see AnalyticJacobian.gauss_partials).
+The objective is the same chi-square minimized by Model.as_resid, and
+errors are scaled by the reduced chi-square as lmfit does by default, so
+results match those of lmfit.minimize.
+"""
+
+import numpy as np
+from collections import namedtuple
+from lmfit import Parameters
+from lmfit.minimizer import MinimizerResult
+
+PARAM_NAMES = ('norm', 'lam', 'radius')
+
+
+class BatchFitResult(namedtuple('BatchFitResult', [
+        'values', 'stderr', 'covar', 'chisqr', 'ndata', 'var_names', 'niter', 'success'])):
+    """
+    Results of batch_fit - values and stderr map parameter names to arrays
+    with one entry per fit; covar is the (nfits, nvarys, nvarys) array of
+    covariance matrices of the varying parameters.
+    """
+
+    __slots__ = ()
+
+    def __len__(self):
+        return len(self.chisqr)
+
+    @property
+    def nvarys(self):
+        return len(self.var_names)
+
+    @property
+    def redchi(self):
+        return self.chisqr / np.maximum(self.ndata - self.nvarys, 1)
+
+    def params(self, i):
+        """Return lmfit Parameters holding the results of fit i"""
+        p = Parameters()
+        for name in PARAM_NAMES:
+            p.add(name, value=float(self.values[name][i]))
+            p[name].stderr = float(self.stderr[name][i])
+        return p
+
+    def minimizer_result(self, i):
+        """Return fit i as an lmfit MinimizerResult (for report_fit etc.)"""
+        params = self.params(i)
+        var_names = list(self.var_names)
+        for name in PARAM_NAMES:
+            params[name].vary = name in var_names
+        ndata, nvarys = int(self.ndata[i]), self.nvarys
+        chisqr = float(self.chisqr[i])
+        nfree = ndata - nvarys
+        result = MinimizerResult(method='batch_leastsq',
+                                 params=params,
+                                 var_names=var_names,
+                                 init_vals=[],
+                                 covar=self.covar[i],
+                                 errorbars=bool(self.success[i]),
+                                 success=bool(self.success[i]),
+                                 message='',
+                                 nfev=int(self.niter[i]),
+                                 ndata=ndata,
+                                 nvarys=nvarys,
+                                 nfree=nfree,
+                                 chisqr=chisqr,
+                                 redchi=chisqr / max(nfree, 1))
+        neg2_log_likel = ndata * np.log(chisqr / ndata)
+        result.aic = neg2_log_likel + 2 * nvarys
+        result.bic = neg2_log_likel + np.log(ndata) * nvarys
+        return result
+
+
+def stack_histograms(histograms, fit_range):
+    """
+    Stack the bins of 1D histograms within fit_range into padded
+    (nfits, nbins) arrays x, y, errors and mask. Empty bins, and bins
+    with zero error, are masked out.
+    """
+    slices = [h.x_axis.get_slice(fit_range) for h in histograms]
+    columns = [(h.x_axis.bin_centers[s], h.data[s], h.errors[s])
+               for h, s in zip(histograms, slices)]
+    width = max(len(x) for x, _, _ in columns)
+
+    x = np.zeros((len(histograms), width))
+    y = np.zeros_like(x)
+    errors = np.ones_like(x)
+    mask = np.zeros(x.shape, dtype=bool)
+    for i, (hx, hy, he) in enumerate(columns):
+        n = len(hx)
+        x[i, :n], y[i, :n], errors[i, :n] = hx, hy, he
+        mask[i, :n] = (hy != 0) & (he != 0)
+    # masked bins only need to be a valid (finite) domain of the model
+    x[~mask] = 1.0
+    errors[~mask] = 1.0
+    return x, y, errors, mask
+
+
+def batch_fit(ModelClass, x, y, errors, mask=None, params=None, max_iter=200,
+              ftol=1.5e-8, xtol=1.5e-8):
+    """
+    Fit ModelClass to every row of y at once.
+
+    Parameters
+    ----------
+    ModelClass : type
+        Model providing the staticmethod gauss_partials (GaussianModel,
+        GaussianModelCoulomb or GaussianModelFSI)
+    x, y, errors : ndarray
+        Arrays of shape (nfits, nbins) of bin centers, correlation function
+        values and their errors
+    mask : ndarray of bool, optional
+        Bins to include in each fit; defaults to all bins with nonzero error
+    params : lmfit.Parameters, optional
+        Initial values, bounds and vary flags shared by all fits; defaults
+        to ModelClass.guess()
+    max_iter : int
+        Maximum number of Levenberg-Marquardt iterations
+    ftol : float
+        Relative change in chi-square at which a fit has converged
+    xtol : float
+        Relative change in the varying parameters at which a fit has
+        converged; both tolerances must be met by an accepted step
+    """
+    x, y, errors = (np.atleast_2d(np.asarray(a, dtype=np.float64)) for a in (x, y, errors))
+    if mask is None:
+        mask = errors != 0
+    if params is None:
+        params = ModelClass.guess()
+    nfits = y.shape[0]
+
+    vary = [name for name in PARAM_NAMES if params[name].vary]
+    lower = np.array([-np.inf if params[n].min is None else params[n].min for n in vary])
+    upper = np.array([np.inf if params[n].max is None else params[n].max for n in vary])
+
+    values = np.tile([params[name].value for name in PARAM_NAMES], (nfits, 1))
+    cols = [PARAM_NAMES.index(name) for name in vary]
+    weights = np.where(mask, 1.0 / np.where(mask, errors, 1.0), 0.0)
+
+    def evaluate(values):
+        args = {name: values[:, i, None] for i, name in enumerate(PARAM_NAMES)}
+        model, partials = ModelClass.gauss_partials(x, **args)
+        resid = (model - y) * weights
+        jac = np.stack([np.broadcast_to(partials[name], y.shape) for name in vary], axis=-1)
+        jac = jac * weights[..., None]
+        return resid, jac
+
+    resid, jac = evaluate(values)
+    chisqr = np.einsum('ij,ij->i', resid, resid)
+    damping = np.full(nfits, 1e-3)
+    active = np.ones(nfits, dtype=bool)
+    success = np.zeros(nfits, dtype=bool)
+    niter = np.zeros(nfits, dtype=int)
+    eye = np.eye(len(vary))
+
+    for _ in range(max_iter):
+        if not active.any():
+            break
+        niter[active] += 1
+        jtj = np.einsum('ijk,ijl->ikl', jac[active], jac[active])
+        jtr = np.einsum('ijk,ij->ik', jac[active], resid[active])
+        diag = np.einsum('ikk->ik', jtj)
+        lhs = jtj + damping[active, None, None] * diag[:, :, None] * eye
+        # pseudo-inverse, so a degenerate fit (e.g. no valid bins) cannot stop the others
+        step = -(np.linalg.pinv(lhs) @ jtr[..., None])[..., 0]
+
+        trial = values.copy()
+        trial[np.ix_(active, cols)] = np.clip(values[np.ix_(active, cols)] + step, lower, upper)
+        trial_resid, trial_jac = evaluate(trial)
+        trial_chisqr = np.einsum('ij,ij->i', trial_resid, trial_resid)
+
+        accept = active & (trial_chisqr <= chisqr)
+        # a rejected (or heavily damped) step barely moves, so only an
+        # accepted step which changes neither chi-square nor the parameters
+        # marks a fit as converged
+        dx = np.linalg.norm(trial[:, cols] - values[:, cols], axis=1)
+        xnorm = np.linalg.norm(values[:, cols], axis=1)
+        converged = (accept
+                     & (np.abs(chisqr - trial_chisqr) <= ftol * chisqr)
+                     & (dx <= xtol * (xnorm + xtol)))
+        success |= converged
+
+        values[accept] = trial[accept]
+        resid[accept] = trial_resid[accept]
+        jac[accept] = trial_jac[accept]
+        chisqr[accept] = trial_chisqr[accept]
+        damping = np.where(accept, damping / 10, damping * 10)
+
+        # stop fits whose chi-square no longer changes (or cannot be improved)
+        active &= ~converged & (damping < 1e16)
+
+    ndata = mask.sum(axis=1)
+    redchi = chisqr / np.maximum(ndata - len(vary), 1)
+    jtj = np.einsum('ijk,ijl->ikl', jac, jac)
+    with np.errstate(invalid='ignore'):
+        covar = np.linalg.pinv(jtj) * redchi[:, None, None]
+        errs = np.sqrt(np.einsum('ikk->ik', covar))
+
+    stderr = {name: np.full(nfits, np.nan) for name in PARAM_NAMES}
+    for i, name in enumerate(vary):
+        stderr[name] = errs[:, i]
+
+    return BatchFitResult(values={name: values[:, i] for i, name in enumerate(PARAM_NAMES)},
+                          stderr=stderr,
+                          covar=covar,
+                          chisqr=chisqr,
+                          ndata=ndata,
+                          var_names=tuple(vary),
+                          niter=niter,
+                          success=success)
+
+
+def batch_fit_histograms(ModelClass, histograms, fit_range, params=None, **kw):
+    """
+    Fit every 1D correlation function histogram (ratio with errors) in
+    fit_range; see stack_histograms and batch_fit.
+    """
+    x, y, errors, mask = stack_histograms(histograms, fit_range)
+    return batch_fit(ModelClass, x, y, errors, mask, params=params, **kw)
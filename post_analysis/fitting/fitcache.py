@@ -0,0 +1,266 @@
+#
+# post_analysis/fitting/fitcache.py
+#
+"""
+Persistent on-disk cache of fit results.
+
+A fit is identified by a hash of its input arrays (numerator/denominator
+or ratio, with errors and bin centers), the model class and the fit
+settings (fit range, normalization range, method ...). The fitted
+parameters with their errors and correlations, the covariance matrix and
+the fit statistics are stored as one small JSON file per fit, so that
+re-running a script after changing only its plotting or output options
+does not repeat any fit:
+
+    fit_cache = FitCache()
+    fit_res = fit_cache.fit(lambda: simple_fit(ratio),
+                            histogram_arrays(ratio), GaussianModelFSI,
+                            fit_range=(0, 0.16), method='chisqr')
+
+When the files exceed max_bytes, the least recently used are removed
+until they fill LOW_WATER of it. The size of the files is scanned once,
+then kept as a running total, so that storing a fit does not list the
+directory.
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+from lmfit import Parameters
+from lmfit.minimizer import MinimizerResult
+
+DEFAULT_DIRECTORY = os.path.join('~', '.cache', 'pipi_analysis', 'fits')
+
+# fit statistics stored alongside the parameters
+RESULT_FIELDS = ('method', 'var_names', 'nfev', 'ndata', 'nvarys', 'nfree',
+                 'chisqr', 'redchi', 'aic', 'bic', 'success', 'errorbars', 'message')
+
+
+def histogram_arrays(*hists):
+    """Return list of the data, errors and bin centers of 1D histograms"""
+    return [a for h in hists for a in (h.data, h.errors, h.x_axis.bin_centers)]
+
+
+def _to_builtin(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (list, tuple)):
+        return [_to_builtin(v) for v in value]
+    return value
+
+
+def result_to_dict(result):
+    """Return the JSON-serializable contents of an lmfit MinimizerResult"""
+    entry = {name: _to_builtin(getattr(result, name, None)) for name in RESULT_FIELDS}
+    entry['params'] = [[p.name, float(p.value), p.vary, p.min, p.max, p.expr,
+                        _to_builtin(p.stderr),
+                        None if p.correl is None else {k: float(v) for k, v in p.correl.items()}]
+                       for p in result.params.values()]
+    covar = getattr(result, 'covar', None)
+    entry['covar'] = None if covar is None else np.asarray(covar).tolist()
+    return entry
+
+
+def result_from_dict(entry):
+    """Rebuild the MinimizerResult stored by result_to_dict"""
+    params = Parameters()
+    for name, value, vary, pmin, pmax, expr, stderr, correl in entry['params']:
+        params.add(name, value=value, vary=vary, min=pmin, max=pmax)
+        params[name].stderr = stderr
+        params[name].correl = correl
+    # constraints are added once all parameters exist
+    for name, _, _, _, _, expr, _, _ in entry['params']:
+        if expr is not None:
+            params[name].expr = expr
+
+    fields = {name: entry.get(name) for name in RESULT_FIELDS}
+    covar = entry['covar']
+    result = MinimizerResult(params=params,
+                             covar=None if covar is None else np.array(covar),
+                             init_vals=[],
+                             **fields)
+    result.cached = True
+    return result
+
+
+class FitCache:
+    """
+    Directory of fit results keyed by content (see FitCache.key).
+
+    Parameters
+    ----------
+    directory : str, optional
+        Location of the cache files; defaults to DEFAULT_DIRECTORY
+    max_bytes : int
+        Total size of the files above which the least recently used are
+        removed
+    enabled : bool
+        If False nothing is read or written, and every fit is run
+    """
+
+    VERSION = 1
+    SUFFIX = '.fit.json'
+
+    # fraction of max_bytes left after an eviction
+    LOW_WATER = 0.75
+
+    def __init__(self, directory=None, max_bytes=64 * 1024 ** 2, enabled=True):
+        if directory is None:
+            directory = DEFAULT_DIRECTORY
+        self.directory = os.path.expanduser(directory)
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        # total size of the files, None until the directory is scanned
+        self._nbytes = None
+
+    @classmethod
+    def key(cls, arrays, model, **settings):
+        """
+        Return the hex digest identifying a fit of the given arrays by the
+        model class (or name) with settings (JSON-serializable values)
+        """
+        digest = hashlib.blake2b(digest_size=20)
+        if isinstance(model, type):
+            model = "%s.%s" % (model.__module__, model.__qualname__)
+        header = json.dumps([cls.VERSION, model, _to_builtin(settings)], sort_keys=True)
+        digest.update(header.encode())
+        for array in arrays:
+            array = np.ascontiguousarray(array)
+            digest.update(("%s%s" % (array.shape, array.dtype.str)).encode())
+            digest.update(array.data)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def get(self, key):
+        """
+        Return the cached MinimizerResult of key, or None, counting the
+        lookup as a hit or a miss
+        """
+        result = self._load(key)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def _load(self, key):
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            with open(path) as entry_file:
+                entry = json.load(entry_file)
+        except (OSError, ValueError):
+            return None
+        if entry.get('version') != self.VERSION:
+            return None
+        try:
+            # mark as recently used
+            os.utime(path)
+        except OSError:
+            pass
+        return result_from_dict(entry)
+
+    def put(self, key, result):
+        """
+        Store a MinimizerResult under key. Failure to write is not an error.
+        """
+        if not self.enabled:
+            return
+        entry = dict(result_to_dict(result), version=self.VERSION)
+        path = self._path(key)
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        if self._nbytes is None:
+            self._nbytes = sum(size for _, size, _ in self._entries())
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp_path, 'w') as entry_file:
+                json.dump(entry, entry_file)
+            size = os.path.getsize(tmp_path)
+            try:
+                replaced = os.stat(path).st_size
+            except OSError:
+                replaced = 0
+            os.replace(tmp_path, path)
+        except OSError:
+            return
+        self._nbytes += size - replaced
+        if self._nbytes > self.max_bytes:
+            self._evict(self.LOW_WATER * self.max_bytes)
+
+    def fit(self, fitter, arrays, model, **settings):
+        """
+        Return the cached result of the fit identified by arrays, model and
+        settings (see key), calling fitter() and storing its result on a
+        miss.
+        """
+        key = self.key(arrays, model, **settings)
+        result = self.get(key)
+        if result is not None:
+            return result
+        result = fitter()
+        self.put(key, result)
+        return result
+
+    def _entries(self):
+        """Return list of (mtime, size, path) of the cache files"""
+        entries = []
+        try:
+            files = os.scandir(self.directory)
+        except OSError:
+            return entries
+        with files:
+            for f in files:
+                if f.name.endswith(self.SUFFIX):
+                    try:
+                        stat = f.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, f.path))
+        return entries
+
+    def _evict(self, limit=None):
+        """
+        Remove the least recently used files until their total size is
+        at most limit (default max_bytes). This is the only place, besides
+        the first put, where the directory is listed; it also corrects the
+        running total for files written by other processes.
+        """
+        if limit is None:
+            limit = self.max_bytes
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        # never remove the newest entry
+        for _, size, path in entries[:-1]:
+            if total <= limit:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        self._nbytes = total
+
+    def clear(self):
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._nbytes = 0
+
+    def stats(self):
+        """Return dict of hit/miss counters and disk usage"""
+        entries = self._entries()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(entries),
+            'nbytes': sum(size for _, size, _ in entries),
+            'max_bytes': self.max_bytes,
+        }
@@ -5,14 +5,120 @@
 Provides a gaussian fitting model.
 """
 
+import hashlib
 import numpy as np
+from functools import wraps
+from collections import OrderedDict
 from lmfit import Model, Parameters
 from pionpion.fit import fitfunc_qinv_gauss
 
 HBAR_C = 0.1973269788 # GeV·fm
 
 
-class GaussianModel(Model):
+def memoize_by_array(maxsize=64):
+    """
+    Decorator caching the results of a function of a single array by the
+    array's contents (shape, dtype and a hash of its bytes). The least
+    recently used results are evicted once maxsize are stored. Results are
+    returned read-only, as they are shared between callers.
+
+    Used for the q-dependent (parameter independent) correction factors of
+    the models, which are otherwise recomputed in every fit iteration on
+    the same bin centers.
+    """
+    def decorator(func):
+        cache = OrderedDict()
+
+        @wraps(func)
+        def wrapper(x):
+            x = np.asarray(x)
+            key = (x.shape, x.dtype.str,
+                   hashlib.blake2b(np.ascontiguousarray(x).data, digest_size=16).digest())
+            try:
+                result = cache[key]
+            except KeyError:
+                wrapper.misses += 1
+                result = np.asarray(func(x))
+                result.setflags(write=False)
+                cache[key] = result
+                if len(cache) > maxsize:
+                    cache.popitem(last=False)
+            else:
+                wrapper.hits += 1
+                cache.move_to_end(key)
+            return result
+
+        def cache_clear():
+            cache.clear()
+            wrapper.hits = wrapper.misses = 0
+
+        wrapper.hits = wrapper.misses = 0
+        wrapper.cache_clear = cache_clear
+        return wrapper
+    return decorator
+
+
+class AnalyticJacobian:
+    """
+    Mixin providing the Jacobians of the as_resid and as_loglike residual
+    arrays, for use as the `Dfun` argument of lmfit.minimize:
+
+        minimize(Model.as_resid, params, args=args, Dfun=Model.as_resid_jacobian)
+
+    Subclasses implement the staticmethod `gauss_partials(x, radius, lam,
+    norm)`, returning the model and a dict of its partial derivatives by
+    parameter name. Columns of the Jacobians are the varying parameters,
+    in the order lmfit stores them.
+    """
+
+    @staticmethod
+    def _vary_columns(p, partials):
+        return np.column_stack([partials[name]
+                                for name, par in p.items() if par.vary])
+
+    @classmethod
+    def _partials(cls, p, q_inv):
+        return cls.gauss_partials(q_inv, **{k: p[k].value for k in ('radius', 'lam', 'norm')})
+
+    @classmethod
+    def as_resid_jacobian(cls, p, q_inv, ratio, errs):
+        """
+        Jacobian of as_resid: d|model - ratio| / err
+        """
+        model, partials = cls._partials(p, q_inv)
+        scale = np.sign(model - ratio) / np.abs(errs)
+        return cls._vary_columns(p, {k: v * scale for k, v in partials.items()})
+
+    @classmethod
+    def as_loglike_jacobian(cls, p, q_inv, num, den):
+        """
+        Jacobian of as_loglike: -2 (A / C - (A + B) / (C + 1)) dC
+        """
+        skip_zeros = (den != 0.0) & (num != 0.0)
+        A, B = num[skip_zeros], den[skip_zeros]
+        C, partials = cls._partials(p, q_inv[skip_zeros])
+
+        scale = -2 * (A / C - (A + B) / (C + 1))
+        return cls._vary_columns(p, {k: v * scale for k, v in partials.items()})
+
+
+def _fsi_gauss_partials(x, f, radius, lam, norm):
+    """
+    Model norm * ((1 - lam) + f * lam * (1 + exp(-(x R / ħc)^2))) and its
+    partial derivatives, given the final-state-interaction factor f
+    """
+    e = np.exp((-(x * radius / HBAR_C) ** 2).astype(np.float64))
+    fsi = f * (1.0 + e)
+    model = norm * ((1.0 - lam) + lam * fsi)
+    partials = {
+        'norm': (1.0 - lam) + lam * fsi,
+        'lam': norm * (fsi - 1.0),
+        'radius': norm * lam * f * e * (-2 * x ** 2 * radius / HBAR_C ** 2),
+    }
+    return model, partials
+
+
+class GaussianModel(Model, AnalyticJacobian):
     """
     Model of a 'simple' Gaussian fit to a 1D femtoscopic
     correlation function. This includes the parameters norm,
@@ -24,6 +130,17 @@ class GaussianModel(Model):
         epart = -(x * radius / HBAR_C) ** 2
         return norm * (1.0 + lam * np.exp(epart.astype(float)))
 
+    @staticmethod
+    def gauss_partials(x, radius, lam, norm):
+        e = np.exp((-(x * radius / HBAR_C) ** 2).astype(float))
+        model = norm * (1.0 + lam * e)
+        partials = {
+            'norm': 1.0 + lam * e,
+            'lam': norm * e,
+            'radius': norm * lam * e * (-2 * x ** 2 * radius / HBAR_C ** 2),
+        }
+        return model, partials
+
     def __init__(self, *args, **kwargs):
         super().__init__(GaussianModel.gauss, *args, **kwargs)
 
@@ -114,7 +231,7 @@ class GaussianModel2D(Model):
         super().__init__(self.gauss, *args, **kwargs)
 
 
-class GaussianModelCoulomb(Model):
+class GaussianModelCoulomb(Model, AnalyticJacobian):
     """
     Femtoscopic model incorporating quantum statistics and Coulomb FSI.
     """
@@ -127,9 +244,22 @@ class GaussianModelCoulomb(Model):
         $$a_{\pi} = \pm 387.5fm$$
         """
         epart = -(x * radius / HBAR_C) ** 2
-        f = np.nan_to_num(GaussianModelCoulomb.gammow(x))
+        f = GaussianModelCoulomb.fsi_factor(x)
         return norm * ((1.0 - lam) + f * lam * (1.0 + np.exp(epart.astype(np.float64))))
 
+    @staticmethod
+    def gauss_partials(x, radius, lam, norm):
+        f = GaussianModelCoulomb.fsi_factor(x)
+        return _fsi_gauss_partials(x, f, radius, lam, norm)
+
+    @staticmethod
+    @memoize_by_array()
+    def fsi_factor(x):
+        """
+        Coulomb correction factor at each q - the (finite) Gamow factor
+        """
+        return np.nan_to_num(GaussianModelCoulomb.gammow(x))
+
     @staticmethod
     def gammow(q):
         eta = HBAR_C / (q * 387.5)
@@ -171,7 +301,7 @@ class GaussianModelCoulomb(Model):
         return resid
 
 
-class GaussianModelFSI(Model):
+class GaussianModelFSI(Model, AnalyticJacobian):
     """
     Femtoscopic model incorporating quantum statistics and Coulomb FSI.
     """
@@ -194,9 +324,22 @@ class GaussianModelFSI(Model):
             x, = x
         epart = -(x * radius / HBAR_C) ** 2
         exp_factor = 1.0 + np.exp(epart.astype(np.float64))
-        fsi_factor = GaussianModelFSI.CC(x)
+        fsi_factor = GaussianModelFSI.fsi_factor(x)
         return norm * ((1.0 - lam) + lam * fsi_factor * exp_factor)
 
+    @staticmethod
+    def gauss_partials(x, radius, lam, norm):
+        if np.shape(x)[0] == 1:
+            x, = x
+        return _fsi_gauss_partials(x, GaussianModelFSI.fsi_factor(x), radius, lam, norm)
+
+    @staticmethod
+    @memoize_by_array()
+    def fsi_factor(x):
+        """
+        Final state interaction factor at each q, interpolated from CC
+        """
+        return GaussianModelFSI.CC(x)
 
     def __init__(self, *args, **kwargs):
         super().__init__(self.gauss, *args, **kwargs)
@@ -8,7 +8,9 @@ Gaussian 3d
 
 import numpy as np
 from lmfit import Model, Parameters
-from ..pionpion.fit import fitfunc_qinv_gauss
+from pionpion.fit import fitfunc_qinv_gauss
+
+from .objective import Gauss3DResidual, Gauss3DLogLikelihood
 
 HBAR_C = 0.1973269788 # GeV·fm
 
@@ -54,7 +56,6 @@ class Gaussian3dModel(Model):
 
         """
         epart = - ((q[:, 0] * r_o) ** 2 + (q[:, 1] * r_s) ** 2 + (q[:, 2] * r_l) ** 2) / HBAR_C ** 2
-        print('fitting:', epart[100:110], q.shape, r_o, r_s, r_l)
         return norm * (1.0 + lam * np.exp(epart.astype(float)))
 
     def __init__(self, *args, **kwargs):
@@ -62,7 +63,7 @@ class Gaussian3dModel(Model):
 
     @classmethod
     def as_chisqr(cls, params, q_inv, ratio, errs):
-        model = cls.gauss(q_inv, **p)
+        model = cls.gauss(q_inv, **params)
         res = np.sqrt(((ratio - model) ** 2 / errs ** 2).astype(np.float64))
         return res
 
@@ -81,6 +82,27 @@ class Gaussian3dModel(Model):
         resid = -2 * (A * log1  + B * log2)
         return resid
 
+    @staticmethod
+    def chisqr_objective(q, ratio, errs, dtype=np.float64):
+        """
+        Return the chi-square residual bound to the bins (see
+        fitting.objective.Gauss3DResidual), evaluated in the floating point
+        type dtype - np.float32 for large histograms (validate the
+        results with fitting.precision.compare_precision)
+        """
+        return Gauss3DResidual(q, ratio, errs, radii=('r_o', 'r_s', 'r_l'), dtype=dtype)
+
+    @staticmethod
+    def loglike_objective(q, num, den, scalar=False):
+        """
+        Return the log-likelihood objective bound to the bins (see
+        fitting.objective.Gauss3DLogLikelihood) - all parameter independent
+        terms are computed once, so prefer it to as_loglike for fits:
+
+            minimize(Gaussian3dModel.loglike_objective(q, num, den), params)
+        """
+        return Gauss3DLogLikelihood(q, num, den, radii=('r_o', 'r_s', 'r_l'), scalar=scalar)
+
 
     @classmethod
     def get_chisquared(cls, params, q_inv, num, den):
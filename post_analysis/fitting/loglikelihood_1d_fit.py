@@ -2,6 +2,7 @@
 # loglikelihood_1d_fit.py
 #
 
+import numpy as np
 from .gaussian import GaussianModelFSI
 from lmfit import minimize, report_fit
 
@@ -20,8 +21,9 @@ def gauss(num, den, *, fit_range=(0.0, 0.17), model=GaussianModelFSI):
 
     params = model.guess()
     # fitres = GaussianModelFSI.as_loglike(params, q, num, den)
-    fitres = minimize(model.as_loglike, params, args=(q, num, den))
+    fitres = minimize(model.as_loglike, params, args=(q, num_slice, den_slice),
+                      Dfun=model.as_loglike_jacobian)
     report_fit(fitres)
 
-    FIT_X = np.linspace(x[0], x[-1], 300)
-    FIT_Y = model().eval(qinv_fit.params, x=FIT_X)
+    FIT_X = np.linspace(q[0], q[-1], 300)
+    FIT_Y = model().eval(fitres.params, x=FIT_X)
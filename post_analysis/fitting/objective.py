@@ -0,0 +1,274 @@
+#
+# post_analysis/fitting/objective.py
+#
+"""
+Fit objectives bound to a fixed domain.
+
+Each objective is constructed once per fit with the data to be fitted:
+bins which cannot contribute (zero errors, empty numerator or denominator)
+are dropped, and every quantity not depending on the fit parameters (q^2,
+inverse errors, final-state-interaction factors, log-likelihood constants)
+is computed up front. Calls evaluate the residual with `out=` into
+preallocated work buffers, so the only allocation per evaluation is the
+returned copy (scipy's leastsq keeps references to previously returned
+residuals, so they may not be reused).
+
+Objectives are called with the lmfit parameters only:
+
+    objective = QinvResidual(GaussianModelFSI, q, ratio, errors)
+    minimize(objective, params, Dfun=objective.jacobian)
+"""
+
+import numpy as np
+from scipy.special import xlogy
+
+from pionpion.fit import HBAR_C
+
+
+class BoundObjective:
+    """
+    Base class holding the output work buffer of an objective
+    """
+
+    def __init__(self, size, dtype=np.float64):
+        self._out = np.empty(size, dtype=dtype)
+
+    def __len__(self):
+        return len(self._out)
+
+    def _output(self):
+        return self._out
+
+
+class QinvResidual(BoundObjective):
+    """
+    |model - ratio| / error of a 1D femtoscopic model (GaussianModel,
+    GaussianModelCoulomb or GaussianModelFSI), equivalent to the model's
+    as_resid over the bins with nonzero error.
+    """
+
+    def __init__(self, ModelClass, q_inv, ratio, errs):
+        mask = np.asarray(errs) != 0
+        self.ModelClass = ModelClass
+        self.q_inv = np.ascontiguousarray(q_inv[mask], dtype=np.float64)
+        self.ratio = np.ascontiguousarray(ratio[mask], dtype=np.float64)
+        self.errs = np.ascontiguousarray(errs[mask], dtype=np.float64)
+        self.mask = mask
+
+        self._q2 = self.q_inv ** 2 / HBAR_C ** 2
+        self._inv_errs = 1.0 / np.abs(self.errs)
+        fsi_factor = getattr(ModelClass, 'fsi_factor', None)
+        self._fsi = None if fsi_factor is None else np.asarray(fsi_factor(self.q_inv), dtype=np.float64)
+        self._model = np.empty_like(self.q_inv)
+        super().__init__(len(self.q_inv))
+
+    def model(self, p):
+        """
+        Evaluate the model into the work buffer (overwritten by each call)
+        """
+        radius, lam, norm = p['radius'].value, p['lam'].value, p['norm'].value
+        C = self._model
+        np.multiply(self._q2, -radius * radius, out=C)
+        np.exp(C, out=C)
+        if self._fsi is None:
+            # norm * (1 + lam * e)
+            C *= lam
+            C += 1.0
+        else:
+            # norm * ((1 - lam) + lam * fsi * (1 + e))
+            C += 1.0
+            C *= self._fsi
+            C *= lam
+            C += 1.0 - lam
+        C *= norm
+        return C
+
+    def __call__(self, p):
+        out = self._output()
+        np.subtract(self.model(p), self.ratio, out=out)
+        np.abs(out, out=out)
+        out *= self._inv_errs
+        return out.copy()
+
+    def jacobian(self, p):
+        """Jacobian of the residual (see AnalyticJacobian.as_resid_jacobian)"""
+        return self.ModelClass.as_resid_jacobian(p, self.q_inv, self.ratio, self.errs)
+
+
+class QinvLogLikelihood(QinvResidual):
+    """
+    Log-likelihood terms of a numerator/denominator pair, equivalent to the
+    model's as_loglike:
+
+        -2 (A ln(C (A + B) / (A (C + 1))) + B ln((A + B) / (B (C + 1))))
+          = -2 (A ln C - (A + B) ln(C + 1) + K)
+
+    where K = (A + B) ln(A + B) - A ln A - B ln B is computed once.
+    """
+
+    def __init__(self, ModelClass, q_inv, num, den):
+        num, den = np.asarray(num, dtype=np.float64), np.asarray(den, dtype=np.float64)
+        mask = (num != 0.0) & (den != 0.0)
+        A, B = num[mask], den[mask]
+        # reuse the model evaluation and buffers of the residual
+        super().__init__(ModelClass, q_inv[mask], A, np.ones_like(A))
+        self.mask = mask
+        self.num, self.den = A, B
+
+        self._sum = A + B
+        self._const = self._sum * np.log(self._sum) - A * np.log(A) - B * np.log(B)
+        self._log_c1 = np.empty_like(A)
+
+    def __call__(self, p):
+        out = self._output()
+        C = self.model(p)
+        np.log1p(C, out=self._log_c1)
+        self._log_c1 *= self._sum
+        np.log(C, out=out)
+        out *= self.num
+        out -= self._log_c1
+        out += self._const
+        out *= -2.0
+        return out.copy()
+
+    def jacobian(self, p):
+        """Jacobian of the terms (see AnalyticJacobian.as_loglike_jacobian)"""
+        return self.ModelClass.as_loglike_jacobian(p, self.q_inv, self.num, self.den)
+
+
+class Gauss3DResidual(BoundObjective):
+    """
+    |model - ratio| / error of the 3D Gaussian (see pionpion.fit.fitfunc_3d)
+    over the bins with nonzero error.
+
+    The names of the out, side and long radius parameters are given by
+    radii (Gaussian3dModel uses ('r_o', 'r_s', 'r_l')).
+
+    With dtype=np.float32 the data and work buffers are single precision,
+    halving the memory traffic of each evaluation; the residual is returned
+    as float64. The finite difference steps of leastsq must then be larger
+    than float32 resolution - pass the objective's epsfcn:
+
+        minimize(objective, params, epsfcn=objective.epsfcn)
+    """
+
+    RADII = ('r_out', 'r_side', 'r_long')
+
+    def __init__(self, q, ratio, errs, radii=None, dtype=np.float64):
+        mask = np.asarray(errs) != 0
+        self.mask = mask
+        self.ratio = np.ascontiguousarray(ratio[mask], dtype=dtype)
+        self._inv_errs = (1.0 / np.abs(errs[mask])).astype(dtype)
+        self._bind_q(q, mask, radii, dtype)
+
+    def _bind_q(self, q, mask, radii, dtype=np.float64):
+        q = np.asarray(q, dtype=np.float64)
+        if q.shape[-1] == 3:
+            q = q.T
+        if radii is not None:
+            self.RADII = tuple(radii)
+        self.dtype = np.dtype(dtype)
+        # (q / ħc)^2 of each component, contiguous per component
+        self._q2 = np.ascontiguousarray((q[:, mask] / HBAR_C) ** 2, dtype=dtype)
+        size = self._q2.shape[1]
+        self._model = np.empty(size, dtype=dtype)
+        self._tmp = np.empty(size, dtype=dtype)
+        BoundObjective.__init__(self, size, dtype)
+
+    @property
+    def epsfcn(self):
+        """Relative error of the evaluation (leastsq's epsfcn)"""
+        return float(np.finfo(self.dtype).eps)
+
+    def model(self, p):
+        """
+        Evaluate the model into the work buffer (overwritten by each call)
+        """
+        out = self._model
+        r_out, r_side, r_long = (p[name].value for name in self.RADII)
+        tmp = self._tmp
+        np.multiply(self._q2[0], -r_out * r_out, out=out)
+        np.multiply(self._q2[1], r_side * r_side, out=tmp)
+        out -= tmp
+        np.multiply(self._q2[2], r_long * r_long, out=tmp)
+        out -= tmp
+        np.exp(out, out=out)
+        out *= p['lam'].value
+        out += 1.0
+        out *= p['norm'].value
+        return out
+
+    def __call__(self, p):
+        out = self._output()
+        np.subtract(self.model(p), self.ratio, out=out)
+        np.abs(out, out=out)
+        out *= self._inv_errs
+        return out.astype(np.float64)
+
+
+class Gauss3DLogLikelihood(Gauss3DResidual):
+    """
+    Log-likelihood of a 3D numerator/denominator pair given the 3D Gaussian
+    correlation function C (the ratio of Poisson means):
+
+        d = -2 (A ln(C (A + B) / (A (C + 1))) + B ln((A + B) / (B (C + 1))))
+          = -2 (A ln C - (A + B) ln(C + 1) + K)
+
+    with K = (A + B) ln(A + B) - A ln A - B ln B (0 ln 0 = 0) computed once.
+    Each d is non-negative (a deviance), so the residual of each bin is
+    sign(C B - A) sqrt(d): lmfit's sum of squared residuals is then the
+    -2 log-likelihood ratio itself. If scalar is True, calls instead
+    return that sum, for scalar minimizers.
+
+    Only bins with A + B > 0 contribute; bins with an empty numerator must
+    be kept (use Q3D.fit_domain(exclude_zero_error=False)). Evaluation is
+    always in float64, as the terms are small differences of large
+    numbers.
+    """
+
+    def __init__(self, q, num, den, radii=None, scalar=False):
+        num, den = np.asarray(num, dtype=np.float64), np.asarray(den, dtype=np.float64)
+        mask = (num + den) > 0
+        self.mask = mask
+        self.scalar = scalar
+        self.num, self.den = np.ascontiguousarray(num[mask]), np.ascontiguousarray(den[mask])
+        self._sum = self.num + self.den
+        self._const = (xlogy(self._sum, self._sum)
+                       - xlogy(self.num, self.num)
+                       - xlogy(self.den, self.den))
+        self._log_c = np.empty(len(self.num))
+        self._bind_q(q, mask, radii)
+
+    @classmethod
+    def from_domain(cls, domain, **kw):
+        """Bind to the bins of a pionpion.q3d.FitDomain"""
+        return cls(domain.q, domain.num, domain.den, **kw)
+
+    def deviance(self, p):
+        """Return the terms d of each bin (in a work buffer)"""
+        C = self.model(p)
+        out = self._tmp
+        np.log1p(C, out=out)
+        out *= self._sum
+        log_c = self._log_c
+        np.log(C, out=log_c)
+        log_c *= self.num
+        np.subtract(log_c, out, out=out)
+        out += self._const
+        out *= -2.0
+        # rounding can make terms of well-described bins slightly negative
+        np.maximum(out, 0.0, out=out)
+        return out
+
+    def __call__(self, p):
+        d = self.deviance(p)
+        if self.scalar:
+            return d.sum()
+        out = self._output()
+        np.sqrt(d, out=out)
+        # the sign of C - A / B
+        C = self._model
+        np.multiply(C, self.den, out=self._log_c)
+        self._log_c -= self.num
+        np.copysign(out, self._log_c, out=out)
+        return out.copy()
@@ -0,0 +1,84 @@
+#
+# post_analysis/fitting/precision.py
+#
+"""
+Validation of reduced precision (float32) 3D fits against float64.
+
+The same data is fitted with a Gauss3DResidual evaluated in float64 and in
+the reduced type, and the relative deviation of each fitted radius is
+compared with a tolerance:
+
+    check = compare_precision(domain.q, domain.ratio, domain.errors, params)
+    print(check.report())
+    assert check.ok
+"""
+
+import time
+import numpy as np
+from collections import namedtuple
+from lmfit import minimize
+
+from .objective import Gauss3DResidual
+
+
+class PrecisionCheck(namedtuple('PrecisionCheck', [
+        'reference', 'reduced', 'deviation', 'tolerance', 'times'])):
+    """
+    Result of compare_precision.
+
+    reference, reduced : MinimizerResult
+        The float64 and reduced precision fits
+    deviation : dict
+        Relative deviation of each radius from the float64 value
+    tolerance : float
+        The largest allowed relative deviation
+    times : (float, float)
+        Time taken by the float64 and reduced precision fits (seconds)
+    """
+
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return all(d <= self.tolerance for d in self.deviation.values())
+
+    def report(self):
+        lines = ["%-8s %12s %12s %10s %8s" % ('param', 'float64', 'reduced', 'rel.dev', 'σ')]
+        for name, dev in self.deviation.items():
+            ref, red = self.reference.params[name], self.reduced.params[name]
+            sigma = abs(red.value - ref.value) / ref.stderr if ref.stderr else float('nan')
+            lines.append("%-8s %12.6f %12.6f %10.2e %8.3f" % (name, ref.value, red.value, dev, sigma))
+        lines.append("fit time %0.3fs (float64) %0.3fs (reduced) - %s (tolerance %g)"
+                     % (self.times + ('ok' if self.ok else 'FAILED', self.tolerance)))
+        return "\n".join(lines)
+
+
+def compare_precision(q, ratio, errs, params, dtype=np.float32, tolerance=1e-3,
+                      radii=Gauss3DResidual.RADII):
+    """
+    Fit ratio in float64 and in dtype, and compare the fitted radii.
+
+    Parameters
+    ----------
+    q, ratio, errs : ndarray
+        The bins to fit (see Gauss3DResidual)
+    params : lmfit.Parameters
+        Starting parameters of both fits
+    dtype : numpy dtype
+        The reduced precision type to validate
+    tolerance : float
+        Largest allowed relative deviation of a radius from its float64 value
+    radii : tuple of str
+        Names of the radius parameters
+    """
+    fits, times = [], []
+    for fit_dtype in (np.float64, dtype):
+        objective = Gauss3DResidual(q, ratio, errs, radii=radii, dtype=fit_dtype)
+        start = time.monotonic()
+        fits.append(minimize(objective, params.copy(), epsfcn=objective.epsfcn))
+        times.append(time.monotonic() - start)
+
+    reference, reduced = fits
+    deviation = {name: abs(reduced.params[name].value / reference.params[name].value - 1.0)
+                 for name in radii}
+    return PrecisionCheck(reference, reduced, deviation, tolerance, tuple(times))
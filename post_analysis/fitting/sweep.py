@@ -0,0 +1,209 @@
+#
+# post_analysis/fitting/sweep.py
+#
+"""
+Warm-started fitting of a sweep of correlation functions over kT and
+centrality bins.
+
+Fits are run ordered by centrality then kT, each starting from the
+converged parameters of its nearest already finished neighbour (in bin
+index distance, preferring the same centrality) rather than from the
+model's default guess. A fit which does not converge from its seed is
+repeated from the default guess.
+
+Every sweep reports its function evaluations split between warm-started
+fits and fits from the default guess (SweepResult.report). Comparing
+against a sweep entirely from the default guess is a separate benchmark,
+measure_cold_start, as it repeats every fit.
+"""
+
+import numpy as np
+from collections import OrderedDict, namedtuple
+
+
+class SweepTask(namedtuple('SweepTask', ['key', 'centrality', 'kt', 'fit'])):
+    """
+    A fit in a sweep.
+
+    key : hashable
+        Identifies the fit in the results
+    centrality, kt : float or (float, float)
+        Position of the fit - a bin range is reduced to its midpoint
+    fit : callable
+        Called with lmfit Parameters (the starting values) and returns the
+        lmfit MinimizerResult of the fit
+    """
+
+    __slots__ = ()
+
+
+class SweepResult(namedtuple('SweepResult', [
+        'results', 'seeds', 'fallbacks', 'nfev', 'warm_nfev', 'cold_nfev'])):
+    """
+    Results of fit_sweep.
+
+    results : OrderedDict
+        MinimizerResult of each task by key, in task order
+    seeds : dict
+        Key of the neighbour each fit was seeded from (None for the default)
+    fallbacks : list
+        Keys of fits repeated from the default guess
+    nfev : int
+        Total function evaluations of the sweep, including fallbacks
+    warm_nfev : int
+        Function evaluations of the fits started from a neighbour's result,
+        including those rejected (and repeated as fallbacks)
+    cold_nfev : int or None
+        Total function evaluations with every fit started from the default
+        guess, if benchmarked (see measure_cold_start)
+    """
+
+    __slots__ = ()
+
+    @property
+    def nwarm(self):
+        """Number of fits started from a neighbour's result"""
+        return sum(seed is not None for seed in self.seeds.values())
+
+    @property
+    def ndefault(self):
+        """Number of fits started from the default guess, fallbacks included"""
+        return len(self.results) - self.nwarm + len(self.fallbacks)
+
+    @property
+    def nfev_saved(self):
+        if self.cold_nfev is None:
+            return None
+        return self.cold_nfev - self.nfev
+
+    def report(self):
+        lines = ["sweep: %d fits, %d function evaluations, %d fallback(s) to default guess"
+                 % (len(self.results), self.nfev, len(self.fallbacks))]
+        default_nfev = self.nfev - self.warm_nfev
+        lines.append("  warm-started: %d fits, %d evaluations (%0.1f per fit); "
+                     "from default guess: %d fits, %d evaluations (%0.1f per fit)"
+                     % (self.nwarm, self.warm_nfev, self.warm_nfev / max(self.nwarm, 1),
+                        self.ndefault, default_nfev, default_nfev / max(self.ndefault, 1)))
+        if self.cold_nfev is not None:
+            lines.append("  %d evaluations from the default guess - saved %d (%0.1f%%)"
+                         % (self.cold_nfev, self.nfev_saved,
+                            100.0 * self.nfev_saved / max(self.cold_nfev, 1)))
+        return "\n".join(lines)
+
+
+def _midpoint(value):
+    return float(np.mean(value))
+
+
+def _ranks(values):
+    """Map each distinct value to its index in sorted order"""
+    return {v: i for i, v in enumerate(sorted(set(values)))}
+
+
+def sweep_order(tasks):
+    """
+    Return tasks sorted by centrality then kT, and a function returning
+    the (centrality, kT) bin indices of a task
+    """
+    cent_rank = _ranks(_midpoint(t.centrality) for t in tasks)
+    kt_rank = _ranks(_midpoint(t.kt) for t in tasks)
+
+    def position(task):
+        return cent_rank[_midpoint(task.centrality)], kt_rank[_midpoint(task.kt)]
+
+    return sorted(tasks, key=position), position
+
+
+def converged(result):
+    """
+    Return whether a fit result may be used (and a seed for neighbours):
+    the minimizer succeeded and all parameters and errors are finite
+    """
+    if not result.success or not getattr(result, 'errorbars', True):
+        return False
+    return all(np.isfinite(p.value) and (p.stderr is None or np.isfinite(p.stderr))
+               for p in result.params.values())
+
+
+def seed_params(guess, result):
+    """
+    Copy of the guess parameters with the values of the varying
+    parameters taken from a previous fit result
+    """
+    params = guess.copy()
+    for name, param in params.items():
+        if param.vary and name in result.params:
+            value = result.params[name].value
+            if param.min is not None:
+                value = max(value, param.min)
+            if param.max is not None:
+                value = min(value, param.max)
+            param.value = value
+    return params
+
+
+def fit_sweep(tasks, guess, is_converged=converged):
+    """
+    Run every task, warm-starting each from its nearest finished neighbour.
+
+    Parameters
+    ----------
+    tasks : iterable of SweepTask
+        The fits to run
+    guess : lmfit.Parameters
+        Default starting parameters (e.g. GaussianModelFSI.guess()); used
+        for the first fit and as fallback
+    is_converged : callable
+        Predicate on a MinimizerResult deciding if the fit succeeded
+    """
+    tasks = list(tasks)
+    ordered, position = sweep_order(tasks)
+
+    results = {}
+    seeds = {}
+    fallbacks = []
+    finished = []
+    nfev = warm_nfev = 0
+
+    for task in ordered:
+        cent, kt = position(task)
+        neighbour = None
+        if finished:
+            # nearest in bin distance, preferring the same centrality
+            neighbour = min(finished,
+                            key=lambda f: (abs(f[1] - cent) + abs(f[2] - kt), abs(f[1] - cent)))
+
+        if neighbour is None:
+            result = task.fit(guess.copy())
+            nfev += result.nfev
+            seeds[task.key] = None
+        else:
+            result = task.fit(seed_params(guess, results[neighbour[0]]))
+            nfev += result.nfev
+            warm_nfev += result.nfev
+            seeds[task.key] = neighbour[0]
+            if not is_converged(result):
+                fallbacks.append(task.key)
+                result = task.fit(guess.copy())
+                nfev += result.nfev
+
+        results[task.key] = result
+        if is_converged(result):
+            finished.append((task.key, cent, kt))
+
+    return SweepResult(results=OrderedDict((t.key, results[t.key]) for t in tasks),
+                       seeds=seeds,
+                       fallbacks=fallbacks,
+                       nfev=nfev,
+                       warm_nfev=warm_nfev,
+                       cold_nfev=None)
+
+
+def measure_cold_start(sweep, tasks, guess):
+    """
+    Benchmark of warm starting: repeat every task from the default guess
+    and return sweep with cold_nfev set, so that its report includes the
+    function evaluations saved. This doubles the cost of the sweep.
+    """
+    cold_nfev = sum(task.fit(guess.copy()).nfev for task in tasks)
+    return sweep._replace(cold_nfev=cold_nfev)
@@ -0,0 +1,241 @@
+#
+# post_analysis/fitting/systematics.py
+#
+"""
+Systematic variation of the 1D (qinv) fits.
+
+Every analysis is fitted with every combination of the settings of a grid
+(fit range, normalization range and model). The numerator and denominator
+arrays of all analyses are read once and sent to each worker process
+once (by the pool initializer); tasks are then only (analysis name,
+variation) pairs. Results are a tidy table - one row per analysis and
+variation, variations which cannot be fitted (e.g. an empty normalization
+range) recorded as failed rows with their error - from which the spread of
+each parameter over the successful variations is summarized:
+
+    data = {analysis.name: qinv_arrays(analysis) for analysis in femtolist}
+    rows = run_systematics(data, variation_grid((0.12, 0.16), [(0.8, 1.1)]))
+    write_csv(rows, 'systematics.csv')
+    write_csv(spread(rows), 'systematics.spread.csv')
+"""
+
+import csv
+import itertools
+import numpy as np
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from lmfit import minimize
+
+from .gaussian import GaussianModel, GaussianModelCoulomb, GaussianModelFSI
+from .objective import QinvResidual
+
+MODELS = OrderedDict((cls.__name__, cls)
+                     for cls in (GaussianModel, GaussianModelCoulomb, GaussianModelFSI))
+
+PARAMETERS = ('radius', 'lam', 'norm')
+
+
+class Variation(namedtuple('Variation', ['model', 'fit_range', 'norm_range'])):
+    """
+    One set of fit settings: the name of the model (a key of MODELS), and
+    the (min, max) qinv ranges of the fit and of the normalization.
+    """
+
+    __slots__ = ()
+
+    def as_dict(self):
+        return OrderedDict([('model', self.model),
+                            ('fit_min', self.fit_range[0]),
+                            ('fit_max', self.fit_range[1]),
+                            ('norm_min', self.norm_range[0]),
+                            ('norm_max', self.norm_range[1])])
+
+
+def variation_grid(fit_maxes, norm_ranges, models=tuple(MODELS), fit_min=0.0):
+    """
+    Return list of the Variations of every combination of the settings;
+    the first is that of the first of each.
+    """
+    for model in models:
+        if model not in MODELS:
+            raise ValueError("Unknown model %r (expected one of %s)" % (model, ', '.join(MODELS)))
+    return [Variation(model, (fit_min, fit_max), tuple(norm_range))
+            for model, fit_max, norm_range in itertools.product(models, fit_maxes, norm_ranges)]
+
+
+def qinv_arrays(analysis):
+    """
+    Return copies of the bin centers, numerator and denominator contents
+    of an analysis' qinv histograms
+    """
+    num, den = analysis.qinv_pair
+    return (np.array(num.x_axis.bin_centers, dtype=np.float64),
+            np.array(num.data, dtype=np.float64),
+            np.array(den.data, dtype=np.float64))
+
+
+def normalized_ratio(x, num, den, norm_range):
+    """
+    Return the ratio num / den scaled to one in norm_range, and its errors
+    (zero where either histogram is empty)
+    """
+    in_norm = (norm_range[0] <= x) & (x <= norm_range[1])
+    num_sum, den_sum = num[in_norm].sum(), den[in_norm].sum()
+    if num_sum == 0 or den_sum == 0:
+        raise ValueError("Empty normalization range %s" % (norm_range, ))
+
+    filled = (num > 0) & (den > 0)
+    ratio = np.zeros_like(num)
+    errors = np.zeros_like(num)
+    ratio[filled] = num[filled] / den[filled] * (den_sum / num_sum)
+    errors[filled] = ratio[filled] * np.sqrt(1.0 / num[filled] + 1.0 / den[filled])
+    return ratio, errors
+
+
+def fit_variation(x, num, den, variation):
+    """Fit one analysis with the settings of variation; returns a table row"""
+    ModelClass = MODELS[variation.model]
+    ratio, errors = normalized_ratio(x, num, den, variation.norm_range)
+    in_fit = (variation.fit_range[0] <= x) & (x <= variation.fit_range[1])
+
+    objective = QinvResidual(ModelClass, x[in_fit], ratio[in_fit], errors[in_fit])
+    fit = minimize(objective, ModelClass.guess(), Dfun=objective.jacobian)
+
+    row = variation.as_dict()
+    for name in PARAMETERS:
+        param = fit.params[name]
+        row[name] = param.value
+        row[name + '_err'] = np.nan if param.stderr is None else param.stderr
+    row['chisqr'] = fit.chisqr
+    row['redchi'] = fit.redchi
+    row['ndata'] = fit.ndata
+    row['success'] = bool(fit.success)
+    row['error'] = '' if fit.success else fit.message
+    return row
+
+
+def failed_variation(variation, error):
+    """Return the table row of a variation which could not be fitted"""
+    row = variation.as_dict()
+    for name in PARAMETERS:
+        row[name] = np.nan
+        row[name + '_err'] = np.nan
+    row['chisqr'] = np.nan
+    row['redchi'] = np.nan
+    row['ndata'] = 0
+    row['success'] = False
+    row['error'] = str(error)
+    return row
+
+
+# arrays of every analysis, set by the pool initializer of a worker process
+_worker_data = None
+
+
+def _init_worker(data):
+    global _worker_data
+    _worker_data = data
+
+
+def _run(task):
+    name, variation = task
+    row = OrderedDict(analysis=name)
+    try:
+        row.update(fit_variation(*_worker_data[name], variation))
+    except Exception as err:
+        # e.g. LinAlgError, FloatingPointError or a minimizer error: only
+        # this variation fails, not the whole map
+        row.update(failed_variation(variation, repr(err)))
+    return row
+
+
+def run_systematics(data, variations, workers=None, chunksize=4):
+    """
+    Fit every analysis with every variation.
+
+    Parameters
+    ----------
+    data : dict
+        Map of analysis name to (x, num, den) arrays (see qinv_arrays)
+    variations : list of Variation
+        Settings of the fits (see variation_grid)
+    workers : int, optional
+        Number of processes; defaults to one per CPU, 1 fits in this process
+
+    Returns
+    -------
+    list of OrderedDict
+        One row per analysis and variation, ordered by analysis then
+        variation. A variation raising an exception does not stop the
+        others; its row has success False and the repr of the exception as
+        'error' (see failures).
+    """
+    tasks = [(name, variation) for name in data for variation in variations]
+    if workers == 1:
+        _init_worker(data)
+        try:
+            return [_run(task) for task in tasks]
+        finally:
+            _init_worker(None)
+
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=_init_worker,
+                             initargs=(data, )) as pool:
+        return list(pool.map(_run, tasks, chunksize=chunksize))
+
+
+def failures(rows):
+    """Return the rows of the variations which failed"""
+    return [row for row in rows if not row['success']]
+
+
+def spread(rows, parameters=PARAMETERS):
+    """
+    Summarize the variation of each parameter of each analysis: the value
+    of the reference variation - the first which was fitted successfully -
+    and the mean, standard deviation, minimum, maximum and largest
+    deviation from the reference over all successful variations. Failed
+    variations are only counted. reference_variation is the position of
+    the reference among the variations (-1 if none succeeded).
+    """
+    by_analysis = OrderedDict()
+    for row in rows:
+        by_analysis.setdefault(row['analysis'], []).append(row)
+
+    summary = []
+    for name, analysis_rows in by_analysis.items():
+        good = [r for r in analysis_rows if r['success']]
+        successes = [i for i, r in enumerate(analysis_rows) if r['success']]
+        if successes:
+            reference_index = successes[0]
+            reference = analysis_rows[reference_index]
+        else:
+            reference_index = -1
+            reference = {key: np.nan for param in parameters for key in (param, param + '_err')}
+        for param in parameters:
+            values = np.array([r[param] for r in good])
+            if len(values) == 0:
+                values = np.array([np.nan])
+            summary.append(OrderedDict([
+                ('analysis', name),
+                ('parameter', param),
+                ('reference', reference[param]),
+                ('reference_err', reference[param + '_err']),
+                ('reference_variation', reference_index),
+                ('nvariations', len(good)),
+                ('nfailed', len(analysis_rows) - len(good)),
+                ('mean', values.mean()),
+                ('std', values.std()),
+                ('min', values.min()),
+                ('max', values.max()),
+                ('max_deviation', np.abs(values - reference[param]).max()),
+            ]))
+    return summary
+
+
+def write_csv(rows, path):
+    """Write a table (list of dicts with the same keys) as CSV"""
+    with open(path, 'w', newline='') as table_file:
+        writer = csv.DictWriter(table_file, fieldnames=list(rows[0]) if rows else [])
+        writer.writeheader()
+        writer.writerows(rows)
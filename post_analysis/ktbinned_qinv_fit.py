@@ -18,6 +18,8 @@ from pionpion.analysis import Analysis
 from pionpion.fit import fitfunc_qinv
 from pionpion.fit import fitfunc_qinv_gauss_ll
 from fitting.gaussian import GaussianModelCoulomb, GaussianModelFSI
+from fitting.batch import batch_fit_histograms
+from fitting.fitcache import FitCache, histogram_arrays
 from lmfit import minimize, Parameters, report_fit
 from pionpion.root_helpers import get_root_object
 from stumpy import Histogram
@@ -50,6 +52,9 @@ def argument_parser():
     parser.add_argument("--use-ll",
                         action='store_true',
                         help="Uses the log-likelihood fitting procedure")
+    parser.add_argument("--no-fit-cache",
+                        action='store_true',
+                        help="Always repeat the fits, instead of reusing cached results")
     parser.add_argument("datafile", help="ROOT filename to analyze")
     parser.add_argument("output_filename",
                         nargs='?',
@@ -89,7 +94,8 @@ def do_qinv_fit(ratio, ModelClass, fit_range):
     e = ratio.errors[fit_slice][nonzero_mask]
     # print('y', y)
     # print('e', e)
-    qinv_fit = minimize(ModelClass.as_resid, qinv_params, args=(x, y, e))
+    qinv_fit = minimize(ModelClass.as_resid, qinv_params, args=(x, y, e),
+                        Dfun=ModelClass.as_resid_jacobian)
 
     return qinv_fit
 
@@ -175,29 +181,20 @@ def main(argv):
         report_fit(fit)
         save_fit_canvas(root_cf, fit, name)
 
-    fit_serieses = []
+    # collect every correlation function, fit them all at once, then write
+    fit_jobs = []
 
     for analysis in femtolist:
         print("\n***", analysis.name)
 
         # Set output for this analysis
         output_dir = output_file.mkdir(analysis.name)
-        output_dir.cd()
 
-        # Get the correlation function
-        root_cf = analysis['CF']
-        cf_fit_res = do_qinv_fit(root_cf, FIT_CLASS, fit_range)
-        write_fit(root_cf,
-                  cf_fit_res,
-                  name='CF_fit',
-                  title="(Uncorrected) CF : %s" % (analysis.title))
-
-        root_cf = analysis['cCF']
-        ccf_fit_res = do_qinv_fit(root_cf, FIT_CLASS, fit_range)
-        write_fit(root_cf,
-                  ccf_fit_res,
-                  name='cCF_fit',
-                  title="(Corrected) CF : %s" % (analysis.title))
+        # Get the correlation functions
+        fit_jobs.append((output_dir, analysis['CF'], 'CF_fit',
+                         "(Uncorrected) CF : %s" % (analysis.title), None))
+        fit_jobs.append((output_dir, analysis['cCF'], 'cCF_fit',
+                         "(Corrected) CF : %s" % (analysis.title), None))
 
         try:
             kt_analysis = analysis['KT_Qinv']
@@ -209,34 +206,46 @@ def main(argv):
         kt_bins = tuple((x.GetName(), x.ReadObj()) for x in kt_analysis.GetListOfKeys())
 
         for name, x in kt_bins:
-            output_dir.mkdir(name).cd()
+            kt_dir = output_dir.mkdir(name)
 
             kt_range = tuple(map(float, name.split('_')))
 
             title = '%s - kT : %s' % (analysis.title, '%0.1f-%0.1f' % kt_range)
-            root_cf = get_root_object(x, 'CF')
-            cf_fit_res = do_qinv_fit(root_cf, FIT_CLASS, fit_range)
-            fit_serieses.append(fitres_to_series(cf_fit_res,
-                                                 momentum_corrected=false,
-                                                 kt_range=kt_range,
-                                                 centrality=analysis.centrality_range,
-                                                 ))
-            write_fit(root_cf,
-                      cf_fit_res,
-                      name='CF_fit',
-                      title="(Uncorrected) CF : %s" % (title))
-
-            root_cf = get_root_object(x, 'cCF')
-            ccf_fit_res = do_qinv_fit(root_cf, FIT_CLASS, fit_range)
-            fit_serieses.append(fitres_to_series(ccf_fit_res,
-                                                 momentum_corrected=True,
-                                                 kt_range=kt_range,
-                                                 centrality=analysis.centrality_range,
-                                                 ))
-            write_fit(root_cf,
-                      ccf_fit_res,
-                      name='cCF_fit',
-                      title="(Corrected) CF : %s" % (title))
+            for cf_name, corrected, cf_title in (('CF', False, "(Uncorrected) CF : %s"),
+                                                 ('cCF', True, "(Corrected) CF : %s")):
+                series_info = dict(momentum_corrected=corrected,
+                                   kt_range=kt_range,
+                                   centrality=analysis.centrality_range)
+                fit_jobs.append((kt_dir, get_root_object(x, cf_name), cf_name + '_fit',
+                                 cf_title % (title), series_info))
+
+    # only the correlation functions without a cached fit are fitted (get
+    # counts the hits and misses reported by fit_cache.stats)
+    fit_cache = FitCache(enabled=not args.no_fit_cache)
+    hists = [Histogram.BuildFromRootHist(job[1]) for job in fit_jobs]
+    keys = [fit_cache.key(histogram_arrays(h), FIT_CLASS, fit_range=fit_range, method='chisqr')
+            for h in hists]
+    fit_results = [fit_cache.get(key) for key in keys]
+    missing = [i for i, res in enumerate(fit_results) if res is None]
+
+    TIMESTART = time.monotonic()
+    if missing:
+        batch_res = batch_fit_histograms(FIT_CLASS, [hists[i] for i in missing], fit_range)
+        for j, i in enumerate(missing):
+            fit_results[i] = batch_res.minimizer_result(j)
+            # a failed fit is not stored, so it is retried on the next run
+            if fit_results[i].success:
+                fit_cache.put(keys[i], fit_results[i])
+    print("-- fit %d correlation functions in %0.3fs (%d cached)"
+          % (len(missing), time.monotonic() - TIMESTART, len(fit_jobs) - len(missing)))
+    print("-- fit cache:", fit_cache.stats())
+
+    fit_serieses = []
+    for (output_dir, root_cf, name, title, series_info), fit_res in zip(fit_jobs, fit_results):
+        output_dir.cd()
+        if series_info is not None:
+            fit_serieses.append(fitres_to_series(fit_res, **series_info))
+        write_fit(root_cf, fit_res, name=name, title=title)
 
     fit_df = pd.DataFrame(fit_serieses)
     if args.fit_output:
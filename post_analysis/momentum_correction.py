@@ -164,10 +164,10 @@ def main(argv):
         print(norm_correction)
         print()
         # this applies the matrix to ALL qinv histograms
-        analysis.apply_momentum_correction(norm_correction.T)
+        analysis.apply_momentum_correction_matrix(norm_correction.T)
 
-        # write the smeared output
-        analysis.write_into(output_femtolist)
+        # write the smeared output - unchanged objects are copied as raw keys
+        analysis.write_into(output_femtolist, fast_copy=True)
 
     output.Close()
 
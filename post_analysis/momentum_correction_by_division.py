@@ -9,11 +9,11 @@ Generate momentum corrections by
 import sys
 import numpy as np
 from stumpy import Histogram
-from stumpy.utils import root_histogram_datatype
 from argparse import ArgumentParser
 from unittest.mock import MagicMock
 from pionpion.femtolist import Femtolist
 from pionpion.root_helpers import get_root_object
+from pionpion.rootview import data_view
 import ROOT
 
 TRUE_NUM_PATH = ['CF_Num']
@@ -74,11 +74,8 @@ class Corrections:
                 return None
 
         def get_data_from_hist(root_hist):
-            nbins = root_hist.GetNbinsX()
-            dtype = root_histogram_datatype(root_hist)
-            data = np.frombuffer(root_hist.GetArray(), dtype=dtype, count=nbins + 2)
-            # ignore overflow+underflow bins
-            return np.copy(data[1:-1])
+            # an owned copy, which callers may modify and which outlives the histogram
+            return np.array(data_view(root_hist))
 
         ratio = self.make_ratio(*self.get_cf_hists(analysis._data))
         data = get_data_from_hist(ratio)
@@ -1,6 +1,22 @@
 #
 # pionpion/__init__.py
 #
+"""
+Pion-pion femtoscopy analysis helpers.
 
-from .femtolist import Femtolist
-from .analysis import Analysis
+Femtolist and Analysis are imported on first access, so importing the
+package (or its ROOT-free modules such as pionpion.fit, pionpion.q3d and
+pionpion.store) does not load ROOT.
+"""
+
+__all__ = ['Femtolist', 'Analysis']
+
+
+def __getattr__(name):
+    if name == 'Femtolist':
+        from .femtolist import Femtolist
+        return Femtolist
+    if name == 'Analysis':
+        from .analysis import Analysis
+        return Analysis
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -3,10 +3,12 @@
 #
 
 import itertools
-from collections import defaultdict
+from collections import OrderedDict
 
 from stumpy import Histogram
 from stumpy.utils import get_root_object
+from .metadata import AnalysisInfo, parse_settings
+from .rootview import data_view, as_array_histogram
 from ROOT import (
     TObjArray,
     TObjString,
@@ -14,22 +16,203 @@ from ROOT import (
     TDirectory,
     TList,
     TKey,
+    TH1,
+    TClass,
+    TObject,
+    SetOwnership,
 )
 
 
-class Analysis:
+def lookup(obj, path):
+    """
+    Return the object found at path inside obj, which may be either a
+    ROOT collection or a KeyIndex. Returns None if nothing was found.
+    """
+    if isinstance(obj, KeyIndex):
+        return obj.get(path)
+    return get_root_object(obj, path)
+
+
+class KeyIndex:
+    """
+    Name-indexed view over the keys of a TDirectory.
+
+    Only the key names are read at construction; an object is deserialized
+    (TKey::ReadObj) the first time it is accessed and kept afterwards, so
+    repeated access returns the same (possibly modified) object.
+    Subdirectories are returned as nested KeyIndex objects.
+
+    If keep is False (an ObjectCache holds the objects instead), loaded
+    objects are not referenced by the index - only subdirectories and
+    objects marked as modified are kept - so objects evicted from the
+    cache are freed, and read again on the next access.
+
+    Provides the small subset of the TObjArray interface used throughout
+    post_analysis (GetName, FindObject, At, Last, iteration, indexing).
+    """
+
+    def __init__(self, tdir, keep=True):
+        self._dir = tdir
+        self.keep = keep
+        self._keys = OrderedDict()
+        for key in tdir.GetListOfKeys():
+            # keys are stored highest-cycle first - ignore older cycles
+            self._keys.setdefault(key.GetName(), key)
+        self._objs = {}
+        self.modified = set()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, name):
+        return name in self._keys
+
+    def __iter__(self):
+        for name in self._keys:
+            yield self.load(name)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, int):
+            return self.load(self.names()[idx])
+        elif isinstance(idx, slice):
+            return [self.load(name) for name in self.names()[idx]]
+        return self.load(idx)
+
+    def __repr__(self):
+        return "<KeyIndex %r (%d keys)>" % (self.GetName(), len(self))
+
+    @property
+    def directory(self):
+        return self._dir
+
+    def names(self):
+        """Return list of key names in file order"""
+        return list(self._keys)
+
+    def key(self, name):
+        """Return the TKey with name"""
+        return self._keys[name]
+
+    def is_loaded(self, name):
+        """Return if the object with name is held by the index"""
+        return name in self._objs
+
+    def mark_modified(self, name, obj=None):
+        """
+        Record that the object stored under key name has been changed, so
+        it is re-serialized (instead of copied) by Analysis.write_into.
+        The modified object (obj, or the loaded object) is kept from now on.
+        """
+        if name not in self._keys:
+            raise KeyError(name)
+        if obj is None:
+            obj = self.load(name)
+        self._objs[name] = obj
+        self.modified.add(name)
+
+    def load(self, name):
+        """
+        Return object stored under key name, reading it from the file if
+        it has not been accessed before. Raises KeyError if no such key.
+        """
+        try:
+            return self._objs[name]
+        except KeyError:
+            pass
+
+        obj = self._keys[name].ReadObj()
+        if isinstance(obj, TDirectory):
+            obj = KeyIndex(obj, keep=self.keep)
+        elif not self.keep:
+            return obj
+        self._objs[name] = obj
+        return obj
+
+    def get(self, path):
+        """
+        Resolve a path in the same manner as get_root_object: a string
+        path may be separated by dots to look into subcollections, and a
+        list of paths is tried in order with the first found object
+        returned. Returns None if no path matches.
+        """
+        paths = [path] if isinstance(path, str) else path
+        for p in paths:
+            if p in self._keys:
+                return self.load(p)
+            head, _, rest = p.partition('.')
+            if not rest or head not in self._keys:
+                continue
+            obj = lookup(self.load(head), rest)
+            if obj != None:
+                return obj
+        return None
+
+    def GetName(self):
+        return self._dir.GetName()
+
+    def FindObject(self, name):
+        return self.load(name) if name in self._keys else None
+
+    def At(self, idx):
+        try:
+            return self[idx]
+        except IndexError:
+            return None
+
+    def Last(self):
+        return self[-1] if self._keys else None
+
+
+def copy_key(key, target):
+    """
+    Copy a key, with its compressed object bytes, into the target
+    directory without deserializing the object.
+    """
+    new_key = TKey(target, key, 0)
+    SetOwnership(new_key, False)
+    new_key.WriteFile()
+    return new_key
+
+
+def fast_root_write(index, target):
+    """
+    Write the contents of a KeyIndex into the target directory in a single
+    pass: subdirectories are recreated, objects marked as modified are
+    serialized again and all other keys are copied raw.
+    """
+    for name in index.names():
+        key = index.key(name)
+        if TClass.GetClass(key.GetClassName()).InheritsFrom(TDirectory.Class()):
+            fast_root_write(index.load(name), target.mkdir(name))
+        elif name in index.modified:
+            target.cd()
+            index.load(name).Write(name, TObject.kSingleKey)
+        else:
+            copy_key(key, target)
+
+
+class Analysis(AnalysisInfo):
     """
     Analysis object wrapping a TObjArray full of various femtoscopic
     information.
-    """
 
-    QINV_NUM_PATH = ['Num_qinv_pip', 'Num_qinv_pim']
-    QINV_DEN_PATH = ['Den_qinv_pip', 'Den_qinv_pim']
-    KT_BINNED_ANALYSIS_PATH = ['KT_Qinv']
+    If constructed from a TDirectory, only the names of the stored keys are
+    read and objects are loaded on demand (see KeyIndex). Pass lazy=False
+    to read everything into a TObjArray up front.
 
-    def __init__(self, analysis_obj):
-        if isinstance(analysis_obj, (TList, TObjArray)):
+    If an ObjectCache is given, path lookups and Histogram conversions are
+    cached under keys made from source, a (filepath, mtime) pair identifying
+    the file the analysis was read from. Lazily loaded objects are then
+    held only by the cache, so its byte limit bounds their memory.
+    """
+
+    def __init__(self, analysis_obj, lazy=True, cache=None, source=None):
+        if isinstance(analysis_obj, KeyIndex):
+            analysis_obj.keep = cache is None
+        elif isinstance(analysis_obj, (TList, TObjArray)):
             pass
+        elif isinstance(analysis_obj, TDirectory) and lazy:
+            analysis_obj = KeyIndex(analysis_obj, keep=cache is None)
         elif isinstance(analysis_obj, TDirectory):
             array = TObjArray()
             array.SetName(analysis_obj.GetName())
@@ -41,11 +224,38 @@ class Analysis:
                              "initialization value. Found %r." % (analysis_obj))
 
         self._data = analysis_obj
-        self.metadata = Analysis.load_metadata(self._data.Last())
+        self._cache = cache
+        self._source = source if source is not None else (None, None)
+
+    @property
+    def metadata(self):
+        """
+        Settings of the analysis, parsed from the settings TObjString on
+        first access
+        """
+        try:
+            return self._metadata
+        except AttributeError:
+            pass
+        self._metadata = Analysis.load_metadata(self._data.Last())
+        return self._metadata
+
+    @metadata.setter
+    def metadata(self, value):
+        self._metadata = value
 
     def __iter__(self):
         yield from self._data
 
+    def __contains__(self, name):
+        """
+        Return if an object with name is stored at the top level of the
+        analysis (does not load the object in lazy analyses).
+        """
+        if isinstance(self._data, KeyIndex):
+            return name in self._data
+        return self._data.FindObject(name) != None
+
     def __getattr__(self, name):
         """
         Forwards any missing attribute to the underlaying TObjArray
@@ -56,115 +266,138 @@ class Analysis:
         """
         Returns the object found at the path given in the name.
         """
-        return get_root_object(self._data, name)
+        if self._cache is None:
+            return lookup(self._data, name)
+        return self._cache.get_object(self._cache_key(name),
+                                      lambda: lookup(self._data, name))
+
+    def _cache_key(self, path):
+        return self._cache.make_key(*self._source, self.name, path)
+
+    def histogram(self, path):
+        """
+        Return the object at path converted to a stumpy Histogram, or None
+        if no such object exists.
+        """
+        if self._cache is None:
+            obj = self[path]
+            return None if obj == None else Histogram.BuildFromRootHist(obj)
+        return self._cache.get_histogram(self._cache_key(path),
+                                         lambda: self[path],
+                                         Histogram.BuildFromRootHist)
 
     def has_kt_bins(self):
         """
         Return if the analysis has a collection of kt-binned histograms
         """
-        return get_root_object(self._data, self.KT_BINNED_ANALYSIS_PATH) != None
+        return self[self.KT_BINNED_ANALYSIS_PATH] != None
 
     @property
     def name(self):
         return self._data.GetName()
 
-    @property
-    def title(self):
-        x = self.name.split('_')
-        centrality_name = "%d-%d%%" % self.centrality_range
-        title = "%s (%s)" % (self.system_name, centrality_name)
-        return title.replace("π", "#pi")
-
-    @property
-    def centrality_range(self):
-        return tuple(map(float, self.name.split('_')[1:3]))
-
-    @property
-    def system_name(self):
-        """
-        Returns the 'friendly' name of the particle system - could be π+, π-
-        """
-        if self.metadata:
-            pp_info = self.metadata['AliFemtoAnalysisPionPion']
-        else:
-            suffix = self.name.split('_')[-1]
-            pp_info = {'pion_1_type': 0}
-        if pp_info:
-            if 'pion_1_type' in pp_info:
-                pion_code = int(pp_info['pion_1_type'])
-            elif 'piontype' in pp_info:
-                pion_code = int(pp_info['piontype'])
-
-        return {
-            0: "π^{+}",
-            1: "π^{-}",
-        }[pion_code]
-
     @staticmethod
     def load_metadata(settings):
         if not isinstance(settings, TObjString):
             return
+        return parse_settings(str(settings))
 
-        def tree(): return defaultdict(tree)
-        analysis_meta = tree()
-
-        for s in str(settings).split("\n")[1:-1]:
-            k, v = s.split('=')
-            keys = k.split('.')
-            k = analysis_meta
-            for key in keys[:-1]:
-                k = k[key]
-            k[keys[-1]] = v
-            # for key in k.split('.'):
-        return analysis_meta
+    def view(self, path, writable=False):
+        """
+        Return the histogram at path as an ArrayHistogram whose data is a
+        zero-copy view of the ROOT histogram's buffer (see
+        pionpion.rootview). Returns None if no such object exists.
+        """
+        obj = self[path]
+        return None if obj == None else as_array_histogram(obj, writable=writable)
 
     @property
     def qinv_pair(self):
-        n = get_root_object(self._data, self.QINV_NUM_PATH)
-        if n == None:
+        n = self.histogram(self.QINV_NUM_PATH)
+        if n is None:
             print("Error! Could not load numerator in analysis")
-            n = None
-        else:
-            n = Histogram.BuildFromRootHist(n)
 
-        d = get_root_object(self._data, self.QINV_DEN_PATH)
-        if d == None:
+        d = self.histogram(self.QINV_DEN_PATH)
+        if d is None:
             print("Error! Could not load denominator in analysis")
-            d = None
-        else:
-            d = Histogram.BuildFromRootHist(d)
 
         return n, d
 
     @property
     def kt_binned_pairs(self):
         """
-        Return the TObjArray containing the kT binned pairs
+        Return the TObjArray (or KeyIndex, if stored in a directory)
+        containing the kT binned pairs
         """
         try:
             return self._kt_binned_correlation_functions
         except AttributeError:
             pass
-        kt_cfs = get_root_object(self._data, self.KT_BINNED_ANALYSIS_PATH)
+        kt_cfs = self[self.KT_BINNED_ANALYSIS_PATH]
 
         if isinstance(kt_cfs, TDirectory):
-            kt_cfs = list(map(TKey.ReadObj, kt_cfs.GetListOfKeys()))
+            kt_cfs = KeyIndex(kt_cfs, keep=self._cache is None)
         elif kt_cfs == None:
             kt_cfs = ()
 
         self._kt_binned_correlation_functions = kt_cfs
         return kt_cfs
 
+    def kt_bin_names(self):
+        """
+        Return list of the names of the kT bins
+        """
+        kt_cfs = self.kt_binned_pairs
+        if isinstance(kt_cfs, KeyIndex):
+            return kt_cfs.names()
+        return [kt_bin.GetName() for kt_bin in kt_cfs]
+
     def qinv_pair_in_kt_bin(self, idx):
         """
         """
-        if isinstance(idx, str):
-            objarray = self.kt_binned_pairs.FindObject(idx)
-        else:
-            objarray = self.kt_binned_pairs[idx]
-        n = get_root_object(objarray, self.QINV_NUM_PATH)
-        d = get_root_object(objarray, self.QINV_DEN_PATH)
-        return Histogram.BuildFromRootHist(n), Histogram.BuildFromRootHist(d)
+        def load(path):
+            if isinstance(idx, str):
+                objarray = self.kt_binned_pairs.FindObject(idx)
+            else:
+                objarray = self.kt_binned_pairs[idx]
+            return lookup(objarray, path)
+
+        if self._cache is None:
+            n = load(self.QINV_NUM_PATH)
+            d = load(self.QINV_DEN_PATH)
+            return Histogram.BuildFromRootHist(n), Histogram.BuildFromRootHist(d)
+
+        def cached(path):
+            key = self._cache_key((tuple(self.KT_BINNED_ANALYSIS_PATH), idx, tuple(path)))
+            return self._cache.get_histogram(key,
+                                             lambda: load(path),
+                                             Histogram.BuildFromRootHist)
+
+        return cached(self.QINV_NUM_PATH), cached(self.QINV_DEN_PATH)
+
+    def iter_histograms(self):
+        """
+        Yield (path, histogram) pairs of all ROOT histograms stored at the
+        top level of the analysis and in each kT bin of the kT-binned
+        collections. Paths are tuples of object names, e.g.
+        ('Num_qinv_pip',) or ('KT_Qinv', '0.2_0.3', 'Num_qinv_pip').
+        """
+        def histograms_in(collection, prefix):
+            for obj in collection:
+                if isinstance(obj, TH1):
+                    yield prefix + (obj.GetName(), ), obj
+
+        yield from histograms_in(self, ())
+
+        for kt_path in (self.KT_BINNED_ANALYSIS_PATH, self.KT_BINNED_Q3D_PATH):
+            kt_collection = self[kt_path]
+            if kt_collection == None:
+                continue
+            if isinstance(kt_collection, TDirectory):
+                kt_collection = KeyIndex(kt_collection, keep=self._cache is None)
+            for kt_bin in kt_collection:
+                prefix = (kt_collection.GetName(), kt_bin.GetName())
+                yield from histograms_in(kt_bin, prefix)
 
     def apply_momentum_correction_matrix(self, matrix):
         """
@@ -174,38 +407,88 @@ class Analysis:
             matrix: The normalized square matrix which smears the q_inv histograms.
         """
         def apply_matrix(root_hist):
-            hist = Histogram.BuildFromRootHist(root_hist)
-            data = hist.__rmatmul__(matrix).copy_data_with_overflow()
-            root_hist.SetContent(data)
+            data = data_view(root_hist, writable=True)
+            data[...] = matrix @ data
 
         def apply_vector(root_hist):
-            hist = Histogram.BuildFromRootHist(root_hist)
-            data = hist.data * matrix
-            root_hist.SetContent(data)
+            data = data_view(root_hist, writable=True)
+            data *= matrix
 
         def get_num_and_den(obj):
-            yield get_root_object(obj, self.QINV_NUM_PATH)
-            yield get_root_object(obj, self.QINV_DEN_PATH)
+            yield lookup(obj, self.QINV_NUM_PATH)
+            yield lookup(obj, self.QINV_DEN_PATH)
 
         def get_num_and_den_in_collection(obj):
             for tobj in obj:
                 yield from get_num_and_den(tobj)
 
-        # keys = [self.QINV_NUM_PATH, self.QINV_DEN_PATH]
-        # keys += list(map(lambda x:  self.kt_binned_pairs)
-        objs = list(get_num_and_den(self._data))
-        for kt_bin_cf in self.kt_binned_pairs:
-            objs += list(get_num_and_den(kt_bin_cf))
+        def mark_modified(collection, obj):
+            if isinstance(collection, KeyIndex):
+                collection.mark_modified(obj.GetName(), obj)
 
         apply = apply_vector if matrix.ndim == 1 else apply_matrix
 
-        for obj in filter(lambda x: x is not None, objs):
-            apply(obj)
+        for obj in get_num_and_den(self._data):
+            if obj != None:
+                apply(obj)
+                mark_modified(self._data, obj)
+
+        kt_cfs = self.kt_binned_pairs
+        for kt_bin_cf in kt_cfs:
+            for obj in get_num_and_den(kt_bin_cf):
+                if obj == None:
+                    continue
+                apply(obj)
+                # an object is rewritten with the whole key containing it: the
+                # kT bin, or all kT bins if stored as a single TObjArray key
+                if isinstance(kt_bin_cf, KeyIndex):
+                    mark_modified(kt_bin_cf, obj)
+                elif isinstance(kt_cfs, KeyIndex):
+                    mark_modified(kt_cfs, kt_bin_cf)
+                else:
+                    self._mark_container_modified(self.KT_BINNED_ANALYSIS_PATH, kt_cfs)
+
+        # converted histograms no longer match the ROOT objects
+        if self._cache is not None:
+            self._cache.invalidate(*self._source, self.name)
 
-    def write_into(self, output):
+    def _mark_container_modified(self, path, container):
         """
-        Write the analysis object into some kind of output
+        Mark the top-level key storing container (found at path, a list of
+        alternative names) as modified, if the analysis is lazily loaded
+        """
+        if not isinstance(self._data, KeyIndex):
+            return
+        for name in path:
+            if name in self._data:
+                self._data.mark_modified(name, container)
+                return
+
+    def write_into(self, output, fast_copy=False):
         """
+        Write the analysis object into some kind of output: a TDirectory
+        (a subdirectory named after the analysis is created), a ROOT
+        collection, or a filename of a new ROOT file to create.
+
+        If fast_copy is True and the analysis was loaded lazily from a
+        file, unmodified objects are copied as raw compressed keys without
+        being read, and only objects marked as modified (see
+        KeyIndex.mark_modified, called by apply_momentum_correction_matrix)
+        are serialized again.
+        """
+        if isinstance(output, str):
+            output_file = TFile(output, "RECREATE")
+            try:
+                self.write_into(output_file, fast_copy=fast_copy)
+                output_file.Write()
+            finally:
+                output_file.Close()
+            return
+
+        if fast_copy and isinstance(self._data, KeyIndex) and isinstance(output, TDirectory):
+            container = output.mkdir(self.name)
+            fast_root_write(self._data, container)
+            return container
 
         copied_settings = False
         def recursive_root_write(obj, container):
@@ -222,7 +505,7 @@ class Analysis:
                         continue
                     copied_settings = True
 
-                elif isinstance(o, TObjArray):
+                elif isinstance(o, (TObjArray, KeyIndex)):
                     if isinstance(container, TDirectory):
                         sub_dir = container.mkdir(o.GetName())
                         recursive_root_write(o, sub_dir)
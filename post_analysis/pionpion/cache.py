@@ -0,0 +1,169 @@
+#
+# pionpion/cache.py
+#
+"""
+Byte-bounded LRU cache of objects looked up in femtolist analyses.
+"""
+
+from collections import OrderedDict
+
+
+class ObjectCache:
+    """
+    Least-recently-used cache holding ROOT objects and their converted
+    numpy Histograms.
+
+    Entries are keyed by (file path, file mtime, analysis name, object path)
+    so a rewritten file never serves stale objects. When the estimated size
+    of all entries exceeds max_bytes, the least recently used entries are
+    evicted.
+
+    Note that cached objects are shared between callers - copy before
+    modifying in place.
+    """
+
+    def __init__(self, max_bytes=512 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    class Entry:
+        """Cached ROOT object and (optional) converted Histogram"""
+
+        __slots__ = ('root_obj', 'histogram', 'nbytes')
+
+        def __init__(self, root_obj):
+            self.root_obj = root_obj
+            self.histogram = None
+            self.nbytes = ObjectCache.root_nbytes(root_obj)
+
+    @staticmethod
+    def make_key(filepath, mtime, analysis, path):
+        """
+        Build a hashable key; object paths given as lists of alternatives
+        are converted to tuples.
+        """
+        if not isinstance(path, (str, tuple)):
+            path = tuple(tuple(p) if isinstance(p, list) else p for p in path)
+        return (filepath, mtime, analysis, path)
+
+    @staticmethod
+    def root_nbytes(obj):
+        """
+        Estimate the memory used by a ROOT object - only histogram bin
+        contents (and sum of weights squared) are accounted for.
+        """
+        try:
+            ncells = obj.GetNcells()
+        except AttributeError:
+            return 0
+        sumw2 = 1 if obj.GetSumw2N() else 0
+        return ncells * 8 * (1 + sumw2)
+
+    @staticmethod
+    def histogram_nbytes(hist):
+        """Size of the numpy arrays held by a Histogram"""
+        size = 0
+        for attr in ('data', 'errors'):
+            size += getattr(getattr(hist, attr, None), 'nbytes', 0)
+        return size
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def _lookup(self, key):
+        try:
+            entry = self._entries[key]
+        except KeyError:
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _insert(self, key, entry):
+        self._entries[key] = entry
+        self.nbytes += entry.nbytes
+        self._evict()
+
+    def _resize(self, entry, delta):
+        entry.nbytes += delta
+        self.nbytes += delta
+        self._evict()
+
+    def _evict(self):
+        # never evict the most recent entry, even if it alone is too large
+        while self.nbytes > self.max_bytes and len(self._entries) > 1:
+            _, entry = self._entries.popitem(last=False)
+            self.nbytes -= entry.nbytes
+
+    def get_object(self, key, loader):
+        """
+        Return the ROOT object stored under key, calling loader() to
+        produce it on a miss. Objects equal to None are not cached.
+        """
+        entry = self._lookup(key)
+        if entry is not None:
+            self.hits += 1
+            return entry.root_obj
+
+        self.misses += 1
+        obj = loader()
+        if obj != None:
+            self._insert(key, ObjectCache.Entry(obj))
+        return obj
+
+    def get_histogram(self, key, loader, convert):
+        """
+        Return the Histogram made by calling convert on the ROOT object
+        stored under key (which is loaded by loader() if not cached).
+        Returns None if the object could not be found.
+        """
+        entry = self._lookup(key)
+        if entry is not None and entry.histogram is not None:
+            self.hits += 1
+            return entry.histogram
+
+        if entry is None:
+            self.misses += 1
+            obj = loader()
+            if obj == None:
+                return None
+            entry = ObjectCache.Entry(obj)
+            self._insert(key, entry)
+        else:
+            # object cached, but never converted
+            self.misses += 1
+
+        entry.histogram = convert(entry.root_obj)
+        self._resize(entry, self.histogram_nbytes(entry.histogram))
+        return entry.histogram
+
+    def invalidate(self, *prefix):
+        """
+        Remove all entries whose key starts with the given values, e.g.
+        cache.invalidate(filepath, mtime, analysis_name). With no arguments
+        the whole cache is cleared.
+        """
+        n = len(prefix)
+        for key in [k for k in self._entries if k[:n] == prefix]:
+            self.nbytes -= self._entries.pop(key).nbytes
+
+    def clear(self):
+        self.invalidate()
+
+    def stats(self):
+        """Return dict of hit/miss counters and memory usage"""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._entries),
+            'nbytes': self.nbytes,
+            'max_bytes': self.max_bytes,
+        }
+
+
+default_cache = ObjectCache()
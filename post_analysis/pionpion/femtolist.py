@@ -2,10 +2,8 @@
 # pionpion/femtolist.py
 #
 
-from stumpy.utils import get_root_object, is_null
-from .analysis import Analysis
-from os.path import basename
-import ROOT
+from .metadata import MetadataIndex
+from os.path import basename, getmtime
 
 
 class Femtolist:
@@ -22,13 +20,26 @@ class Femtolist:
         'PWG2FEMTO',
     ]
 
-    def __init__(self, file, listpath=None):
+    def __init__(self, file, listpath=None, lazy=True, cache=None):
         """
         Construct femtolist from file; given either a TFile or the
         path to the file.
         If no femtolist object is found inside the file - a ValueError
         is raised.
+
+        If lazy is True and the femtolist is a directory, analyses are
+        indexed by key name and their contents only read when accessed.
+
+        If cache (a pionpion.cache.ObjectCache, such as
+        pionpion.cache.default_cache) is given, all analyses share it for
+        object lookups and Histogram conversions.
+
+        ROOT (and stumpy) are first imported here, not when the module is.
         """
+        import ROOT
+        from stumpy.utils import get_root_object
+        from .analysis import KeyIndex
+
         if not isinstance(file, ROOT.TDirectory):
             file = ROOT.TFile(str(file), "READ")
 
@@ -39,39 +50,114 @@ class Femtolist:
         if femtolist == None:
             raise ValueError("Could not find a femtolist in %r" % (file))
 
+        if isinstance(femtolist, ROOT.TDirectory):
+            femtolist = KeyIndex(femtolist)
         self._femtolist = femtolist
+        self._listpath = listpath
         self._file = file
+        self._lazy = lazy
+        self._cache = cache
+        try:
+            self._source = (self.filepath, getmtime(self.filepath))
+        except OSError:
+            self._source = (self.filepath, None)
 
     def __iter__(self):
         """
         Iterate over all analyses in this Femtolist
         """
-        if isinstance(self._femtolist, ROOT.TDirectoryFile):
-            femto_iter = map(ROOT.TKey.ReadObj, self._femtolist.GetListOfKeys())
-        else:
-            femto_iter = self._femtolist
+        for analysis in self._femtolist:
+            yield self._make_analysis(analysis)
 
-        for analysis in femto_iter:
-            yield Analysis(analysis)
+    def _make_analysis(self, obj):
+        from .analysis import Analysis, KeyIndex
+        if isinstance(obj, KeyIndex) and not self._lazy:
+            obj = obj.directory
+        return Analysis(obj, lazy=self._lazy, cache=self._cache, source=self._source)
 
     def __getitem__(self, idx):
         """
         Return an analysis object either by numerical index or by name.
         If no analysis exists, an KeyError is raised.
         """
+        from stumpy.utils import is_null
+        from .analysis import KeyIndex
+
         if isinstance(idx, int):
             obj = self._femtolist.At(idx)
         elif isinstance(idx, str):
             obj = self._femtolist.FindObject(idx)
         elif isinstance(idx, slice):
-            return [Analysis(obj) for obj in self._femtolist[idx]]
+            return [self._make_analysis(obj) for obj in self._femtolist[idx]]
         else:
             obj = None
 
-        if is_null(obj):
+        if obj is None or (not isinstance(obj, KeyIndex) and is_null(obj)):
             raise KeyError("No analysis found with index `{}`".format(idx))
 
-        return Analysis(obj)
+        return self._make_analysis(obj)
+
+    def names(self):
+        """
+        Return list of the names of all analyses, without loading them
+        """
+        if hasattr(self._femtolist, 'names'):
+            return self._femtolist.names()
+        return [obj.GetName() for obj in self._femtolist]
+
+    def map(self, func, names=None, workers=None):
+        """
+        Return list of func(analysis) for each analysis (or each of the
+        given names), in order.
+
+        Analyses are processed by a pool of worker processes, each opening
+        this file itself and receiving only analysis names; func (and its
+        results) must therefore be picklable - a module-level function
+        returning fit parameters or numpy arrays, not ROOT objects. If
+        workers is 1, func is called in this process.
+        """
+        if names is None:
+            names = self.names()
+        if workers == 1:
+            return [func(self[name]) for name in names]
+
+        from .parallel import map_analyses
+        kwargs = {'lazy': self._lazy}
+        if self._cache is not None:
+            from .cache import default_cache
+            kwargs['cache'] = default_cache
+        return map_analyses(func, names, Femtolist,
+                            args=(self.filepath, self._listpath),
+                            kwargs=kwargs,
+                            workers=workers)
+
+    @property
+    def index(self):
+        """
+        MetadataIndex of all analyses - built on first access from the
+        analyses' settings, or loaded from the index file stored next to
+        the ROOT file.
+        """
+        try:
+            return self._index
+        except AttributeError:
+            pass
+        self._index = MetadataIndex.for_femtolist(self)
+        return self._index
+
+    def select(self, **criteria):
+        """
+        Return list of analyses matching the criteria, e.g.
+        femtolist.select(centrality=(0, 10), pion='π+', has_kt=True).
+        See MetadataIndex.select for the available criteria. In lazy mode
+        the contents of the returned analyses have not yet been read.
+        """
+        result = []
+        for record in self.index.select(**criteria):
+            analysis = self[record.name]
+            analysis.metadata = record.metadata
+            result.append(analysis)
+        return result
 
     @property
     def name(self):
@@ -28,7 +28,7 @@ def fitfunc_qinv_gauss(params, q, data=None):
     """
 
     t = -(q * params['radius'] / HBAR_C) ** 2
-    model = params['norm'] * (1.0 + params['lam'] * np.exp(list(t)))
+    model = params['norm'] * (1.0 + params['lam'] * np.exp(t))
 
     if data is None:
         return model
@@ -111,7 +111,7 @@ fitfunc_qinv = fitfunc_qinv_gauss
 # fitfunc_qinv = fitfunc_qinv_lorentz
 
 
-def fitfunc_3d(params, q, data=None):
+def fitfunc_3d(params, q, data=None, dtype=None):
     """
     Do 3D Gaussian fit of data.
 
@@ -128,6 +128,12 @@ def fitfunc_3d(params, q, data=None):
 
     q: 3xN matrix of each point in out-side-long space (units: GeV)
     data: {optional} observed data to which we will calculate the residual
+    dtype: {optional} floating point type of the evaluation (e.g. np.float32
+      to halve the memory traffic of large histograms); the model is
+      returned in this type. The observed data and errors are used in this
+      type too - pass them already converted (e.g. cast the fit domain once,
+      outside the fit loop) to avoid a conversion per call - and only the
+      final residual is converted to float64.
     """
 
     # extract parameters
@@ -140,6 +146,11 @@ def fitfunc_3d(params, q, data=None):
     # create array of radii (1x3)
     rr = np.array([r_out, r_side, r_long]) / HBAR_C
 
+    if dtype is not None:
+        q = np.asarray(q, dtype=dtype)
+        rr = rr.astype(dtype)
+        norm, lam = dtype(norm), dtype(lam)
+
     # create the exponent parameter by multiplying each radius by the
     # appropriate q component (do shape check to ensure appropriate (1x3 * 3xN)
     # matrix multiplication)
@@ -160,13 +171,31 @@ def fitfunc_3d(params, q, data=None):
 
     # split data and error
     observed, err = data[:2]
+    if dtype is not None:
+        # no copy if already of dtype
+        observed = np.asarray(observed, dtype=dtype)
+        err = np.asarray(err, dtype=dtype)
 
     # get residual result
-    res = np.zeros(observed.shape)
+    res = np.zeros(observed.shape, dtype=model.dtype)
     zero_mask = err != 0.0
     res[zero_mask] = np.sqrt((model[zero_mask] - observed[zero_mask]) ** 2 / err[zero_mask] ** 2)
-    return res
+    return res if dtype is None else res.astype(np.float64)
+
+
 
+def fitfunc_3d_grid(params, q_out, q_side, q_long, radii=('r_out', 'r_side', 'r_long')):
+    """
+    The 3D Gaussian of fitfunc_3d evaluated on coordinate arrays which are
+    broadcast against each other - e.g. the axes of a grid from np.ix_ -
+    in a single vectorized call.
+
+    radii: names of the out, side and long radius parameters
+    """
+    exponent = 0.0
+    for q, name in zip((q_out, q_side, q_long), radii):
+        exponent = exponent + (np.asarray(q) * (params[name].value / HBAR_C)) ** 2
+    return params['norm'].value * (1 + params['lam'].value * np.exp(-exponent))
 
 
 def fitfunc_3d_with_offdiagonal_terms(params, q, data=None):
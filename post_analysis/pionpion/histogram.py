@@ -0,0 +1,192 @@
+#
+# pionpion/histogram.py
+#
+"""
+Lightweight numpy-only histogram classes, providing the subset of the
+stumpy.Histogram interface used by the post_analysis scripts without
+requiring ROOT. Data arrays may be memory-mapped or views into other
+buffers - no copies are made on construction.
+"""
+
+import numpy as np
+
+
+class ArrayAxis:
+    """
+    A histogram axis defined by its bin edges.
+    """
+
+    def __init__(self, edges):
+        self.edges = np.asarray(edges, dtype=np.float64)
+        if self.edges.ndim != 1 or self.edges.size < 2:
+            raise ValueError("Axis requires a 1D array of at least two edges")
+        self._centers = None
+
+    @property
+    def nbins(self):
+        return self.edges.size - 1
+
+    @property
+    def bin_centers(self):
+        if self._centers is None:
+            self._centers = (self.edges[:-1] + self.edges[1:]) / 2.0
+        return self._centers
+
+    @property
+    def bin_widths(self):
+        return np.diff(self.edges)
+
+    def __len__(self):
+        return self.nbins
+
+    def __getitem__(self, idx):
+        """Return bin center(s) at index idx"""
+        return self.bin_centers[idx]
+
+    def __eq__(self, other):
+        if not isinstance(other, ArrayAxis):
+            return NotImplemented
+        return np.array_equal(self.edges, other.edges)
+
+    def __repr__(self):
+        return "<ArrayAxis %d bins [%g, %g]>" % (self.nbins, self.edges[0], self.edges[-1])
+
+    def find_bin(self, x):
+        """
+        Return index of the bin containing value x. Values below the axis
+        return -1, values above return nbins.
+        """
+        return int(np.searchsorted(self.edges, x, side='right')) - 1
+
+    def get_slice(self, domain=None):
+        """
+        Convert a domain to a slice object (or bin index).
+
+        Integers are treated as bin indices and floats as axis values; a
+        pair (start, stop) of values selects every bin containing a value
+        in the closed range, a pair of ints is a python-style index range.
+        None selects the whole axis.
+        """
+        if domain is None:
+            return slice(None)
+        if isinstance(domain, slice):
+            return domain
+        if isinstance(domain, (int, np.integer)):
+            return int(domain)
+        if isinstance(domain, (float, np.floating)):
+            return self.find_bin(domain)
+
+        start, stop = domain
+        if isinstance(start, (float, np.floating)):
+            start = max(self.find_bin(start), 0)
+        if isinstance(stop, (float, np.floating)):
+            stop = min(self.find_bin(stop) + 1, self.nbins)
+        return slice(start, stop)
+
+
+class ArrayHistogram:
+    """
+    N-dimensional histogram of bin contents with errors and axes. Under and
+    overflow bins are not stored.
+    """
+
+    def __init__(self, data, errors=None, edges=(), name='', title=''):
+        self.data = data
+        self.errors = np.sqrt(np.abs(data)) if errors is None else errors
+        self.axes = tuple(e if isinstance(e, ArrayAxis) else ArrayAxis(e)
+                          for e in edges)
+        self.name = name
+        self.title = title
+
+        if self.data.shape != self.errors.shape:
+            raise ValueError("Data and errors shapes do not match (%s ≠ %s)"
+                             % (self.data.shape, self.errors.shape))
+        if tuple(a.nbins for a in self.axes) != self.data.shape:
+            raise ValueError("Axes %s do not match data shape %s"
+                             % (self.axes, self.data.shape))
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def ndim(self):
+        return self.data.ndim
+
+    @property
+    def x_axis(self):
+        return self.axes[0]
+
+    @property
+    def y_axis(self):
+        return self.axes[1]
+
+    @property
+    def z_axis(self):
+        return self.axes[2]
+
+    def __repr__(self):
+        return "<ArrayHistogram %r %s>" % (self.name, self.shape)
+
+    def get_slice(self, *domains):
+        """
+        Convert domains (one per axis, see ArrayAxis.get_slice) to a tuple
+        of slices; a single axis histogram returns a single slice.
+        """
+        slices = tuple(axis.get_slice(dom) for axis, dom in zip(self.axes, domains))
+        slices += (slice(None), ) * (self.ndim - len(slices))
+        return slices[0] if self.ndim == 1 else slices
+
+    def __getitem__(self, idx):
+        """Return bin contents in the given domain"""
+        if self.ndim == 1 or not isinstance(idx, tuple):
+            idx = (idx, )
+        return self.data[self.get_slice(*idx)]
+
+    def __len__(self):
+        return len(self.data)
+
+    def _check_axes(self, other):
+        if self.axes != other.axes:
+            raise ValueError("Histogram axes do not match")
+
+    def copy(self):
+        return ArrayHistogram(np.array(self.data), np.array(self.errors), self.axes,
+                              name=self.name, title=self.title)
+
+    def __add__(self, other):
+        self._check_axes(other)
+        return ArrayHistogram(self.data + other.data,
+                              np.hypot(self.errors, other.errors),
+                              self.axes, name=self.name, title=self.title)
+
+    def __truediv__(self, other):
+        """
+        Bin-by-bin division; a histogram divisor is treated as uncorrelated
+        and errors are propagated accordingly.
+        """
+        if not isinstance(other, ArrayHistogram):
+            return ArrayHistogram(self.data / other, self.errors / np.abs(other),
+                                  self.axes, name=self.name, title=self.title)
+        self._check_axes(other)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            data = self.data / other.data
+            errors = np.hypot(self.errors / other.data,
+                              self.data * other.errors / other.data ** 2)
+        return ArrayHistogram(data, errors, self.axes, name=self.name, title=self.title)
+
+    def __mul__(self, factor):
+        return ArrayHistogram(self.data * factor, self.errors * np.abs(factor),
+                              self.axes, name=self.name, title=self.title)
+
+    __rmul__ = __mul__
+
+    def __imul__(self, factor):
+        self.data = self.data * factor
+        self.errors = self.errors * np.abs(factor)
+        return self
+
+    def __itruediv__(self, factor):
+        self.data = self.data / factor
+        self.errors = self.errors / np.abs(factor)
+        return self
@@ -0,0 +1,99 @@
+#
+# post_analysis/pionpion/integral.py
+#
+"""
+Summed-volume tables (3D integral images) for constant time box sums.
+
+The table of an (nx, ny, nz) array holds at [i, j, k] the sum of all bins
+[:i, :j, :k], so the sum over any rectangular box is the signed sum of the
+table at the box's eight corners, and a projection onto one axis (or onto
+the plane of two axes) costs eight lookups per projected bin - independent
+of the size of the box.
+"""
+
+import numpy as np
+from itertools import product
+
+
+def slice_bounds(index, size):
+    """
+    Return the (start, stop) bin range of an index (slice with unit step,
+    or a single int) into an axis of length size
+    """
+    if isinstance(index, slice):
+        start, stop, step = index.indices(size)
+        if step != 1:
+            raise ValueError("Only contiguous slices may be summed (step %d)" % step)
+        return start, max(start, stop)
+    index = int(index)
+    if index < 0:
+        index += size
+    if not 0 <= index < size:
+        raise IndexError("Bin %d out of range of axis with %d bins" % (index, size))
+    return index, index + 1
+
+
+class SummedVolume:
+    """
+    Summed-volume table of a three dimensional array. Non-finite values
+    are summed as zero.
+    """
+
+    def __init__(self, data):
+        data = np.asarray(data, dtype=np.float64)
+        if data.ndim != 3:
+            raise ValueError("SummedVolume requires a 3D array (got shape %s)" % (data.shape, ))
+        self.shape = data.shape
+        table = np.zeros(tuple(n + 1 for n in data.shape))
+        inner = table[1:, 1:, 1:]
+        np.copyto(inner, data, where=np.isfinite(data))
+        for axis in range(3):
+            np.cumsum(inner, axis=axis, out=inner)
+        self.table = table
+
+    def bounds(self, slices):
+        """Return the (start, stop) ranges of three slices (or bin indices)"""
+        return [slice_bounds(s, n) for s, n in zip(slices, self.shape)]
+
+    def _box(self, x, y, z):
+        """
+        Sum of the boxes with corners x = (x0, x1) etc; bounds may be
+        arrays, giving an array of sums
+        """
+        T = self.table
+        total = 0.0
+        for (i, xi), (j, yj), (k, zk) in product(enumerate(x), enumerate(y), enumerate(z)):
+            # corners with an odd number of lower bounds (index 0) are subtracted
+            sign = 1.0 if (i + j + k) % 2 == 1 else -1.0
+            total = total + sign * T[xi, yj, zk]
+        return total
+
+    def sum(self, slices):
+        """Return the sum of the bins in the box selected by three slices"""
+        return float(self._box(*self.bounds(slices)))
+
+    def projection(self, axis, slices):
+        """
+        Return the sums over the other two axes of each bin of axis within
+        slices - the projection of the box onto axis
+        """
+        bounds = self.bounds(slices)
+        start, stop = bounds[axis]
+        lower = np.arange(start, stop)
+        bounds[axis] = (lower, lower + 1)
+        return np.asarray(self._box(*bounds), dtype=np.float64).reshape(stop - start)
+
+    def plane(self, axis, slices):
+        """
+        Return the sums along axis (within its slice) of each bin of the
+        other two axes within slices - the projection of the box onto the
+        plane of the other two axes
+        """
+        bounds = self.bounds(slices)
+        shape = []
+        for n, i in enumerate(i for i in range(3) if i != axis):
+            start, stop = bounds[i]
+            lower = np.arange(start, stop).reshape((-1, 1) if n == 0 else (1, -1))
+            bounds[i] = (lower, lower + 1)
+            shape.append(stop - start)
+        return np.array(np.broadcast_to(self._box(*bounds), shape), dtype=np.float64)
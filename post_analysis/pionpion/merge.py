@@ -0,0 +1,187 @@
+#
+# pionpion/merge.py
+#
+"""
+Merging of femtolists from several ROOT files (e.g. per-run grid outputs)
+by summing matching histograms, replacing an external hadd pass.
+"""
+
+import os
+import numpy as np
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+from .histogram import ArrayHistogram
+from .store import ArrayFemtolist
+
+
+def read_histogram_arrays(filename, listpath=None):
+    """
+    Read every histogram of every analysis in the femtolist of a file.
+
+    Returns an OrderedDict mapping analysis name to a dict with 'metadata'
+    and 'histograms', the latter mapping '/'-joined paths (see
+    Analysis.iter_histograms) to (data, variance, edges, title) tuples of
+    picklable numpy arrays. Run by the worker processes of MergedFemtolist.
+    """
+    from . import rootview
+    from .femtolist import Femtolist
+
+    result = OrderedDict()
+    for analysis in Femtolist(filename, listpath):
+        histograms = OrderedDict()
+        for path, hist in analysis.iter_histograms():
+            data = np.array(rootview.data_view(hist), dtype=np.float64)
+            sumw2 = rootview.sumw2_view(hist)
+            variance = np.abs(data) if sumw2 is None else np.array(sumw2)
+            histograms['/'.join(path)] = (data, variance, rootview.edges(hist), hist.GetTitle())
+        result[analysis.name] = {
+            'metadata': analysis.metadata,
+            'histograms': histograms,
+        }
+    return result
+
+
+class MergedFemtolist(ArrayFemtolist):
+    """
+    Femtolist made by summing the histograms of the femtolists found in
+    several files. Numerators, denominators (and every other histogram)
+    with the same analysis name and path are added bin-by-bin; errors are
+    added in quadrature.
+
+    Files are read by a pool of worker processes, each returning the arrays
+    of one file, which are reduced in place into preallocated arrays in
+    file order (so the result does not depend on worker scheduling). At
+    most two files per worker are submitted ahead of the reduction, which
+    bounds the memory held by finished results waiting for their turn.
+    Analyses are provided as StoreAnalysis objects.
+    """
+
+    def __init__(self, filenames, listpath=None, workers=None):
+        """
+        Parameters
+        ----------
+        filenames : list of str
+            Paths to the ROOT files to merge
+        listpath : str or list, optional
+            Path to the femtolist within the files (see Femtolist)
+        workers : int, optional
+            Number of reader processes; defaults to one per CPU. If 1,
+            files are read in this process.
+        """
+        self._filenames = list(filenames)
+        if not self._filenames:
+            raise ValueError("MergedFemtolist requires at least one file")
+
+        self._sums = OrderedDict()
+        self._analyses = OrderedDict()
+
+        if workers == 1:
+            for filename in self._filenames:
+                self._reduce(read_histogram_arrays(filename, listpath))
+        else:
+            max_pending = 2 * (workers or os.cpu_count() or 1)
+            pending = deque()
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for filename in self._filenames:
+                    pending.append(pool.submit(read_histogram_arrays, filename, listpath))
+                    if len(pending) >= max_pending:
+                        self._reduce(pending.popleft().result())
+                while pending:
+                    self._reduce(pending.popleft().result())
+
+        self._finalize()
+
+    def _reduce(self, file_arrays):
+        """Add arrays read from one file into the running sums"""
+        for name, analysis in file_arrays.items():
+            try:
+                sums = self._sums[name]
+            except KeyError:
+                sums = self._sums[name] = {
+                    'metadata': analysis['metadata'],
+                    'nfiles': 0,
+                    'histograms': OrderedDict(),
+                }
+            sums['nfiles'] += 1
+
+            for path, (data, variance, edges, title) in analysis['histograms'].items():
+                try:
+                    total_data, total_var, total_edges, _ = sums['histograms'][path]
+                except KeyError:
+                    sums['histograms'][path] = (np.zeros_like(data), np.zeros_like(variance),
+                                                edges, title)
+                    total_data, total_var, total_edges, _ = sums['histograms'][path]
+
+                if total_data.shape != data.shape or not all(map(np.array_equal, edges, total_edges)):
+                    raise ValueError("Binning of %s/%s does not match between files" % (name, path))
+
+                np.add(total_data, data, out=total_data)
+                np.add(total_var, variance, out=total_var)
+
+    def _finalize(self):
+        """Build the analysis entries from the summed arrays"""
+        for name, sums in self._sums.items():
+            histograms = OrderedDict()
+            kt_bins = OrderedDict()
+            for path, (data, variance, edges, title) in sums['histograms'].items():
+                np.sqrt(variance, out=variance)
+                histograms[path] = ArrayHistogram(data, variance, edges,
+                                                  name=path.rpartition('/')[2],
+                                                  title=title)
+                parts = path.split('/')
+                if len(parts) == 3:
+                    bins = kt_bins.setdefault(parts[0], [])
+                    if parts[1] not in bins:
+                        bins.append(parts[1])
+
+            self._analyses[name] = {
+                'name': name,
+                'metadata': sums['metadata'],
+                'nfiles': sums['nfiles'],
+                'kt_bins': kt_bins,
+                'histograms': histograms,
+            }
+        del self._sums
+
+    def map(self, func, names=None, workers=None):
+        """
+        Return list of func(analysis) for each analysis (or each of the
+        given names), in order. Unlike Femtolist.map this always runs
+        serially in this process - the merged histograms exist only here,
+        and rebuilding them in workers would mean merging the files again.
+        The workers argument is ignored, and accepted only so that either
+        kind of femtolist may be passed to the same code.
+        """
+        if names is None:
+            names = self.names()
+        return [func(self[name]) for name in names]
+
+    def load_histogram(self, hist):
+        # entries already hold the merged histograms
+        return hist
+
+    @property
+    def name(self):
+        return 'merged'
+
+    @property
+    def filenames(self):
+        """Paths of the merged ROOT files"""
+        return list(self._filenames)
+
+    source = filenames
+
+
+def open_femtolist(filenames, listpath=None, workers=None, **kw):
+    """
+    Open a comma separated string (or list) of filenames: a single file
+    returns a Femtolist, several files a MergedFemtolist of them.
+    """
+    if isinstance(filenames, str):
+        filenames = [name.strip() for name in filenames.split(',')]
+
+    if len(filenames) == 1:
+        from .femtolist import Femtolist
+        return Femtolist(filenames[0], listpath, **kw)
+    return MergedFemtolist(filenames, listpath, workers=workers)
@@ -0,0 +1,283 @@
+#
+# pionpion/metadata.py
+#
+"""
+Analysis settings parsing and the name/metadata derived properties shared
+by all analysis types. Does not require ROOT.
+"""
+
+import os
+import json
+from collections import defaultdict, namedtuple
+
+
+def settings_tree():
+    """
+    Nested defaultdict returned by parse_settings: a missing key is an
+    empty settings_tree. Defined at module level so it can be pickled,
+    e.g. returned by the reader processes of MergedFemtolist.
+    """
+    return defaultdict(settings_tree)
+
+
+def parse_settings(text):
+    """
+    Parse the text of an analysis' settings TObjString (lines of
+    'dotted.key=value', enclosed by a header and footer line) into a
+    settings_tree.
+    """
+    analysis_meta = settings_tree()
+
+    for s in text.split("\n")[1:-1]:
+        k, v = s.split('=')
+        keys = k.split('.')
+        k = analysis_meta
+        for key in keys[:-1]:
+            k = k[key]
+        k[keys[-1]] = v
+    return analysis_meta
+
+
+class AnalysisInfo:
+    """
+    Mixin providing properties derived from an analysis' name and metadata.
+    Subclasses provide the attributes `name` and `metadata`.
+    """
+
+    QINV_NUM_PATH = ['Num_qinv_pip', 'Num_qinv_pim']
+    QINV_DEN_PATH = ['Den_qinv_pip', 'Den_qinv_pim']
+    KT_BINNED_ANALYSIS_PATH = ['KT_Qinv']
+    KT_BINNED_Q3D_PATH = ['KT_Q3D']
+
+    Q3D_NUM_PATH = ['Num_q3D_pip', 'Num_q3D_pim']
+
+    @property
+    def title(self):
+        centrality_name = "%d-%d%%" % self.centrality_range
+        title = "%s (%s)" % (self.system_name, centrality_name)
+        return title.replace("π", "#pi")
+
+    @property
+    def centrality_range(self):
+        try:
+            return self._centrality_range
+        except AttributeError:
+            pass
+        self._centrality_range = tuple(map(float, self.name.split('_')[1:3]))
+        return self._centrality_range
+
+    @property
+    def pion_code(self):
+        """
+        Return the AliFemto code of the (first) pion type - 0 for π+, 1 for π-
+        """
+        try:
+            return self._pion_code
+        except AttributeError:
+            pass
+
+        pion_code = None
+        if self.metadata:
+            pp_info = self.metadata.get('AliFemtoAnalysisPionPion', {})
+        else:
+            pp_info = {'pion_1_type': 0}
+        if pp_info:
+            if 'pion_1_type' in pp_info:
+                pion_code = int(pp_info['pion_1_type'])
+            elif 'piontype' in pp_info:
+                pion_code = int(pp_info['piontype'])
+
+        self._pion_code = pion_code
+        return pion_code
+
+    @property
+    def system_name(self):
+        """
+        Returns the 'friendly' name of the particle system - could be π+, π-
+        """
+        return PION_NAMES[self.pion_code]
+
+    def has_q3d(self):
+        """
+        Return if the analysis has a three dimensional numerator histogram
+        """
+        return any(name in self for name in self.Q3D_NUM_PATH)
+
+
+PION_NAMES = {
+    0: "π^{+}",
+    1: "π^{-}",
+}
+
+PION_ALIASES = {
+    0: ("π^{+}", "π+", "pi+", "+", "pip", "+1"),
+    1: ("π^{-}", "π-", "pi-", "-", "pim", "-1"),
+}
+
+
+def pion_code(pion):
+    """
+    Return the pion code (0 or 1) of a pion given by code or name (any of
+    the aliases in PION_ALIASES, e.g. 'π+', 'pi-', 'pip').
+    """
+    if pion in PION_NAMES:
+        return pion
+    for code, aliases in PION_ALIASES.items():
+        if pion in aliases:
+            return code
+    raise ValueError("Unknown pion type %r" % (pion, ))
+
+
+class AnalysisRecord(namedtuple('AnalysisRecord', [
+        'name', 'index', 'centrality', 'pion', 'kt_bins', 'has_q3d', 'metadata'])):
+    """
+    Compact description of an analysis, used by MetadataIndex to select
+    analyses without loading their contents.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_analysis(cls, analysis, index):
+        return cls(name=analysis.name,
+                   index=index,
+                   centrality=analysis.centrality_range,
+                   pion=analysis.pion_code,
+                   kt_bins=tuple(analysis.kt_bin_names()),
+                   has_q3d=analysis.has_q3d(),
+                   metadata=analysis.metadata)
+
+    @property
+    def has_kt(self):
+        return bool(self.kt_bins)
+
+    def setting(self, dotted_key):
+        """Return the value of a (dotted) setting, or None if not present"""
+        value = self.metadata or {}
+        for key in dotted_key.split('.'):
+            if not isinstance(value, dict) or key not in value:
+                return None
+            value = value[key]
+        return value
+
+
+class MetadataIndex:
+    """
+    Index of the analyses of a femtolist, built once by reading only the
+    settings and key names of each analysis, and persisted in a JSON file
+    next to the source file (invalidated when the source's size or mtime
+    changes).
+    """
+
+    VERSION = 1
+    SUFFIX = '.meta.json'
+
+    def __init__(self, records):
+        self.records = list(records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __len__(self):
+        return len(self.records)
+
+    @classmethod
+    def build(cls, femtolist):
+        return cls(AnalysisRecord.from_analysis(analysis, i)
+                   for i, analysis in enumerate(femtolist))
+
+    @staticmethod
+    def _source_stat(source_path):
+        stat = os.stat(source_path)
+        return {'source_size': stat.st_size, 'source_mtime': stat.st_mtime}
+
+    @classmethod
+    def load(cls, path, source_path):
+        """
+        Load index from path; returns None if the file is missing, of an
+        older version or does not match the current state of source_path.
+        """
+        try:
+            with open(path) as index_file:
+                contents = json.load(index_file)
+            valid = (contents.get('version') == cls.VERSION
+                     and all(contents.get(k) == v
+                             for k, v in cls._source_stat(source_path).items()))
+        except (OSError, ValueError):
+            return None
+        if not valid:
+            return None
+
+        def to_record(r):
+            r['centrality'] = tuple(r['centrality'])
+            r['kt_bins'] = tuple(r['kt_bins'])
+            return AnalysisRecord(**r)
+
+        return cls(map(to_record, contents['records']))
+
+    def save(self, path, source_path):
+        contents = dict(self._source_stat(source_path),
+                        version=self.VERSION,
+                        records=[r._asdict() for r in self.records])
+        with open(path, 'w') as index_file:
+            json.dump(contents, index_file)
+
+    @classmethod
+    def for_femtolist(cls, femtolist, persist=True):
+        """
+        Return the index of femtolist, loading it from (or saving it to)
+        the file next to the femtolist's source if persist is True.
+        Failure to write the index file is not an error.
+        """
+        source_path = femtolist.filepath
+        path = source_path + cls.SUFFIX
+        if persist and os.path.isfile(source_path):
+            index = cls.load(path, source_path)
+            if index is not None:
+                return index
+
+        index = cls.build(femtolist)
+
+        if persist and os.path.isfile(source_path):
+            try:
+                index.save(path, source_path)
+            except OSError:
+                pass
+        return index
+
+    def select(self, centrality=None, pion=None, has_kt=None, has_q3d=None, settings=None):
+        """
+        Return the records of all analyses matching every given criterion.
+
+        Parameters
+        ----------
+        centrality : (float, float), optional
+            Select analyses whose centrality range lies within this range
+        pion : int or str, optional
+            Pion type, as code or name (see pion_code)
+        has_kt : bool, optional
+            Select analyses with (or without) kT-binned correlation functions
+        has_q3d : bool, optional
+            Select analyses with (or without) 3D correlation functions
+        settings : dict, optional
+            Map of dotted setting names to required (string) values
+        """
+        if pion is not None:
+            pion = pion_code(pion)
+
+        def matches(r):
+            if centrality is not None:
+                lo, hi = centrality
+                if not (lo <= r.centrality[0] and r.centrality[1] <= hi):
+                    return False
+            if pion is not None and r.pion != pion:
+                return False
+            if has_kt is not None and r.has_kt != has_kt:
+                return False
+            if has_q3d is not None and r.has_q3d != has_q3d:
+                return False
+            if settings:
+                return all(r.setting(k) == str(v) for k, v in settings.items())
+            return True
+
+        return [r for r in self.records if matches(r)]
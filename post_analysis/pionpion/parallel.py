@@ -0,0 +1,53 @@
+#
+# pionpion/parallel.py
+#
+"""
+Process-pool execution of independent per-analysis work over a femtolist.
+
+Worker processes never receive ROOT objects: each opens its own copy of
+the femtolist once (in the pool initializer) and is sent only analysis
+names. Results must be picklable and are returned in the order of the
+names, whatever the order the workers finish in.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+# femtolist opened by the pool initializer of a worker process
+_worker_femtolist = None
+
+
+def _init_worker(opener, args, kwargs):
+    global _worker_femtolist
+    _worker_femtolist = opener(*args, **kwargs)
+
+
+def _run(func, name):
+    return func(_worker_femtolist[name])
+
+
+def map_analyses(func, names, opener, args=(), kwargs=None, workers=None, chunksize=1):
+    """
+    Call func on the analysis of each name and return the list of results.
+
+    Parameters
+    ----------
+    func : callable
+        Function of one analysis; must be picklable (defined at module
+        level) as must its return value
+    names : iterable of str
+        Names of the analyses to process
+    opener : callable
+        Called as opener(*args, **kwargs) in each worker to open the
+        femtolist, e.g. the Femtolist class and the file path
+    workers : int, optional
+        Number of processes; defaults to one per CPU
+    chunksize : int
+        Number of names sent to a worker at once
+    """
+    names = list(names)
+    kwargs = kwargs or {}
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=_init_worker,
+                             initargs=(opener, args, kwargs)) as pool:
+        return list(pool.map(partial(_run, func), names, chunksize=chunksize))
@@ -10,51 +10,134 @@ import numpy as np
 import numpy.ma as ma
 from itertools import starmap
 from functools import partialmethod
-from stumpy import Histogram
+from collections import namedtuple
+from .histogram import ArrayHistogram
+from .integral import SummedVolume, slice_bounds
+from .sparse import SparseHistogram3D
+from .fit import fitfunc_3d_grid
+from .rootview import as_array_histogram, is_root_histogram
+
+
+class FitDomain(namedtuple('FitDomain', ['q', 'ratio', 'errors', 'num', 'den', 'index'])):
+    """
+    Compact arrays of the bins selected for a 3D fit (see Q3D.fit_domain).
+
+    q : (N, 3) array of bin centers (q_out, q_side, q_long)
+    ratio, errors : correlation function value and error of each bin
+    num, den : numerator and denominator counts of each bin
+    index : flat (C-order) index of each bin in the full histogram
+    """
+
+    __slots__ = ()
+
+    def __len__(self):
+        return len(self.ratio)
+
+
+def fold_axis(data, errors, edges, axis):
+    """
+    Merge the bins of data at negative coordinates of axis into their
+    mirror bins at positive coordinates, adding errors in quadrature.
+    The axis must be symmetric about zero; a central bin containing zero
+    (odd number of bins) is kept once. Returns the folded data, errors and
+    the edges of the remaining bins.
+    """
+    edges = np.asarray(edges)
+    if not np.allclose(edges, -edges[::-1]):
+        raise ValueError("Axis %d is not symmetric about zero - cannot fold" % axis)
+
+    n = len(edges) - 1
+    half = n // 2
+    d, e = np.moveaxis(data, axis, 0), np.moveaxis(errors, axis, 0)
+
+    folded = np.array(d[half:], dtype=np.float64)
+    folded[n % 2:] += d[:half][::-1]
+    err2 = np.square(e[half:], dtype=np.float64)
+    err2[n % 2:] += np.square(e[:half][::-1])
+
+    return (np.moveaxis(folded, 0, axis),
+            np.moveaxis(np.sqrt(err2), 0, axis),
+            edges[half:])
+
+
+class Q3DIntegrals(namedtuple('Q3DIntegrals', ['num', 'den', 'ratio', 'err2'])):
+    """
+    Summed-volume tables (see pionpion.integral.SummedVolume) of the
+    numerator, denominator, ratio and squared ratio errors of a Q3D.
+    """
+
+    __slots__ = ()
+
+
+class Q3DProjection2D(namedtuple('Q3DProjection2D', ['plane', 'bins', 'num', 'den', 'ratio'])):
+    """
+    Projection of a Q3D onto a plane (see Q3D.PLANES): the numerator and
+    denominator summed over the (start, stop) bins of the third axis, and
+    their ratio (zero where the denominator is empty, as TH1::Divide).
+    """
+
+    __slots__ = ()
 
 
 class Q3D:
     """
     Class wrapping a Q_{out,side,long} analysis - containing numerator and
     denominator histograms.
+
+    Unless do_sanity_check is False (for trusted inputs), the histograms
+    are checked for consistency on construction (see check_consistency).
     """
 
+    SANITY_DOMAIN = ((-.1, .1), (-.1, .1), (-.1, .1))
+
+    # axes merged by each mode of fold
+    FOLD_MODES = {
+        # q_side -> -q_side and q_long -> -q_long (LCMS symmetries)
+        'side_long': (1, 2),
+        # with the q -> -q inversion of identical particles
+        'octant': (0, 1, 2),
+    }
+
+    # the axis summed by the projection onto each plane
+    PLANES = {
+        'out_side': 2,
+        'out_long': 1,
+        'side_long': 0,
+    }
+
+    # the mode by which this Q3D was folded (None for the full cube)
+    folded = None
+
     def __init__(self, numerator, denominator, do_sanity_check=True):
-        from ROOT import TH1
         num_root, den_root = None, None
-        if isinstance(numerator, TH1):
+        if isinstance(numerator, SparseHistogram3D):
+            numerator = numerator.to_histogram()
+        if isinstance(denominator, SparseHistogram3D):
+            denominator = denominator.to_histogram()
+        # wrap ROOT histograms without copying their (large) bin buffers
+        if is_root_histogram(numerator):
             num_root = numerator
-            numerator = Histogram.BuildFromRootHist(numerator)
-        if isinstance(denominator, TH1):
+            numerator = as_array_histogram(numerator)
+        if is_root_histogram(denominator):
             den_root = denominator
-            denominator = Histogram.BuildFromRootHist(denominator)
+            denominator = as_array_histogram(denominator)
 
         self.num = numerator
         self.den = denominator
+        self.num._ptr = num_root
+        self.den._ptr = den_root
 
-        assert self.num.shape == self.den.shape
-        assert all(n[i] == d[i]
-                   for n, d in zip(self.num.axes, self.den.axes)
-                   for i in (2, 10, -2))
+        if do_sanity_check:
+            self.check_consistency()
 
         self.ratio = numerator / denominator
+        # the ratio exists only as arrays (see rootview.to_root_histogram)
+        self.ratio._ptr = None
         # ratio = numerator.Clone("ratio")
         # ratio.Divide(denominator)
         # self.ratio = Histogram.BuildFromRootHist(ratio)
         # self.ratio.errors = np.sqrt(self.ratio.data)
 
-
-        if do_sanity_check:
-            sanity_bins = self.num.get_slice((-.1, .1), (-.1, .1), (-.1, .1))
-            sanity_data = np.fromiter((
-                self.num[x, y, z]
-                for x in range(sanity_bins[0].start, sanity_bins[0].stop)
-                for y in range(sanity_bins[1].start, sanity_bins[1].stop)
-                for z in range(sanity_bins[2].start, sanity_bins[2].stop)
-            ), np.float64)
-            # simple sanity test
-            assert all(self.num[sanity_bins].flatten() == sanity_data)
-
         # store domain
         # ratio = self.num / self.den
         self.ratio_data = np.nan_to_num(self.ratio.data)  # self.num.data / self.den.data
@@ -66,11 +149,180 @@ class Q3D:
         #
         # self.ratio._ptr = numerator.Clone("_ptr")
         # self.ratio._ptr.Divide(numerator, denominator)
-        self.num._ptr = num_root
-        self.den._ptr = den_root
         # self.ratio._ptr = num_root
-        # print(self.ratio.data - self.ratio_data)
-        assert (self.ratio.data == self.ratio_data).all(), "Error %f" % (np.max(self.ratio.data - self.ratio_data))
+
+    @classmethod
+    def from_arrays(cls, num, den, edges, num_errors=None, den_errors=None,
+                    do_sanity_check=False):
+        """
+        Build from numerator and denominator arrays of shape (nx, ny, nz)
+        without ROOT.
+
+        edges is either one array of bin edges shared by all axes, or a
+        sequence of the three arrays. Errors default to the square root of
+        the counts. The arrays are used without copying, and (as they are
+        trusted) not checked unless do_sanity_check is True.
+        """
+        num, den = np.asarray(num), np.asarray(den)
+        if np.ndim(edges[0]) == 0:
+            edges = (edges, ) * 3
+        return cls(ArrayHistogram(num, num_errors, edges),
+                   ArrayHistogram(den, den_errors, edges),
+                   do_sanity_check=do_sanity_check)
+
+    @classmethod
+    def from_sparse(cls, num, den, q_max=None, do_sanity_check=False):
+        """
+        Build from SparseHistogram3D numerator and denominator, making dense
+        only the bins with |q_i| <= q_max on every axis - by default their
+        dense core blocks. Sparse histograms of every kT bin may then be
+        kept in memory, and a Q3D of the fit region built when needed.
+        """
+        if q_max is None:
+            box = num.core
+        else:
+            if np.ndim(q_max) == 0:
+                q_max = (q_max, ) * 3
+            box = tuple((-q, q) for q in q_max)
+        return cls(num.dense(*box), den.dense(*box), do_sanity_check=do_sanity_check)
+
+    def fold(self, mode='side_long'):
+        """
+        Return a new Q3D with the numerator and denominator merged into the
+        independent part of q-space under the symmetries of mode (a key of
+        FOLD_MODES): 'side_long' keeps q_side, q_long >= 0 (a quarter of
+        the bins), 'octant' additionally q_out >= 0 (an eighth).
+
+        Counts of mirror bins are added (errors in quadrature) and the
+        ratio recomputed from the merged counts; fits, fit domains and
+        projections of the result work on the folded axes as on any Q3D.
+        Folded histograms are cached per mode.
+        """
+        try:
+            axes = self.FOLD_MODES[mode]
+        except KeyError:
+            raise ValueError("Unknown fold mode %r (expected one of %s)"
+                             % (mode, ', '.join(self.FOLD_MODES)))
+        try:
+            return self._folds[mode]
+        except AttributeError:
+            self._folds = {}
+        except KeyError:
+            pass
+
+        hists = []
+        for hist in (self.num, self.den):
+            data, errors = hist.data, hist.errors
+            edges = [axis.edges for axis in hist.axes]
+            for axis in axes:
+                data, errors, edges[axis] = fold_axis(data, errors, edges[axis], axis)
+            hists.append(ArrayHistogram(data, errors, edges, name=hist.name, title=hist.title))
+
+        folded = Q3D(*hists, do_sanity_check=False)
+        folded.folded = mode
+        self._folds[mode] = folded
+        return folded
+
+    def check_consistency(self):
+        """
+        Raise ValueError if the numerator and denominator differ in shape or
+        axis edges, or - for histograms viewing ROOT buffers - if the array
+        contents differ from GetBinContent of the ROOT histogram at the
+        corners and center of the central region (see SANITY_DOMAIN).
+        """
+        if self.num.shape != self.den.shape:
+            raise ValueError("Numerator and denominator shapes do not match (%s ≠ %s)"
+                             % (self.num.shape, self.den.shape))
+        if self.num.ndim != 3:
+            raise ValueError("Q3D requires three dimensional histograms (got %s)"
+                             % (self.num.shape, ))
+        for i, (n, d) in enumerate(zip(self.num.axes, self.den.axes)):
+            if not np.array_equal(n.edges, d.edges):
+                raise ValueError("Numerator and denominator axis %d edges do not match" % i)
+
+        sanity_bins = self.num.get_slice(*self.SANITY_DOMAIN)
+        for hist in (self.num, self.den):
+            root_hist = getattr(hist, '_ptr', None)
+            if root_hist is None:
+                continue
+            corners = [(s.start, s.stop - 1) for s in sanity_bins if s.stop > s.start]
+            if len(corners) < 3:
+                continue
+            samples = [(x, y, z) for x in corners[0] for y in corners[1] for z in corners[2]]
+            samples.append(tuple((s.start + s.stop) // 2 for s in sanity_bins))
+            for x, y, z in samples:
+                # ROOT bin numbers start at 1 (0 is the underflow bin)
+                if hist.data[x, y, z] != root_hist.GetBinContent(x + 1, y + 1, z + 1):
+                    raise ValueError("Bin contents of %r do not match the ROOT histogram"
+                                     " at bin %s" % (hist.name, (x, y, z)))
+
+    def fit_domain(self, q_max=None, min_counts=0, exclude_zero_error=True, dtype=np.float64):
+        """
+        Return a FitDomain holding only the informative bins, for fitting
+        without iterating over (mostly empty) high-q bins.
+
+        Parameters
+        ----------
+        q_max : float or (float, float, float), optional
+            Select bins whose center satisfies |q_i| <= q_max (per axis)
+        min_counts : float
+            Minimum numerator and denominator counts of a selected bin;
+            bins with an empty denominator are never selected
+        exclude_zero_error : bool
+            Drop bins whose correlation function has zero error
+        dtype : numpy dtype
+            Floating point type of the returned arrays
+
+        Results are cached per selection, and returned read-only.
+        """
+        if q_max is not None and np.ndim(q_max) == 0:
+            q_max = (q_max, ) * 3
+        key = (None if q_max is None else tuple(map(float, q_max)),
+               min_counts, exclude_zero_error, np.dtype(dtype).str)
+
+        try:
+            return self._fit_domains[key]
+        except AttributeError:
+            self._fit_domains = {}
+        except KeyError:
+            pass
+
+        centers = [axis.bin_centers for axis in self.num.axes]
+        if q_max is None:
+            axis_masks = [np.ones(len(c), dtype=bool) for c in centers]
+        else:
+            axis_masks = [np.abs(c) <= q for c, q in zip(centers, q_max)]
+
+        # restrict to the bounding box of the q selection before masking bins
+        box = tuple(slice(m.argmax(), len(m) - m[::-1].argmax()) if m.any() else slice(0, 0)
+                    for m in axis_masks)
+        num, den = self.num.data[box], self.den.data[box]
+        x_mask, y_mask, z_mask = (m[b] for m, b in zip(axis_masks, box))
+        mask = x_mask[:, None, None] & y_mask[None, :, None] & z_mask[None, None, :]
+
+        mask &= (den > 0) & (den >= min_counts) & (num >= min_counts)
+        if exclude_zero_error:
+            mask &= self.ratio_err[box] != 0
+        mask &= np.isfinite(self.ratio_data[box])
+
+        selected = np.nonzero(mask)
+        full_index = tuple(s + b.start for s, b in zip(selected, box))
+
+        q = np.empty((len(selected[0]), 3), dtype=dtype)
+        for i, idx in enumerate(full_index):
+            q[:, i] = centers[i][idx]
+
+        domain = FitDomain(q=q,
+                           ratio=self.ratio_data[full_index].astype(dtype),
+                           errors=self.ratio_err[full_index].astype(dtype),
+                           num=np.asarray(num[selected], dtype=dtype),
+                           den=np.asarray(den[selected], dtype=dtype),
+                           index=np.ravel_multi_index(full_index, self.num.shape))
+        for array in domain:
+            array.setflags(write=False)
+
+        self._fit_domains[key] = domain
+        return domain
 
     def bins_to_slices(self,
                        x_domain=(None, None),
@@ -128,27 +380,168 @@ class Q3D:
     #     sum = data.sum(axis=(1, 2)) / (s[1].stop - s[1].start) / (s[2].stop - s[2].start)
     #     return sum
 
+    # quantities which may be summed (see integral, project_2d)
+    QUANTITIES = Q3DIntegrals._fields
+
+    def _quantity(self, of, box):
+        """
+        Return the bins of quantity 'num', 'den', 'ratio' or 'err2'
+        (squared ratio errors) within box, with empty (non finite) ratio
+        bins as zero
+        """
+        if of == 'num':
+            return self.num.data[box]
+        if of == 'den':
+            return self.den.data[box]
+        if of == 'ratio':
+            data = self.ratio.data[box]
+        elif of == 'err2':
+            data = np.square(self.ratio.errors[box])
+        else:
+            raise ValueError("Unknown quantity %r (expected one of %s)"
+                             % (of, ', '.join(self.QUANTITIES)))
+        return np.where(np.isfinite(data), data, 0.0)
+
+    def summed_volume(self, of='ratio'):
+        """
+        Return the summed-volume table (see pionpion.integral.SummedVolume)
+        of a quantity, building it on first use. Once built, sums over
+        boxes of that quantity use the table.
+        """
+        try:
+            tables = self._summed_volumes
+        except AttributeError:
+            tables = self._summed_volumes = {}
+        try:
+            return tables[of]
+        except KeyError:
+            pass
+        full = (slice(None), ) * 3
+        tables[of] = SummedVolume(self._quantity(of, full))
+        return tables[of]
+
+    def _table(self, of):
+        """Return the summed-volume table of quantity of, or None if not built"""
+        return getattr(self, '_summed_volumes', {}).get(of)
+
+    @property
+    def integrals(self):
+        """
+        Summed-volume tables of num, den, ratio and squared errors, built
+        on first access. Each is an (n+1)^3 float64 array, so this is
+        opt-in: worthwhile when projecting many boxes (e.g. scanning
+        windows), after which box sums and projections are a constant
+        number of lookups per bin, whatever the size of the box. Without
+        them (or summed_volume) boxes are summed directly.
+
+        Sums read from the tables are differences of running totals, which
+        carry a rounding error up to about n * eps times the total of the
+        whole cube (see tests/test_q3d.py).
+        """
+        return Q3DIntegrals(*map(self.summed_volume, self.QUANTITIES))
+
+    def _sum(self, of, kept, slices):
+        """
+        Sum quantity of over the box of slices (one per axis), keeping the
+        axes in kept - with the summed-volume table if it has been built
+        """
+        table = self._table(of)
+        if table is not None:
+            if not kept:
+                return table.sum(slices)
+            if len(kept) == 1:
+                return table.projection(kept[0], slices)
+            return table.plane(3 - sum(kept), slices)
+
+        box = tuple(slice(*slice_bounds(s, n)) for s, n in zip(slices, self.num.shape))
+        summed = tuple(i for i in range(3) if i not in kept)
+        return self._quantity(of, box).sum(axis=summed, dtype=np.float64)
+
+    def integral(self, x_slice=None, y_slice=None, z_slice=None, of='ratio'):
+        """
+        Return the sum of 'num', 'den', 'ratio' or 'err2' (squared ratio
+        errors) over the box given by one domain per axis
+        """
+        s = self.ratio.get_slice(x_slice, y_slice, z_slice)
+        return float(self._sum(of, (), s))
+
     def project(self, axis, x_slice, y_slice, z_slice):
-        reduce_axes = {0: (1, 2), 1: (0, 2), 2: (0, 1)}[axis]
-        data = self.ratio[x_slice, y_slice, z_slice]
-        sum = data.sum(axis=reduce_axes)
-        # sum = data.sum(axis=(1, 2)) / (s[1].stop - s[1].start) / (s[2].stop - s[2].start)
-        return sum[0]
+        """
+        Sum the ratio over the other two axes within the given domains,
+        returning one value per bin of axis within its domain
+        """
+        s = self.ratio.get_slice(x_slice, y_slice, z_slice)
+        return self._sum('ratio', (axis, ), s)
 
     # projection_out = partialmethod(lambda self, y_domain, z_domain: self.project(0, None, y_domain, z_domain))
     projection_out = partialmethod(project, axis=0, x_slice=None)
     projection_side = partialmethod(project, axis=1, y_slice=None)
     projection_long = partialmethod(project, axis=2, z_slice=None)
 
+    def project_model(self, params, axis, window=None, samples=None, model=fitfunc_3d_grid):
+        """
+        Project a 3D model onto axis in the same way as project projects the
+        data: summed over the bins of the other two axes within window.
+
+        Parameters
+        ----------
+        params : lmfit.Parameters
+            Parameters of the model (see pionpion.fit.fitfunc_3d)
+        axis : int
+            Axis projected onto (0 out, 1 side, 2 long)
+        window : pair of domains, optional
+            Domains of the other two axes (in axis order), defaults to the
+            whole axes
+        samples : int or array, optional
+            Points along axis at which to evaluate the curve: None for the
+            bin centers (matching the data projection bin by bin), a number
+            of points evenly spanning the axis, or the points themselves
+        model : callable
+            Called as model(params, q_out, q_side, q_long) with broadcast
+            coordinate arrays of the grid
+
+        Returns
+        -------
+        (x, curve) : the points along axis and the projected model
+        """
+        axes = self.ratio.axes
+        others = [i for i in range(3) if i != axis]
+        if window is None:
+            window = (None, None)
+
+        if samples is None:
+            x = axes[axis].bin_centers
+        elif np.ndim(samples) == 0:
+            x = np.linspace(axes[axis].edges[0], axes[axis].edges[-1], samples)
+        else:
+            x = np.asarray(samples, dtype=np.float64)
+
+        domains = [None, None, None]
+        for i, dom in zip(others, window):
+            domains[i] = dom
+        s = self.ratio.get_slice(*domains)
+
+        coords = [None, None, None]
+        coords[axis] = x
+        for i in others:
+            centers = axes[i].bin_centers[s[i]]
+            coords[i] = np.atleast_1d(centers)
+        grid = np.ix_(*coords)
+
+        curve = model(params, *grid)
+        return x, np.broadcast_to(curve, tuple(map(len, coords))).sum(axis=tuple(others))
+
     def projection_error(self, axis, x_slice, y_slice, z_slice):
         """
-        Project error along a 1D axis.
+        Project error along a 1D axis (errors of the summed bins are
+        added in quadrature).
         """
-        reduce_axes = {0: (1, 2), 1: (0, 2), 2: (0, 1)}[axis]
         s = self.ratio.get_slice(x_slice, y_slice, z_slice)
-        data = self.ratio.errors[s]
-        sum = np.sqrt((data ** 2).sum(axis=reduce_axes))[0]
-        return sum
+        err2 = self._sum('err2', (axis, ), s)
+        if self._table('err2') is not None:
+            # rounding of the table may leave empty projections slightly negative
+            err2 = np.maximum(err2, 0.0)
+        return np.sqrt(err2)
         # along_axis = 3 - (axes[0] + axes[1])
         # np.swapaxes(axes, 0, along_axis)
 
@@ -173,10 +566,7 @@ class Q3D:
     #     return sum
 
     def projection_side_error(self, x_domain=(-0.1, 0.1), z_domain=(-0.1, 0.1)):
-        x_domain, _, z_domain = self.ratio.get_slice(x_domain, None, z_domain)
-        data = self.ratio.errors[x_domain,:,z_domain]
-        sum = data.sum(axis=(0, 2))
-        return sum
+        return self.projection_error(1, x_domain, None, z_domain)
 
     # def projection_long(self, x_domain=(-0.1, 0.1), y_domain=(-0.1, 0.1)):
     #     data = self.ratio[x_domain,y_domain,:]
@@ -184,10 +574,7 @@ class Q3D:
     #     return sum
 
     def projection_long_error(self, x_domain=(-0.1, 0.1), y_domain=(-0.1, 0.1)):
-        x_domain, y_domain, _ = self.ratio.get_slice(x_domain, y_domain, None)
-        data = self.ratio.errors[x_domain, y_domain, :]
-        sum = data.sum(axis=(0, 1))
-        return sum
+        return self.projection_error(2, x_domain, y_domain, None)
 
     def get_projection(self, x_slice, y_slice, z_slice, summed_axes):
         """
@@ -197,17 +584,74 @@ class Q3D:
         sum = data.sum(axis=summed_axes)
         return sum
 
+    def _plane_axis(self, plane):
+        try:
+            return self.PLANES[plane]
+        except KeyError:
+            raise ValueError("Unknown plane %r (expected one of %s)"
+                             % (plane, ', '.join(self.PLANES))) from None
+
+    def project_2d(self, plane, domain=None, of='ratio'):
+        """
+        Sum 'num', 'den', 'ratio' or 'err2' over the domain of the axis
+        not in plane, returning a 2D array of every bin of the plane
+        """
+        axis = self._plane_axis(plane)
+        s = [slice(None)] * 3
+        s[axis] = self.ratio.axes[axis].get_slice(domain)
+        return self._sum(of, tuple(i for i in range(3) if i != axis), s)
+
     def projection_out_side(self, long_slice):
         # 2d projection x: out, y: side
-        data = self.ratio.project_2d(0, 1, long_slice)
-        return data
+        return self.project_2d('out_side', long_slice)
 
     def projection_out_long(self, side_slice):
         # 2d projection x: out, y: long
-        data = self.ratio.project_2d(0, 2, long_slice)
-        return data
+        return self.project_2d('out_long', side_slice)
 
     def projection_side_long(self, out_slice):
         # 2d projection x: side, y: long
-        data = self.ratio.project_2d(1, 2, out_slice)
-        return data
+        return self.project_2d('side_long', out_slice)
+
+    def projections_2d(self, widths=(1, 2, 3), planes=tuple(PLANES), center=0.0):
+        """
+        Project num and den onto each plane, summed over slabs of the third
+        axis around the bin containing center.
+
+        The slabs of every width are differences of running sums of num
+        and den along the third axis, computed once per plane and dropped
+        afterwards - no summed-volume table is built or kept.
+
+        Parameters
+        ----------
+        widths : sequence of int
+            Half widths of the slabs in bins; a width w sums the 2w+1 bins
+            centered on the bin of center (as SetRange(zz - w, zz + w))
+        planes : sequence of str
+            Keys of PLANES
+        center : float
+            Value of the third axis at the center of each slab
+
+        Returns
+        -------
+        dict
+            Map of (plane, width) to Q3DProjection2D
+        """
+        axes = [self._plane_axis(plane) for plane in planes]
+        result = {}
+        for plane, axis in zip(planes, axes):
+            running = []
+            for hist in (self.num, self.den):
+                data = np.moveaxis(hist.data, axis, 0)
+                total = np.zeros((len(data) + 1, ) + data.shape[1:])
+                np.cumsum(data, axis=0, dtype=np.float64, out=total[1:])
+                running.append(total)
+            middle = self.ratio.axes[axis].find_bin(center)
+            for width in widths:
+                bins = slice_bounds(slice(max(middle - width, 0), middle + width + 1),
+                                    len(self.ratio.axes[axis]))
+                num, den = (total[bins[1]] - total[bins[0]] for total in running)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    ratio = np.where(den != 0, num / den, 0.0)
+                result[plane, width] = Q3DProjection2D(plane, bins, num, den, ratio)
+        return result
@@ -0,0 +1,146 @@
+#
+# pionpion/rootview.py
+#
+"""
+Zero-copy numpy views over the bin buffers of ROOT TH1/TH2/TH3 histograms.
+
+ROOT stores the bins of an N-dimensional histogram in one flat array
+(including under and overflow bins) with the x index varying fastest. The
+functions here wrap that buffer with np.frombuffer and reshape/transpose it
+into an (x, y, z) indexed view, optionally stripping the flow bins, so no
+bin data is copied. Views are read-only unless writable=True is requested,
+in which case writes go straight into the ROOT histogram.
+"""
+
+import sys
+import numpy as np
+
+from .histogram import ArrayHistogram
+
+# numpy type of the bin content, by the final letter of the class name
+ROOT_HIST_DTYPES = {
+    'D': np.float64,
+    'F': np.float32,
+    'I': np.int32,
+    'S': np.int16,
+    'C': np.int8,
+}
+
+
+def is_root_histogram(obj):
+    """
+    Return True if obj is a ROOT TH1 (of any dimension). Does not import
+    ROOT - if it has not been loaded, obj cannot be a ROOT object.
+    """
+    if 'ROOT' not in sys.modules:
+        return False
+    from ROOT import TH1
+    return isinstance(obj, TH1)
+
+
+def hist_dtype(hist):
+    """Return the numpy dtype of the bins of ROOT histogram hist"""
+    try:
+        return np.dtype(ROOT_HIST_DTYPES[hist.ClassName()[-1]])
+    except KeyError:
+        raise TypeError("Unsupported histogram type %r" % hist.ClassName())
+
+
+def _flow_shape(hist):
+    axes = (hist.GetXaxis(), hist.GetYaxis(), hist.GetZaxis())
+    return tuple(axis.GetNbins() + 2 for axis in axes[:hist.GetDimension()])
+
+
+def _shaped_view(buffer, hist, dtype, writable, flow):
+    shape = _flow_shape(hist)
+    count = int(np.prod(shape))
+    array = np.frombuffer(buffer, dtype=dtype, count=count)
+    # x varies fastest in ROOT: reverse the C-order shape then transpose
+    array = array.reshape(shape[::-1]).T
+    if not flow:
+        array = array[(slice(1, -1), ) * len(shape)]
+    array.setflags(write=writable)
+    return array
+
+
+def data_view(hist, writable=False, flow=False):
+    """
+    Return a numpy view of the bin contents of hist, indexed (x, y, z).
+
+    Parameters
+    ----------
+    hist : ROOT.TH1
+        Histogram of any dimension with fixed-size bin type (D, F, I, S, C)
+    writable : bool
+        If True, the returned array may be written, modifying the histogram
+    flow : bool
+        Include the under and overflow bins
+    """
+    return _shaped_view(hist.GetArray(), hist, hist_dtype(hist), writable, flow)
+
+
+def sumw2_view(hist, writable=False, flow=False):
+    """
+    Return a numpy (float64) view of the sum of squared weights of hist, or
+    None if the histogram does not store them (see TH1::Sumw2).
+    """
+    if hist.GetSumw2N() == 0:
+        return None
+    return _shaped_view(hist.GetSumw2().GetArray(), hist, np.float64, writable, flow)
+
+
+def errors(hist, flow=False):
+    """
+    Return the bin errors of hist; unlike the views this allocates a new
+    array - sqrt(sumw2), or sqrt(|content|) if no weights are stored.
+    """
+    sumw2 = sumw2_view(hist, flow=flow)
+    if sumw2 is None:
+        return np.sqrt(np.abs(data_view(hist, flow=flow)))
+    return np.sqrt(sumw2)
+
+
+def edges(hist):
+    """Return list of bin-edge arrays, one per histogram dimension"""
+    axes = (hist.GetXaxis(), hist.GetYaxis(), hist.GetZaxis())
+    return [np.array([axis.GetBinLowEdge(i) for i in range(1, axis.GetNbins() + 2)])
+            for axis in axes[:hist.GetDimension()]]
+
+
+def as_array_histogram(hist, writable=False):
+    """
+    Wrap a ROOT histogram as an ArrayHistogram whose data is a view of the
+    ROOT buffer. Only the errors are computed into a new array. The ROOT
+    histogram is kept as the _ptr attribute, so it outlives the view.
+    """
+    result = ArrayHistogram(data_view(hist, writable=writable),
+                            errors(hist),
+                            edges(hist),
+                            name=hist.GetName(),
+                            title=hist.GetTitle())
+    result._ptr = hist
+    return result
+
+
+def to_root_histogram(hist, name=None):
+    """
+    Return a new ROOT TH1D/TH2D/TH3D with the axes, contents and errors of
+    ArrayHistogram hist, filled through writable views of its buffers
+    """
+    import ROOT
+    classes = {1: ROOT.TH1D, 2: ROOT.TH2D, 3: ROOT.TH3D}
+    try:
+        cls = classes[hist.ndim]
+    except KeyError:
+        raise ValueError("Cannot convert %d dimensional histogram to ROOT" % hist.ndim)
+
+    axis_args = []
+    for axis in hist.axes:
+        edges = np.ascontiguousarray(axis.edges, dtype=np.float64)
+        axis_args += [len(edges) - 1, edges]
+    root_hist = cls(hist.name if name is None else name, hist.title, *axis_args)
+    root_hist.Sumw2()
+    data_view(root_hist, writable=True)[...] = hist.data
+    sumw2_view(root_hist, writable=True)[...] = np.square(hist.errors)
+    root_hist.SetEntries(root_hist.GetEffectiveEntries())
+    return root_hist
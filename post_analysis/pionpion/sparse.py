@@ -0,0 +1,236 @@
+#
+# post_analysis/pionpion/sparse.py
+#
+"""
+Block-sparse storage of three dimensional (Q_osl) histograms.
+
+Bins near the origin (where the correlation signal and most pairs are) are
+kept as a dense core block; the mostly empty remainder is stored as the
+sorted flat (C-order) indices of its nonzero bins with their contents and
+errors. Boxes of bins are materialized as dense ArrayHistograms on demand,
+e.g. to build a Q3D of the fit region (see Q3D.from_sparse).
+"""
+
+import numpy as np
+
+from .histogram import ArrayAxis, ArrayHistogram
+from .integral import slice_bounds
+from .rootview import as_array_histogram, is_root_histogram
+
+
+class SparseHistogram3D:
+    """
+    3D histogram of a dense core block and a sparse list of the nonzero
+    bins outside of it.
+
+    Parameters
+    ----------
+    edges : sequence of three arrays
+        Bin edges of each axis
+    core : tuple of three slices
+        The bins stored densely
+    core_data, core_errors : ndarray
+        Contents and errors of the core bins
+    index : ndarray of int
+        Sorted flat indices of the stored bins outside the core
+    values, errors : ndarray
+        Contents and errors of the bins of index
+    """
+
+    def __init__(self, edges, core, core_data, core_errors, index, values, errors,
+                 name='', title=''):
+        self.axes = tuple(e if isinstance(e, ArrayAxis) else ArrayAxis(e) for e in edges)
+        self.core = tuple(slice(*slice_bounds(s, len(a))) for s, a in zip(core, self.axes))
+        self.core_data = core_data
+        self.core_errors = core_errors
+        self.index = np.asarray(index, dtype=np.int64)
+        self.values = values
+        self.errors = errors
+        self.name = name
+        self.title = title
+
+        core_shape = tuple(s.stop - s.start for s in self.core)
+        if core_data.shape != core_shape or core_errors.shape != core_shape:
+            raise ValueError("Core arrays do not match core bins %s" % (core_shape, ))
+        if not (len(self.index) == len(values) == len(errors)):
+            raise ValueError("Sparse index, values and errors lengths do not match")
+
+    @classmethod
+    def from_histogram(cls, hist, core_q=0.1):
+        """
+        Build from a dense 3D histogram (ArrayHistogram or ROOT histogram),
+        storing bins whose center satisfies |q_i| <= core_q on every axis
+        densely, and only the nonzero bins elsewhere
+        """
+        if is_root_histogram(hist):
+            hist = as_array_histogram(hist)
+        data, errors = np.asarray(hist.data), np.asarray(hist.errors)
+        if data.ndim != 3:
+            raise ValueError("SparseHistogram3D requires a 3D histogram (got shape %s)"
+                             % (data.shape, ))
+
+        core = []
+        for axis in hist.axes:
+            inside = np.flatnonzero(np.abs(axis.bin_centers) <= core_q)
+            core.append(slice(inside[0], inside[-1] + 1) if len(inside) else slice(0, 0))
+        core = tuple(core)
+
+        outside = (data != 0) | (errors != 0)
+        outside[core] = False
+        index = np.flatnonzero(outside)
+        return cls([axis.edges for axis in hist.axes],
+                   core,
+                   np.array(data[core]),
+                   np.array(errors[core]),
+                   index,
+                   data.ravel()[index],
+                   errors.ravel()[index],
+                   name=getattr(hist, 'name', ''),
+                   title=getattr(hist, 'title', ''))
+
+    @property
+    def shape(self):
+        return tuple(len(a) for a in self.axes)
+
+    @property
+    def ndim(self):
+        return 3
+
+    @property
+    def x_axis(self):
+        return self.axes[0]
+
+    @property
+    def y_axis(self):
+        return self.axes[1]
+
+    @property
+    def z_axis(self):
+        return self.axes[2]
+
+    @property
+    def nbytes(self):
+        """Memory held by the bin contents and errors"""
+        return sum(a.nbytes for a in (self.core_data, self.core_errors,
+                                      self.index, self.values, self.errors))
+
+    def __repr__(self):
+        return "<SparseHistogram3D %r %s (%d sparse bins)>" % (self.name, self.shape, len(self.index))
+
+    get_slice = ArrayHistogram.get_slice
+
+    def _box(self, domains):
+        """Return (start, stop) bins of each axis and the axes given by int"""
+        slices = self.get_slice(*domains)
+        return ([slice_bounds(s, len(a)) for s, a in zip(slices, self.axes)],
+                tuple(i for i, s in enumerate(slices) if not isinstance(s, slice)))
+
+    def _coords(self):
+        return np.unravel_index(self.index, self.shape)
+
+    def _sparse_in_box(self, box):
+        """Return the coordinates (relative to box) and mask of sparse bins in box"""
+        coords = self._coords()
+        mask = np.ones(len(self.index), dtype=bool)
+        for c, (start, stop) in zip(coords, box):
+            mask &= (start <= c) & (c < stop)
+        return [c[mask] - start for c, (start, _) in zip(coords, box)], mask
+
+    def _core_overlap(self, box):
+        """Return the slices of the core overlap in box and in the core arrays"""
+        in_box, in_core = [], []
+        for (start, stop), c in zip(box, self.core):
+            lo, hi = max(start, c.start), min(stop, c.stop)
+            hi = max(lo, hi)
+            in_box.append(slice(lo - start, hi - start))
+            in_core.append(slice(lo - c.start, hi - c.start))
+        return tuple(in_box), tuple(in_core)
+
+    def dense(self, x_domain=None, y_domain=None, z_domain=None):
+        """
+        Return the bins within the domains (see ArrayHistogram.get_slice)
+        as a dense ArrayHistogram
+        """
+        box, _ = self._box((x_domain, y_domain, z_domain))
+        shape = tuple(stop - start for start, stop in box)
+        data = np.zeros(shape, dtype=self.core_data.dtype)
+        errors = np.zeros(shape, dtype=self.core_errors.dtype)
+
+        in_box, in_core = self._core_overlap(box)
+        data[in_box] = self.core_data[in_core]
+        errors[in_box] = self.core_errors[in_core]
+
+        coords, mask = self._sparse_in_box(box)
+        data[tuple(coords)] = self.values[mask]
+        errors[tuple(coords)] = self.errors[mask]
+
+        edges = [a.edges[start:stop + 1] for a, (start, stop) in zip(self.axes, box)]
+        return ArrayHistogram(data, errors, edges, name=self.name, title=self.title)
+
+    def to_histogram(self):
+        """Return the full dense ArrayHistogram"""
+        return self.dense()
+
+    def __getitem__(self, idx):
+        """Return bin contents in the given domain (see ArrayHistogram.__getitem__)"""
+        if not isinstance(idx, tuple):
+            idx = (idx, )
+        idx += (None, ) * (3 - len(idx))
+        _, int_axes = self._box(idx)
+        data = self.dense(*idx).data
+        return data.reshape(tuple(n for i, n in enumerate(data.shape) if i not in int_axes))
+
+    def projection(self, axis, x_domain=None, y_domain=None, z_domain=None):
+        """
+        Return the sums over the other two axes (within their domains) of
+        each bin of axis within its domain
+        """
+        box, _ = self._box((x_domain, y_domain, z_domain))
+        length = box[axis][1] - box[axis][0]
+        others = tuple(i for i in range(3) if i != axis)
+
+        in_box, in_core = self._core_overlap(box)
+        result = np.zeros(length)
+        result[in_box[axis]] = self.core_data[in_core].sum(axis=others)
+
+        coords, mask = self._sparse_in_box(box)
+        result += np.bincount(coords[axis], weights=self.values[mask], minlength=length)
+        return result
+
+    def sum(self, x_domain=None, y_domain=None, z_domain=None):
+        """Return the sum of the bins within the domains"""
+        return float(self.projection(0, x_domain, y_domain, z_domain).sum())
+
+    def _lookup(self, index, array):
+        """Return the sparse values of array at the flat indices (0 where absent)"""
+        if len(self.index) == 0:
+            return np.zeros(len(index), dtype=array.dtype)
+        pos = np.minimum(np.searchsorted(self.index, index), len(self.index) - 1)
+        found = self.index[pos] == index
+        return np.where(found, array[pos], 0)
+
+    def __truediv__(self, other):
+        """
+        Bin-by-bin ratio with a histogram of the same axes and core (errors
+        propagated as ArrayHistogram.__truediv__). Outside the core the
+        ratio is stored only where the divisor is nonzero.
+        """
+        if not isinstance(other, SparseHistogram3D):
+            return NotImplemented
+        if (any(a != b for a, b in zip(self.axes, other.axes)) or self.core != other.core):
+            raise ValueError("Histogram axes or core blocks do not match")
+
+        def divide(a, ae, b, be):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return a / b, np.hypot(ae / b, a * be / b ** 2)
+
+        core_data, core_errors = divide(self.core_data, self.core_errors,
+                                        other.core_data, other.core_errors)
+
+        keep = other.values != 0
+        index = other.index[keep]
+        values, errors = divide(self._lookup(index, self.values),
+                                self._lookup(index, self.errors),
+                                other.values[keep], other.errors[keep])
+        return SparseHistogram3D(self.axes, self.core, core_data, core_errors,
+                                 index, values, errors, name=self.name, title=self.title)
@@ -0,0 +1,369 @@
+#
+# pionpion/store.py
+#
+"""
+Columnar on-disk copy of a femtolist.
+
+A femtolist is exported into a directory holding one subdirectory per
+histogram, each containing contiguous .npy arrays (data.npy, errors.npy and
+one axisN.npy of bin edges per dimension), plus a JSON manifest listing the
+analyses, their kT bins and metadata. StoreFemtolist reads such a directory
+back without ROOT, memory-mapping the arrays so histograms are only paged in
+when used and pages may be shared between processes.
+"""
+
+import os
+import json
+import time
+import numpy as np
+from collections import OrderedDict
+
+from . import rootview
+from .femtolist import Femtolist
+from .histogram import ArrayHistogram
+from .metadata import AnalysisInfo, MetadataIndex
+
+MANIFEST_FILENAME = 'manifest.json'
+STORE_FORMAT_VERSION = 1
+
+
+def root_hist_arrays(hist):
+    """Return data, errors and edges arrays of a ROOT histogram"""
+    return rootview.data_view(hist), rootview.errors(hist), rootview.edges(hist)
+
+
+def export_femtolist(femtolist, directory, overwrite=False):
+    """
+    Write all histograms of a femtolist (see Analysis.iter_histograms) into
+    directory, along with the manifest describing them.
+
+    Parameters
+    ----------
+    femtolist : Femtolist or str
+        Femtolist to export, or the path to a ROOT file containing one
+    directory : str
+        Destination directory, created if it does not exist
+    overwrite : bool
+        Allow writing into a directory which already has a manifest
+
+    Returns
+    -------
+    str
+        Path to the written manifest
+    """
+    if not isinstance(femtolist, Femtolist):
+        femtolist = Femtolist(femtolist)
+
+    manifest_path = os.path.join(directory, MANIFEST_FILENAME)
+    if os.path.exists(manifest_path) and not overwrite:
+        raise ValueError("Store already exists at %r" % (directory))
+    os.makedirs(directory, exist_ok=True)
+
+    try:
+        source_mtime = os.path.getmtime(femtolist.filepath)
+    except OSError:
+        source_mtime = None
+
+    manifest = {
+        'format': STORE_FORMAT_VERSION,
+        'name': femtolist.name,
+        'source': femtolist.filepath,
+        'source_mtime': source_mtime,
+        'created': time.time(),
+        'analyses': [],
+    }
+
+    for analysis in femtolist:
+        entry = {
+            'name': analysis.name,
+            'metadata': analysis.metadata,
+            'kt_bins': OrderedDict(),
+            'histograms': OrderedDict(),
+        }
+
+        for path, hist in analysis.iter_histograms():
+            data, errors, edges = root_hist_arrays(hist)
+            hist_dir = os.path.join(analysis.name, *path)
+            os.makedirs(os.path.join(directory, hist_dir), exist_ok=True)
+
+            def save(name, array):
+                np.save(os.path.join(directory, hist_dir, name),
+                        np.ascontiguousarray(array))
+
+            save('data.npy', data)
+            save('errors.npy', errors)
+            for i, axis_edges in enumerate(edges):
+                save('axis%d.npy' % i, axis_edges)
+
+            entry['histograms']['/'.join(path)] = {
+                'dir': hist_dir,
+                'title': hist.GetTitle(),
+                'shape': list(np.shape(data)),
+                'dtype': str(np.asarray(data).dtype),
+            }
+            if len(path) == 3:
+                kt_bins = entry['kt_bins'].setdefault(path[0], [])
+                if path[1] not in kt_bins:
+                    kt_bins.append(path[1])
+
+        manifest['analyses'].append(entry)
+
+    with open(manifest_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+
+    return manifest_path
+
+
+class ArrayFemtolist:
+    """
+    Femtolist-compatible collection of analyses held as manifest-style
+    entries (dicts of name, metadata, kt_bins and histograms), provided as
+    StoreAnalysis objects. Subclasses set _analyses, mapping analysis name
+    to entry, and implement load_histogram to build the ArrayHistogram of
+    a histogram entry.
+    """
+
+    def __iter__(self):
+        for entry in self._analyses.values():
+            yield StoreAnalysis(self, entry)
+
+    def __len__(self):
+        return len(self._analyses)
+
+    def __getitem__(self, idx):
+        """
+        Return an analysis object either by numerical index or by name.
+        If no analysis exists, an KeyError is raised.
+        """
+        entries = list(self._analyses.values())
+        try:
+            if isinstance(idx, int):
+                entry = entries[idx]
+            elif isinstance(idx, str):
+                entry = self._analyses[idx]
+            elif isinstance(idx, slice):
+                return [StoreAnalysis(self, e) for e in entries[idx]]
+            else:
+                entry = None
+        except (KeyError, IndexError):
+            entry = None
+
+        if entry is None:
+            raise KeyError("No analysis found with index `{}`".format(idx))
+
+        return StoreAnalysis(self, entry)
+
+    @property
+    def index(self):
+        """MetadataIndex of the analyses (built from their entries)"""
+        try:
+            return self._index
+        except AttributeError:
+            pass
+        self._index = MetadataIndex.build(self)
+        return self._index
+
+    def select(self, **criteria):
+        """
+        Return list of analyses matching criteria (see MetadataIndex.select)
+        """
+        return [self[record.name] for record in self.index.select(**criteria)]
+
+    def names(self):
+        """Return list of the names of all analyses"""
+        return list(self._analyses)
+
+    def load_histogram(self, info):
+        raise NotImplementedError
+
+
+class StoreFemtolist(ArrayFemtolist):
+    """
+    Femtolist-compatible reader of a directory written by export_femtolist.
+
+    Histograms are returned as ArrayHistogram objects whose arrays are
+    memory-mapped with the given mmap_mode (None loads them into memory).
+    """
+
+    def __init__(self, directory, mmap_mode='r'):
+        manifest_path = os.path.join(directory, MANIFEST_FILENAME)
+        try:
+            with open(manifest_path) as manifest_file:
+                manifest = json.load(manifest_file)
+        except FileNotFoundError:
+            raise ValueError("Could not find a femtolist store in %r" % (directory))
+
+        if manifest.get('format') != STORE_FORMAT_VERSION:
+            raise ValueError("Unsupported store format %r" % manifest.get('format'))
+
+        self._directory = directory
+        self._manifest = manifest
+        self._mmap_mode = mmap_mode
+        self._analyses = OrderedDict((a['name'], a) for a in manifest['analyses'])
+
+    @property
+    def name(self):
+        return self._manifest['name']
+
+    @property
+    def filepath(self):
+        return self._directory
+
+    @property
+    def filename(self):
+        return os.path.basename(os.path.normpath(self._directory))
+
+    @property
+    def source(self):
+        """Path of the ROOT file the store was exported from"""
+        return self._manifest['source']
+
+    def map(self, func, names=None, workers=None):
+        """
+        Return list of func(analysis) for each analysis (or each of the
+        given names), in order, computed by a pool of worker processes
+        (see Femtolist.map). Workers memory-map the same files, so the
+        arrays are shared through the page cache.
+        """
+        if names is None:
+            names = self.names()
+        if workers == 1:
+            return [func(self[name]) for name in names]
+
+        from .parallel import map_analyses
+        return map_analyses(func, names, StoreFemtolist,
+                            args=(self._directory, self._mmap_mode),
+                            workers=workers)
+
+    def load_histogram(self, info):
+        """Build the ArrayHistogram described by a manifest histogram entry"""
+        hist_dir = os.path.join(self._directory, info['dir'])
+
+        def load(name):
+            return np.load(os.path.join(hist_dir, name), mmap_mode=self._mmap_mode)
+
+        edges = [load('axis%d.npy' % i) for i in range(len(info['shape']))]
+        return ArrayHistogram(load('data.npy'),
+                              load('errors.npy'),
+                              edges,
+                              name=os.path.basename(info['dir']),
+                              title=info['title'])
+
+
+class StoreCollection:
+    """
+    A kT bin of a stored analysis - provides GetName and path lookup in the
+    manner of the ROOT collections it replaces.
+    """
+
+    def __init__(self, analysis, prefix):
+        self._analysis = analysis
+        self._prefix = prefix
+
+    def GetName(self):
+        return self._prefix[-1]
+
+    def get(self, path):
+        return self._analysis.get(path, prefix=self._prefix)
+
+    __getitem__ = get
+
+    def __iter__(self):
+        yield from self._analysis._iter_histograms(self._prefix)
+
+
+class StoreAnalysis(AnalysisInfo):
+    """
+    Analysis read from a femtolist store, providing the same accessors as
+    pionpion.Analysis but returning (memory-mapped) ArrayHistograms.
+    """
+
+    def __init__(self, store, entry):
+        self._store = store
+        self._entry = entry
+        self._histograms = entry['histograms']
+        self._loaded = {}
+
+    @property
+    def name(self):
+        return self._entry['name']
+
+    @property
+    def metadata(self):
+        return self._entry['metadata']
+
+    def _load(self, key):
+        try:
+            return self._loaded[key]
+        except KeyError:
+            pass
+        hist = self._store.load_histogram(self._histograms[key])
+        self._loaded[key] = hist
+        return hist
+
+    def _iter_histograms(self, prefix=()):
+        depth = len(prefix) + 1
+        for key in self._histograms:
+            path = tuple(key.split('/'))
+            if len(path) == depth and path[:-1] == prefix:
+                yield self._load(key)
+
+    def __iter__(self):
+        """Iterate over all top-level histograms"""
+        yield from self._iter_histograms()
+
+    def get(self, path, prefix=()):
+        """
+        Return the histogram (or kT collection) at path. As with
+        get_root_object, a string path may be separated by dots and a list
+        of paths is tried in order. Returns None if nothing is found.
+        """
+        paths = [path] if isinstance(path, str) else path
+        for p in paths:
+            full = prefix + tuple(p.split('.'))
+            key = '/'.join(full)
+            if key in self._histograms:
+                return self._load(key)
+            if len(full) == 1 and full[0] in self._entry['kt_bins']:
+                return [StoreCollection(self, (full[0], name))
+                        for name in self._entry['kt_bins'][full[0]]]
+            if len(full) == 2 and full[1] in self._entry['kt_bins'].get(full[0], ()):
+                return StoreCollection(self, full)
+        return None
+
+    def __getitem__(self, name):
+        return self.get(name)
+
+    def __contains__(self, name):
+        return name in self._histograms or name in self._entry['kt_bins']
+
+    histogram = get
+
+    def has_kt_bins(self):
+        return any(name in self._entry['kt_bins']
+                   for name in self.KT_BINNED_ANALYSIS_PATH)
+
+    @property
+    def qinv_pair(self):
+        return self[self.QINV_NUM_PATH], self[self.QINV_DEN_PATH]
+
+    @property
+    def kt_binned_pairs(self):
+        """
+        Return list of the kT bins, each a StoreCollection
+        """
+        return self[self.KT_BINNED_ANALYSIS_PATH] or ()
+
+    def kt_bin_names(self):
+        for name in self.KT_BINNED_ANALYSIS_PATH:
+            if name in self._entry['kt_bins']:
+                return list(self._entry['kt_bins'][name])
+        return []
+
+    def qinv_pair_in_kt_bin(self, idx):
+        kt_bins = self.kt_binned_pairs
+        if isinstance(idx, str):
+            kt_bin = next(b for b in kt_bins if b.GetName() == idx)
+        else:
+            kt_bin = kt_bins[idx]
+        return kt_bin.get(self.QINV_NUM_PATH), kt_bin.get(self.QINV_DEN_PATH)
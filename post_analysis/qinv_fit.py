@@ -22,17 +22,24 @@ from rootpy.plotting import HistStack
 from rootpy.plotting.utils import draw
 
 from stumpy import Histogram
-from pionpion import Femtolist
+from pionpion.cache import default_cache
+from pionpion.merge import open_femtolist
+from pionpion.rootview import is_root_histogram, to_root_histogram
 from pionpion.fit import fitfunc_qinv, fitfunc_qinv_gauss_ll
 from post_analysis.fitting.gaussian import (
     GaussianModel,
     GaussianModelCoulomb,
     GaussianModelFSI,
 )
+from post_analysis.fitting.objective import QinvResidual, QinvLogLikelihood
+from post_analysis.fitting.fitcache import FitCache, histogram_arrays
 from momentum_correction_by_division import Corrections
 
 import ROOT  # import root last
 
+# range of q_inv fitted by simple_fit
+FIT_RANGE = (1, 0.16)
+
 
 def argument_parser():
     parser = ArgumentParser('qinv_fit.py')
@@ -61,12 +68,20 @@ def argument_parser():
     parser.add_argument("--use-ll",
                         action='store_true',
                         help="Uses the log-likelihood fitting procedure")
+    parser.add_argument("--no-fit-cache",
+                        action='store_true',
+                        help="Always repeat the fits, instead of reusing cached results")
     parser.add_argument("--do-ktbin",
                         action='store_true',
                         help="Processes all kt-binned correlation functions (if any)")
+    parser.add_argument("--workers",
+                        type=int,
+                        default=None,
+                        help="Number of processes reading the files to merge "
+                             "(default: one per CPU)")
     parser.add_argument("datafile", help="ROOT filename to analyze. "
-                                         "Separate filenames by commas if you want more than"
-                                         "one file in femtolist")
+                                         "Separate filenames by commas to merge the "
+                                         "femtolists of several files")
     parser.add_argument("output_filename",
                         nargs='?',
                         default=None,
@@ -76,13 +91,12 @@ def argument_parser():
     return parser
 
 
-def simple_fit(ratio, ModelClass=GaussianModelFSI, fit_range=(1, 0.16)):
+def simple_fit(ratio, ModelClass=GaussianModelFSI, fit_range=FIT_RANGE):
     qinv_params = ModelClass.guess()
     fit_slice = ratio.x_axis.get_slice(fit_range)
     x = ratio.x_axis.bin_centers[fit_slice]
-    return minimize(ModelClass.as_resid,
-                    qinv_params,
-                    args=(x, ratio[fit_slice], ratio.errors[fit_slice]))
+    objective = QinvResidual(ModelClass, x, ratio[fit_slice], ratio.errors[fit_slice])
+    return minimize(objective, qinv_params, Dfun=objective.jacobian)
 
 
 def loglikely_fit(num, den, ModelClass=GaussianModelFSI, fit_range=(0, 0.16)):
@@ -94,7 +108,8 @@ def loglikely_fit(num, den, ModelClass=GaussianModelFSI, fit_range=(0, 0.16)):
         ModelClass (type): Subclass of lmfit.Model, implementing the
             classmethod `as_loglike` which accepts lmfit parameters
             and the numerator/deonimator pair; this method is used in
-            the lmfit.minimize function.
+            the lmfit.minimize function, with its Jacobian
+            `as_loglike_jacobian`.
         fit_range (Tuple): Tuple containing beginning and ending qinv
             points, defining the domain of the fit.
     """
@@ -103,9 +118,8 @@ def loglikely_fit(num, den, ModelClass=GaussianModelFSI, fit_range=(0, 0.16)):
     fit_slice = ratio.x_axis.get_slice(fit_range)
     x = ratio.x_axis.bin_centers[fit_slice]
 
-    qinv_fit = minimize(ModelClass.as_loglike,
-                        qinv_params,
-                        args=(x, num[fit_slice], den[fit_slice]))
+    objective = QinvLogLikelihood(ModelClass, x, num[fit_slice], den[fit_slice])
+    qinv_fit = minimize(objective, qinv_params, Dfun=objective.jacobian)
     return qinv_fit
 
 
@@ -260,11 +274,22 @@ def main(argv):
     norm_x_range = tuple(map(float, args.norm_range.split(':')))
     output_domain = tuple(map(float, args.output_domain.split(':')))
 
+    # results of identical fits (same data, model, ranges and method) are reused
+    fit_cache = FitCache(enabled=not args.no_fit_cache)
+
+    def cached_simple_fit(ratio):
+        return fit_cache.fit(lambda: simple_fit(ratio),
+                             histogram_arrays(ratio),
+                             GaussianModelFSI,
+                             fit_range=FIT_RANGE,
+                             norm_range=norm_x_range,
+                             method=simple_fit.__name__)
+
     # get filenames separated by commas
     femtolist_names = tuple(map(str.strip, args.datafile.split(',')))
 
-    # create the femtolist(s) from the input file(s)
-    femtolists = tuple(map(Femtolist, femtolist_names))
+    # create the femtolist from the input file, or merge several
+    femtolist = open_femtolist(femtolist_names, workers=args.workers, cache=default_cache)
 
     # generate filename from (first) input name
     if args.output_filename is None:
@@ -277,86 +302,82 @@ def main(argv):
     else:
         output_file = ROOT.TFile(args.output_filename, 'RECREATE')
 
-    # loop through each file
-    for femtolist in femtolists:
-        # if multiple inputs, store in multiple 'subdirs'
-        if len(femtolists) == 1:
-            d = output_file
-        else:
-            d = output_file.mkdir(femtolist.filename.rstrip(".root"))
-
-        # Create fit object from each analysis in femtolist
-        for analysis in femtolist:
-
-            d.mkdir(analysis.name).cd()
-
-            num, den = analysis.qinv_pair
-            ratio = num / den
-            ratio.title = "Corrected Correlation Function"
-            print(ratio.errors[:5])
-            if corrections:
-                norm_correction = corrections[analysis.name]
-                assert ratio.shape == norm_correction.shape, \
-                       "{} ≠ {}".format(ratio.shape, norm_correction.shape)
-                ratio *= norm_correction
-            print(ratio.errors[:5])
-
-            fit_res = simple_fit(ratio)
-            report_fit(fit_res)
-
-            # import matplotlib.pyplot as plt
-            # plt.errorbar(x=list(range(30)), y=ratio.data[:30], yerr=ratio.errors[:30])
-            # plt.plot(GaussianModelFSI.gauss(
-            #     ratio.x_axis.bin_centers[:30],
-            #     **fit_res.params))
-            # plt.show()
-
-
-            num, den = analysis[analysis.QINV_NUM_PATH], analysis[analysis.QINV_DEN_PATH]
-
-            # create ratio
-            root_ratio = num.Clone()
-            root_ratio.SetTitle("Corrected Correlation Function")
-            root_ratio.Divide(den)
-
-            # apply correction
-            if corrections:
-                norm_correction = corrections[analysis.name]
-                assert num.GetNbinsX() == den.GetNbinsX() == norm_correction.shape[0]
-                for i, c in enumerate(norm_correction, 1):
-                    x = root_ratio.GetBinContent(i)
-                    e = root_ratio.GetBinError(i)
-                    root_ratio.SetBinContent(i, x * c)
-                    root_ratio.SetBinError(i, e * c)
-                root_ratio.Write("CorrelationFunction")
-
-            #
-            fit_res = simple_fit(Histogram.BuildFromRootHist(root_ratio))
-            report_fit(fit_res)
-
-            x = np.linspace(0, 1.0, 300)
-            y = GaussianModelFSI.gauss(x, **fit_res.params)
-            plot = ROOT.TGraph(len(x), x, y)
-            plot.Write("FitPlot")
-            # x = np.copy(ratio.x_axis.bin_centers[:30])
-            # y = np.copy(GaussianModelFSI.gauss(x, **fit_res.params))
-            # ye = np.copy(np.sqrt(np.mean(data[2] ** 2, axis=1)))
-            #
-            # fit_plot = ROOT.TGraphErrors(len(x), x, y, np.zeros(len(x)), ye)
-            # plt.plot(
-            #     ratio.x_axis.bin_centers[:30],
-            #     **fit_res.params))
-            # qfit = QinvFit(analysis, args)
-            # report_fit(qfit.fit_res)
-
-            # o = d.mkdir(analysis.name)
-            # print('.>.', o)
-            # if o != None:
-            #     qfit.write(o)
-            #     print('wrote', qfit)
+    # Create fit object from each analysis in femtolist
+    for analysis in femtolist:
+
+        output_file.mkdir(analysis.name).cd()
+
+        num, den = analysis.qinv_pair
+        ratio = num / den
+        ratio.title = "Corrected Correlation Function"
+        print(ratio.errors[:5])
+        if corrections:
+            norm_correction = corrections[analysis.name]
+            assert ratio.shape == norm_correction.shape, \
+                   "{} ≠ {}".format(ratio.shape, norm_correction.shape)
+            ratio *= norm_correction
+        print(ratio.errors[:5])
+
+        fit_res = cached_simple_fit(ratio)
+        report_fit(fit_res)
+
+        # import matplotlib.pyplot as plt
+        # plt.errorbar(x=list(range(30)), y=ratio.data[:30], yerr=ratio.errors[:30])
+        # plt.plot(GaussianModelFSI.gauss(
+        #     ratio.x_axis.bin_centers[:30],
+        #     **fit_res.params))
+        # plt.show()
+
+
+        num, den = analysis[analysis.QINV_NUM_PATH], analysis[analysis.QINV_DEN_PATH]
+        # merged femtolists hold ArrayHistograms
+        if not is_root_histogram(num):
+            num, den = to_root_histogram(num), to_root_histogram(den)
+
+        # create ratio
+        root_ratio = num.Clone()
+        root_ratio.SetTitle("Corrected Correlation Function")
+        root_ratio.Divide(den)
+
+        # apply correction
+        if corrections:
+            norm_correction = corrections[analysis.name]
+            assert num.GetNbinsX() == den.GetNbinsX() == norm_correction.shape[0]
+            for i, c in enumerate(norm_correction, 1):
+                x = root_ratio.GetBinContent(i)
+                e = root_ratio.GetBinError(i)
+                root_ratio.SetBinContent(i, x * c)
+                root_ratio.SetBinError(i, e * c)
+            root_ratio.Write("CorrelationFunction")
+
+        #
+        fit_res = cached_simple_fit(Histogram.BuildFromRootHist(root_ratio))
+        report_fit(fit_res)
+
+        x = np.linspace(0, 1.0, 300)
+        y = GaussianModelFSI.gauss(x, **fit_res.params)
+        plot = ROOT.TGraph(len(x), x, y)
+        plot.Write("FitPlot")
+        # x = np.copy(ratio.x_axis.bin_centers[:30])
+        # y = np.copy(GaussianModelFSI.gauss(x, **fit_res.params))
+        # ye = np.copy(np.sqrt(np.mean(data[2] ** 2, axis=1)))
+        #
+        # fit_plot = ROOT.TGraphErrors(len(x), x, y, np.zeros(len(x)), ye)
+        # plt.plot(
+        #     ratio.x_axis.bin_centers[:30],
+        #     **fit_res.params))
+        # qfit = QinvFit(analysis, args)
+        # report_fit(qfit.fit_res)
+
+        # o = output_file.mkdir(analysis.name)
+        # print('.>.', o)
+        # if o != None:
+        #     qfit.write(o)
+        #     print('wrote', qfit)
 
     output_file.Write()
     output_file.Close()
+    print("fit cache:", fit_cache.stats())
 
 if __name__ == "__main__":
     sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+#
+# post_analysis/qinv_systematics.py
+#
+"""
+Fit the qinv correlation function of every analysis with each combination
+of fit ranges, normalization ranges and models, writing the table of all
+fit results and the spread of each parameter over the variations.
+"""
+
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+from fitting.systematics import (
+    MODELS,
+    variation_grid,
+    qinv_arrays,
+    run_systematics,
+    failures,
+    spread,
+    write_csv,
+)
+
+
+def parse_range(text):
+    return tuple(map(float, text.split(':')))
+
+
+def argument_parser():
+    parser = ArgumentParser('qinv_systematics.py')
+    parser.add_argument("--fit-max",
+                        default='0.16,0.14,0.12',
+                        help="Comma separated maximum qinv values of the fit range "
+                             "(the first is the reference)")
+    parser.add_argument("--fit-min",
+                        type=float,
+                        default=0.0,
+                        help="Minimum qinv value of the fit range")
+    parser.add_argument("--norm-range",
+                        default='0.8:1.1,0.6:0.9,1.0:1.3',
+                        help="Comma separated normalization ranges 'min:max' "
+                             "(the first is the reference)")
+    parser.add_argument("--models",
+                        default=','.join(reversed(MODELS)),
+                        help="Comma separated model names (the first is the reference)")
+    parser.add_argument("--workers",
+                        type=int,
+                        default=None,
+                        help="Number of worker processes (reading the files to merge "
+                             "and fitting), defaults to one per CPU")
+    parser.add_argument("datafile",
+                        help="ROOT file containing the femtolist (comma separated files "
+                             "are merged), or a directory written by export_femtolist.py")
+    parser.add_argument("output",
+                        nargs='?',
+                        default=None,
+                        help="CSV file of fit results, defaults to the (first) input name with "
+                             "'.systematics.csv'; the spread is written next to it "
+                             "('.spread.csv')")
+    return parser
+
+
+def main(argv):
+    args = argument_parser().parse_args(argv)
+
+    variations = variation_grid(fit_maxes=[float(x) for x in args.fit_max.split(',')],
+                                norm_ranges=[parse_range(r) for r in args.norm_range.split(',')],
+                                models=args.models.split(','),
+                                fit_min=args.fit_min)
+
+    if os.path.isdir(args.datafile):
+        from pionpion.store import StoreFemtolist
+        femtolist = StoreFemtolist(args.datafile)
+    else:
+        from pionpion.merge import open_femtolist
+        femtolist = open_femtolist(args.datafile, workers=args.workers)
+
+    # read every analysis once
+    data = {analysis.name: qinv_arrays(analysis) for analysis in femtolist}
+
+    TIMESTART = time.monotonic()
+    rows = run_systematics(data, variations, workers=args.workers)
+    print("-- %d fits (%d analyses x %d variations) in %0.3fs"
+          % (len(rows), len(data), len(variations), time.monotonic() - TIMESTART))
+    failed = failures(rows)
+    if failed:
+        print("-- %d failed variations (excluded from the spread):" % len(failed))
+        for row in failed:
+            print("   %s %s fit %g:%g norm %g:%g - %s"
+                  % (row['analysis'], row['model'], row['fit_min'], row['fit_max'],
+                     row['norm_min'], row['norm_max'], row['error']))
+
+    if args.output is None:
+        first_input = args.datafile.split(',')[0].strip().rstrip('/')
+        args.output = os.path.splitext(first_input)[0] + '.systematics.csv'
+    spread_output = os.path.splitext(args.output)[0] + '.spread.csv'
+
+    write_csv(rows, args.output)
+    write_csv(spread(rows), spread_output)
+    print("Wrote", args.output, "and", spread_output)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
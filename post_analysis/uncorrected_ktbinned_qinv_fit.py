@@ -11,6 +11,7 @@ import pandas as pd
 import matplotlib.pyplot as plt
 
 from copy import copy
+from functools import partial
 from pprint import pprint
 from argparse import ArgumentParser, Action
 from pionpion import Femtolist
@@ -18,6 +19,7 @@ from pionpion.analysis import Analysis
 from pionpion.fit import fitfunc_qinv
 from pionpion.fit import fitfunc_qinv_gauss_ll
 from fitting.gaussian import GaussianModelCoulomb, GaussianModelFSI
+from fitting.sweep import SweepTask, fit_sweep, measure_cold_start
 from lmfit import minimize, Parameters, report_fit
 from pionpion.root_helpers import get_root_object
 from stumpy import Histogram
@@ -50,6 +52,10 @@ def argument_parser():
     parser.add_argument("--use-ll",
                         action='store_true',
                         help="Uses the log-likelihood fitting procedure")
+    parser.add_argument("--sweep-savings",
+                        action='store_true',
+                        help="Benchmark warm starts: fit every kT bin again from the "
+                             "default guess and report the function evaluations saved")
     parser.add_argument("datafile", help="ROOT filename to analyze")
     parser.add_argument("output_filename",
                         nargs='?',
@@ -71,14 +77,16 @@ def fitres_to_series(fit_res, **kw):
     kw['lambda_err'] = fit_res.params['lam'].stderr
     return pd.Series(kw)
 
-def do_qinv_fit(ratio, ModelClass, fit_range):
+def do_qinv_fit(ratio, ModelClass, fit_range, qinv_params=None):
     """
-    Do a fit of numerator denominator pairs.
+    Do a fit of numerator denominator pairs, starting from qinv_params
+    (default: ModelClass.guess()).
     """
     if isinstance(ratio, ROOT.TH1):
          ratio = Histogram.BuildFromRootHist(ratio)
     # ratio = num / den
-    qinv_params = ModelClass.guess()
+    if qinv_params is None:
+        qinv_params = ModelClass.guess()
     fit_slice = ratio.x_axis.get_slice(fit_range)
 
     y = ratio.data[fit_slice]
@@ -89,7 +97,8 @@ def do_qinv_fit(ratio, ModelClass, fit_range):
     e = ratio.errors[fit_slice][nonzero_mask]
     # print('y', y)
     # print('e', e)
-    qinv_fit = minimize(ModelClass.as_resid, qinv_params, args=(x, y, e))
+    qinv_fit = minimize(ModelClass.as_resid, qinv_params, args=(x, y, e),
+                        Dfun=ModelClass.as_resid_jacobian)
 
     return qinv_fit
 
@@ -176,6 +185,7 @@ def main(argv):
         save_fit_canvas(root_cf, fit, domain, name)
 
     fit_serieses = []
+    kt_fits = []
 
     for analysis in femtolist:
         print("\n***", analysis.name)
@@ -212,7 +222,8 @@ def main(argv):
         kt_bins = tuple((x.GetName(), x) for x in kt_analysis)
 
         for name, x in kt_bins:
-            output_dir.mkdir(name).cd()
+            kt_dir = output_dir.mkdir(name)
+            kt_dir.cd()
 
             kt_range = tuple(map(float, name.split('_')))
 
@@ -224,20 +235,33 @@ def main(argv):
             root_cf.Divide(r_den)
             # root_cf =  'CF'
             root_cf.Write()
-            cf_fit_res = do_qinv_fit(root_cf, FIT_CLASS, fit_range)
-            fit_serieses.append(fitres_to_series(cf_fit_res,
-                                                 momentum_corrected=False,
-                                                 kt_range=kt_range,
-                                                 centrality=analysis.centrality_range,
-                                                 ))
-            write_fit(root_cf,
-                      cf_fit_res,
-                      fit_range,
-                      name='CF_fit',
-                      title="(Uncorrected) CF : %s" % (title))
-            normalized_root_cf = root_cf.Clone("cf_normalized")
-            normalized_root_cf.Scale(1.0 / cf_fit_res.params['norm'].value)
-            normalized_root_cf.Write()
+            kt_fits.append((kt_dir, root_cf, title, analysis.centrality_range, kt_range))
+
+    # fit all kT bins, each warm-started from its nearest fitted neighbour
+    tasks = [SweepTask(i, centrality, kt_range,
+                       partial(do_qinv_fit, Histogram.BuildFromRootHist(root_cf), FIT_CLASS, fit_range))
+             for i, (_, root_cf, _, centrality, kt_range) in enumerate(kt_fits)]
+    sweep = fit_sweep(tasks, FIT_CLASS.guess())
+    if args.sweep_savings:
+        sweep = measure_cold_start(sweep, tasks, FIT_CLASS.guess())
+    print(sweep.report())
+
+    for i, (kt_dir, root_cf, title, centrality, kt_range) in enumerate(kt_fits):
+        kt_dir.cd()
+        cf_fit_res = sweep.results[i]
+        fit_serieses.append(fitres_to_series(cf_fit_res,
+                                             momentum_corrected=False,
+                                             kt_range=kt_range,
+                                             centrality=centrality,
+                                             ))
+        write_fit(root_cf,
+                  cf_fit_res,
+                  fit_range,
+                  name='CF_fit',
+                  title="(Uncorrected) CF : %s" % (title))
+        normalized_root_cf = root_cf.Clone("cf_normalized")
+        normalized_root_cf.Scale(1.0 / cf_fit_res.params['norm'].value)
+        normalized_root_cf.Write()
 
     fit_df = pd.DataFrame(fit_serieses)
     if args.fit_output:
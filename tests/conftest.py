@@ -0,0 +1,9 @@
+#
+# tests/conftest.py
+#
+
+import os
+import sys
+
+# the analysis scripts import pionpion and fitting as top-level packages
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), 'post_analysis'))
@@ -0,0 +1,46 @@
+#
+# tests/test_analysis_write.py
+#
+
+import pytest
+import numpy as np
+
+
+def test_fast_copy_writes_corrected_kt_bins(tmpdir):
+    ROOT = pytest.importorskip('ROOT')
+    from pionpion.analysis import Analysis
+    from pionpion.rootview import data_view
+
+    path = str(tmpdir.join('femtolist.root'))
+    output = ROOT.TFile(path, 'RECREATE')
+    directory = output.mkdir('PiPiAnalysis_00_10_pip')
+    directory.cd()
+    kt_bins = ROOT.TObjArray()
+    kt_bins.SetName('KT_Qinv')
+    kt_bins.SetOwner(True)
+    kt_bin = ROOT.TObjArray()
+    kt_bin.SetName('0.2_0.3')
+    kt_bin.SetOwner(True)
+    for name in ('Num_qinv_pip', 'Den_qinv_pip'):
+        hist = ROOT.TH1D(name, name, 4, 0.0, 0.2)
+        for i in range(1, 5):
+            hist.SetBinContent(i, 10.0)
+        hist.SetDirectory(0)
+        kt_bin.Add(hist)
+    kt_bins.Add(kt_bin)
+    # all kT bins in one key
+    kt_bins.Write('KT_Qinv', ROOT.TObject.kSingleKey)
+    output.Close()
+
+    tfile = ROOT.TFile(path, 'READ')
+    analysis = Analysis(tfile.Get('PiPiAnalysis_00_10_pip'))
+    analysis.apply_momentum_correction_matrix(np.full(4, 2.0))
+    assert 'KT_Qinv' in analysis._data.modified
+
+    corrected = str(tmpdir.join('corrected.root'))
+    analysis.write_into(corrected, fast_copy=True)
+
+    result = ROOT.TFile(corrected, 'READ')
+    kt_bins = result.Get('PiPiAnalysis_00_10_pip').Get('KT_Qinv')
+    num = kt_bins.FindObject('0.2_0.3').FindObject('Num_qinv_pip')
+    assert np.all(data_view(num) == 20.0)
@@ -0,0 +1,57 @@
+#
+# tests/test_batch_fit.py
+#
+
+import lmfit
+import pytest
+import numpy as np
+import post_analysis.fitting.gaussian as gaussian
+from post_analysis.fitting.batch import batch_fit
+
+
+@pytest.mark.parametrize('cls', [
+    gaussian.GaussianModel,
+    gaussian.GaussianModelCoulomb,
+    gaussian.GaussianModelFSI,
+])
+def test_batch_fit_matches_lmfit(cls):
+    np.random.seed(3)
+    nfits = 12
+    x = np.tile(np.linspace(0.004, 0.16, 40), (nfits, 1))
+    radius = np.random.uniform(4.0, 9.0, (nfits, 1))
+    den = np.random.poisson(50000, x.shape).astype(float)
+    num = np.random.poisson(den * cls.gauss(x, radius, 0.5, 1.0)).astype(float)
+    y = num / den
+    e = y * np.sqrt(1 / num + 1 / den)
+
+    # shorter fit range in the last row
+    mask = np.ones(x.shape, dtype=bool)
+    mask[-1, 30:] = False
+
+    result = batch_fit(cls, x, y, e, mask)
+    assert result.success.all()
+
+    for i in range(nfits):
+        m = mask[i]
+        fit = lmfit.minimize(cls.as_resid, cls.guess(), args=(x[i, m], y[i, m], e[i, m]))
+        for name in ('radius', 'lam', 'norm'):
+            par = fit.params[name]
+            assert np.fabs(result.values[name][i] - par.value) < 1e-3 * par.stderr
+            assert np.isclose(result.stderr[name][i], par.stderr, rtol=1e-3)
+        assert np.isclose(result.chisqr[i], fit.chisqr)
+
+    assert result.params(0)['radius'].value == result.values['radius'][0]
+    lmfit.fit_report(result.minimizer_result(0))
+
+
+def test_batch_fit_unconverged_is_not_success():
+    np.random.seed(5)
+    x = np.tile(np.linspace(0.004, 0.16, 40), (4, 1))
+    cls = gaussian.GaussianModel
+    y = cls.gauss(x, 6.0, 0.5, 1.0) + np.random.normal(0, 0.01, x.shape)
+    e = np.full(x.shape, 0.01)
+
+    # too few iterations to reach the minimum
+    result = batch_fit(cls, x, y, e, max_iter=2)
+    assert not result.success.any()
+    assert batch_fit(cls, x, y, e).success.all()
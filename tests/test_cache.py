@@ -0,0 +1,67 @@
+#
+# tests/test_cache.py
+#
+
+import gc
+import weakref
+import pytest
+import numpy as np
+
+from pionpion.cache import ObjectCache
+
+
+class Blob:
+    """Stand-in for a loaded object, sized by ObjectCache.histogram_nbytes"""
+
+    def __init__(self, nbins):
+        self.data = np.zeros(nbins)
+
+
+def test_eviction_releases_objects():
+    cache = ObjectCache(max_bytes=2500)
+    refs = []
+    for i in range(4):
+        hist = cache.get_histogram(('file', 0, 'analysis', 'h%d' % i),
+                                   lambda: 'root object',
+                                   lambda obj: Blob(100))
+        refs.append(weakref.ref(hist))
+        del hist
+    gc.collect()
+
+    # 800 bytes each: only the three most recent fit
+    assert len(cache) == 3
+    assert refs[0]() is None
+    assert all(ref() is not None for ref in refs[1:])
+
+    cache.clear()
+    gc.collect()
+    assert all(ref() is None for ref in refs)
+
+
+def test_key_index_keeps_only_modified(tmpdir):
+    ROOT = pytest.importorskip('ROOT')
+    from pionpion.analysis import Analysis
+
+    path = str(tmpdir.join('analysis.root'))
+    output = ROOT.TFile(path, 'RECREATE')
+    directory = output.mkdir('PiPiAnalysis_00_10_pip')
+    directory.cd()
+    for name in ('Num_qinv_pip', 'Den_qinv_pip'):
+        hist = ROOT.TH1D(name, name, 1000, 0.0, 1.0)
+        hist.Write()
+    output.Close()
+
+    tfile = ROOT.TFile(path, 'READ')
+    cache = ObjectCache(max_bytes=1)
+    analysis = Analysis(tfile.Get('PiPiAnalysis_00_10_pip'), cache=cache, source=(path, 0))
+    index = analysis._data
+
+    num = analysis['Num_qinv_pip']
+    assert num != None and not index.is_loaded('Num_qinv_pip')
+    analysis['Den_qinv_pip']
+    # the numerator was evicted, and nothing else references it
+    assert 'Num_qinv_pip' not in [key[3] for key in cache._entries]
+    assert not index.is_loaded('Num_qinv_pip')
+
+    index.mark_modified('Num_qinv_pip', num)
+    assert index.load('Num_qinv_pip') is num
@@ -0,0 +1,98 @@
+#
+# tests/test_fitcache.py
+#
+
+import os
+import lmfit
+import numpy as np
+import post_analysis.fitting.gaussian as gaussian
+from post_analysis.fitting.fitcache import FitCache
+
+
+def make_fit(seed):
+    cls = gaussian.GaussianModel
+    np.random.seed(seed)
+    x = np.linspace(0.004, 0.16, 40)
+    den = np.random.poisson(50000, x.size).astype(float)
+    num = np.random.poisson(den * cls.gauss(x, 6.0, 0.5, 1.0)).astype(float)
+    y = num / den
+    e = y * np.sqrt(1 / num + 1 / den)
+    calls = []
+
+    def fitter():
+        calls.append(1)
+        return lmfit.minimize(cls.as_resid, cls.guess(), args=(x, y, e))
+
+    return (x, y, e), fitter, calls
+
+
+def test_fit_cache(tmp_path):
+    cache = FitCache(str(tmp_path))
+    arrays, fitter, calls = make_fit(1)
+
+    first = cache.fit(fitter, arrays, gaussian.GaussianModel, fit_range=(0, 0.16), method='chisqr')
+    again = cache.fit(fitter, arrays, gaussian.GaussianModel, fit_range=(0, 0.16), method='chisqr')
+    assert len(calls) == 1
+    assert cache.hits == 1 and cache.misses == 1
+
+    for name in ('radius', 'lam', 'norm'):
+        assert again.params[name].value == first.params[name].value
+        assert again.params[name].stderr == first.params[name].stderr
+    assert np.array_equal(again.covar, first.covar)
+    assert again.chisqr == first.chisqr and again.var_names == first.var_names
+    lmfit.fit_report(again)
+
+    # any change of the settings, model or data is a different fit
+    cache.fit(fitter, arrays, gaussian.GaussianModel, fit_range=(0, 0.12), method='chisqr')
+    cache.fit(fitter, arrays, gaussian.GaussianModelFSI, fit_range=(0, 0.16), method='chisqr')
+    changed = (arrays[0], arrays[1] * 1.01, arrays[2])
+    cache.fit(fitter, changed, gaussian.GaussianModel, fit_range=(0, 0.16), method='chisqr')
+    assert len(calls) == 4
+
+    disabled = FitCache(str(tmp_path), enabled=False)
+    disabled.fit(fitter, arrays, gaussian.GaussianModel, fit_range=(0, 0.16), method='chisqr')
+    assert len(calls) == 5
+
+
+def test_fit_cache_eviction(tmp_path):
+    cache = FitCache(str(tmp_path))
+    arrays, fitter, _ = make_fit(2)
+    keys = [cache.key(arrays, 'model', index=i) for i in range(4)]
+    result = fitter()
+    for i, key in enumerate(keys):
+        cache.put(key, result)
+        # distinct modification times
+        os.utime(cache._path(key), (i, i))
+    size = cache.stats()['nbytes'] // 4
+
+    # the least recently used entries are removed first
+    assert cache.get(keys[0]) is not None
+    cache.max_bytes = 2 * size
+    cache._evict()
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[1]) is None and cache.get(keys[2]) is None
+    assert cache.get(keys[3]) is not None
+
+
+def test_fit_cache_running_size(tmp_path):
+    arrays, fitter, _ = make_fit(3)
+    result = fitter()
+    cache = FitCache(str(tmp_path))
+    cache.put(cache.key(arrays, 'model', index=0), result)
+    size = cache.stats()['nbytes']
+
+    # puts keep a running total, and evict down to LOW_WATER * max_bytes
+    cache.max_bytes = 4 * size
+    keys = [cache.key(arrays, 'model', index=i) for i in range(1, 6)]
+    for i, key in enumerate(keys):
+        cache.put(key, result)
+        os.utime(cache._path(key), (i + 1, i + 1))
+        assert cache._nbytes == cache.stats()['nbytes'] <= cache.max_bytes
+    # the fifth entry overflowed and left three, then one more was added
+    assert cache.stats()['entries'] == 4
+
+    # lookups outside of fit() are counted too
+    cache.hits = cache.misses = 0
+    cache.get(keys[-1])
+    cache.get(cache.key(arrays, 'model', index=99))
+    assert cache.hits == 1 and cache.misses == 1
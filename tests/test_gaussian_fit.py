@@ -43,3 +43,170 @@ def test_gaussian_fit(cls):
     assert np.fabs(fit.params['radius'] - R) < fit.params['radius'].stderr
     assert np.fabs(fit.params['lam'] - L) < fit.params['lam'].stderr
     assert np.fabs(fit.params['norm'] - N) < fit.params['norm'].stderr
+
+
+def finite_difference_jacobian(func, p, args, h=1e-6):
+    columns = []
+    for name in ('norm', 'lam', 'radius'):
+        hi, lo = p.copy(), p.copy()
+        hi[name].value += h
+        lo[name].value -= h
+        columns.append((func(hi, *args) - func(lo, *args)) / (2 * h))
+    return np.column_stack(columns)
+
+
+@pytest.mark.parametrize('cls', [
+    gaussian.GaussianModel,
+    gaussian.GaussianModelCoulomb,
+    gaussian.GaussianModelFSI,
+])
+def test_analytic_jacobians(cls):
+    np.random.seed(42)
+    x = np.linspace(0.002, 0.2, 80)
+    den = np.random.poisson(20000, x.size).astype(float)
+    num = np.random.poisson(den * cls.gauss(x, 6.0, 0.5, 1.0)).astype(float)
+    ratio = num / den
+    errs = ratio * np.sqrt(1 / num + 1 / den)
+
+    p = cls.guess()
+    p['radius'].value, p['lam'].value, p['norm'].value = 7.0, 0.6, 1.1
+
+    for func, jac, args in [(cls.as_resid, cls.as_resid_jacobian, (x, ratio, errs)),
+                            (cls.as_loglike, cls.as_loglike_jacobian, (x, num, den))]:
+        expected = finite_difference_jacobian(func, p, args)
+        assert np.allclose(jac(p, *args), expected, rtol=1e-5, atol=1e-6 * np.abs(expected).max())
+
+        fit = lmfit.minimize(func, cls.guess(), args=args)
+        fit_jac = lmfit.minimize(func, cls.guess(), args=args, Dfun=jac)
+        assert fit_jac.nfev < fit.nfev
+        assert np.fabs(fit_jac.params['radius'] - fit.params['radius']) < 0.01 * fit.params['radius'].stderr
+
+    p['lam'].vary = False
+    assert cls.as_resid_jacobian(p, x, ratio, errs).shape == (x.size, 2)
+
+
+@pytest.mark.parametrize('cls', [
+    gaussian.GaussianModel,
+    gaussian.GaussianModelCoulomb,
+    gaussian.GaussianModelFSI,
+])
+def test_bound_objectives(cls):
+    from post_analysis.fitting.objective import QinvResidual, QinvLogLikelihood
+
+    np.random.seed(42)
+    x = np.linspace(0.002, 0.2, 80)
+    den = np.random.poisson(20000, x.size).astype(float)
+    num = np.random.poisson(den * cls.gauss(x, 6.0, 0.5, 1.0)).astype(float)
+    num[5] = 0.0
+    ratio = num / den
+    errs = np.sqrt(num) / den
+
+    p = cls.guess()
+    p['radius'].value, p['lam'].value, p['norm'].value = 7.0, 0.6, 1.1
+
+    resid = QinvResidual(cls, x, ratio, errs)
+    valid = errs != 0
+    assert np.allclose(resid(p), cls.as_resid(p, x[valid], ratio[valid], errs[valid]))
+
+    loglike = QinvLogLikelihood(cls, x, num, den)
+    first = loglike(p)
+    expected = cls.as_loglike(p, x, num, den)
+    assert np.allclose(first, expected)
+    # results are not overwritten by later calls
+    p['radius'].value = 5.0
+    loglike(p)
+    assert np.allclose(first, expected)
+
+    # fits without an analytic jacobian match the unbound residual
+    fit = lmfit.minimize(resid, cls.guess())
+    expected = lmfit.minimize(cls.as_resid, cls.guess(), args=(x[valid], ratio[valid], errs[valid]))
+    for name in ('radius', 'lam', 'norm'):
+        assert np.isclose(fit.params[name].value, expected.params[name].value, rtol=1e-6)
+
+
+@pytest.mark.parametrize('cls', [
+    gaussian.GaussianModelCoulomb,
+    gaussian.GaussianModelFSI,
+])
+def test_fsi_factor_memoized(cls):
+    cls.fsi_factor.cache_clear()
+    x = np.linspace(0.002, 0.2, 80)
+
+    p = cls.guess()
+    y = cls.gauss(x, **p)
+    for _ in range(5):
+        assert np.array_equal(cls.gauss(x.copy(), **p), y)
+    assert cls.fsi_factor.misses == 1
+    assert cls.fsi_factor.hits == 5
+
+    # different contents are not confused
+    assert not np.array_equal(cls.fsi_factor(x + 0.001), cls.fsi_factor(x))
+    assert cls.fsi_factor.misses == 2
+    with pytest.raises(ValueError):
+        cls.fsi_factor(x)[0] = 1.0
+
+
+def test_gauss3d_loglike():
+    from post_analysis.fitting.gaussian3d import Gaussian3dModel
+
+    np.random.seed(7)
+    axis = np.linspace(-0.1, 0.1, 21)
+    q = np.stack(np.meshgrid(axis, axis, axis, indexing='ij'), axis=-1).reshape(-1, 3)
+    truth = Gaussian3dModel.guess()
+    truth['r_o'].value, truth['r_s'].value, truth['r_l'].value = 5.0, 4.0, 6.0
+    den = np.random.poisson(200, len(q)).astype(float)
+    den[:10] = 0.0
+    num = np.random.poisson(den * Gaussian3dModel.gauss(q, **truth)).astype(float)
+
+    objective = Gaussian3dModel.loglike_objective(q, num, den)
+    assert len(objective) == np.count_nonzero(num + den)
+
+    p = Gaussian3dModel.guess()
+    # squared residuals are the log-likelihood terms (including empty numerator bins)
+    both = (num != 0) & (den != 0)
+    resid = objective(p)
+    assert np.allclose((resid ** 2)[both[objective.mask]], Gaussian3dModel.as_loglike(p, q, num, den))
+    assert np.isclose(Gaussian3dModel.loglike_objective(q, num, den, scalar=True)(p), np.sum(resid ** 2))
+
+    result = lmfit.minimize(objective, p)
+    for name in ('r_o', 'r_s', 'r_l'):
+        assert abs(result.params[name].value - truth[name].value) < 4 * result.params[name].stderr
+
+
+def test_gauss3d_float32():
+    from post_analysis.fitting.objective import Gauss3DResidual
+    from post_analysis.fitting.precision import compare_precision
+    from pionpion.fit import fitfunc_3d
+
+    np.random.seed(11)
+    axis = np.linspace(-0.1, 0.1, 25)
+    q = np.stack(np.meshgrid(axis, axis, axis, indexing='ij'), axis=-1).reshape(-1, 3)
+    p = lmfit.Parameters()
+    p.add('r_out', value=5.0, min=0.0)
+    p.add('r_side', value=4.0, min=0.0)
+    p.add('r_long', value=6.0, min=0.0)
+    p.add('lam', value=0.5)
+    p.add('norm', value=1.0, min=0.0)
+    den = np.random.poisson(500, len(q)).astype(float)
+    num = np.random.poisson(den * fitfunc_3d(p, q)).astype(float)
+    ratio, errs = num / den, np.sqrt(num) / den
+
+    single = Gauss3DResidual(q, ratio, errs, dtype=np.float32)
+    assert single._q2.dtype == np.float32
+    resid = single(p)
+    assert resid.dtype == np.float64
+    assert np.allclose(resid, Gauss3DResidual(q, ratio, errs)(p), rtol=1e-4, atol=1e-5)
+
+    model = fitfunc_3d(p, q, dtype=np.float32)
+    assert model.dtype == np.float32
+    # the observed arrays are cast once, and only the residual is float64
+    data32 = ratio.astype(np.float32), errs.astype(np.float32)
+    resid = fitfunc_3d(p, q.astype(np.float32), data32, dtype=np.float32)
+    assert resid.dtype == np.float64
+    assert np.isclose(np.sum(resid ** 2), np.sum(fitfunc_3d(p, q, (ratio, errs)) ** 2), rtol=1e-5)
+
+    start = p.copy()
+    for name in ('r_out', 'r_side', 'r_long'):
+        start[name].value = 5.5
+    check = compare_precision(q, ratio, errs, start, tolerance=1e-3)
+    assert check.ok, check.report()
@@ -0,0 +1,29 @@
+#
+# tests/test_imports.py
+#
+
+import os
+import sys
+import subprocess
+import pytest
+
+POST_ANALYSIS = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'post_analysis')
+
+MODULES = [
+    'pionpion',
+    'pionpion.fit',
+    'pionpion.q3d',
+    'pionpion.store',
+    'pionpion.merge',
+    'pionpion.femtolist',
+    'fitting.gaussian',
+    'fitting.gaussian3d',
+]
+
+
+@pytest.mark.parametrize('module', MODULES)
+def test_import_does_not_load_root(module):
+    # run in a fresh interpreter, as other tests may have loaded modules
+    code = ("import sys, %s; "
+            "assert 'ROOT' not in sys.modules and 'stumpy' not in sys.modules" % module)
+    subprocess.check_call([sys.executable, '-c', code], cwd=POST_ANALYSIS)
@@ -0,0 +1,52 @@
+#
+# tests/test_merge.py
+#
+
+import numpy as np
+from collections import OrderedDict
+
+from pionpion import merge
+from pionpion.merge import MergedFemtolist
+from pionpion.metadata import parse_settings
+
+SETTINGS = """[settings]
+AliFemtoAnalysisPionPion.pion_1_type=1
+AliFemtoSimpleAnalysis.AliFemtoESDTrackCut.charge=-1
+[end]"""
+
+NAME = 'PiPiAnalysis_00_10_pim'
+EDGES = np.linspace(0.0, 0.2, 11)
+
+
+def read_file_arrays(filename, listpath=None):
+    """Arrays of one file as returned by read_histogram_arrays"""
+    data = np.full(10, float(len(filename)))
+    return OrderedDict([(NAME, {
+        'metadata': parse_settings(SETTINGS),
+        'histograms': OrderedDict([
+            ('Num_qinv_pim', (data, data.copy(), [EDGES], 'num')),
+            ('KT_Qinv/0.2_0.3/Num_qinv_pim', (2 * data, 2 * data, [EDGES], 'num')),
+        ]),
+    })])
+
+
+def test_merge_settings_through_pool(monkeypatch):
+    # workers read the files with the (forked) patched reader
+    monkeypatch.setattr(merge, 'read_histogram_arrays', read_file_arrays)
+    filenames = ['a.root', 'bb.root', 'ccc.root', 'dddd.root', 'eeeee.root']
+    merged = MergedFemtolist(filenames, workers=2)
+
+    analysis = merged[NAME]
+    assert analysis.metadata == parse_settings(SETTINGS)
+    assert analysis.metadata['AliFemtoSimpleAnalysis']['AliFemtoESDTrackCut']['charge'] == '-1'
+    assert analysis.pion_code == 1
+    # still a settings_tree after the round trip through the pool
+    assert analysis.metadata['AliFemtoSimpleAnalysis']['missing'] == {}
+
+    total = sum(map(len, filenames))
+    num = analysis['Num_qinv_pim']
+    assert np.allclose(num.data, total)
+    assert np.allclose(num.errors, np.sqrt(total))
+    assert merged.map(lambda a: a.name) == [NAME]
+    assert merged.filenames == merged.source == filenames
+    assert not hasattr(merged, 'filepath')
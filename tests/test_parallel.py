@@ -0,0 +1,52 @@
+#
+# tests/test_parallel.py
+#
+
+import os
+import json
+import pytest
+import numpy as np
+
+from pionpion.store import StoreFemtolist, MANIFEST_FILENAME, STORE_FORMAT_VERSION
+
+
+def write_store(directory, nanalyses=4, nbins=20):
+    """Write a minimal femtolist store of qinv numerator/denominator pairs"""
+    np.random.seed(7)
+    edges = np.linspace(0.0, 0.2, nbins + 1)
+    analyses = []
+    for i in range(nanalyses):
+        name = 'PiPiAnalysis_%d_%d_pip' % (i * 10, i * 10 + 10)
+        histograms = {}
+        for hist_name in ('Num_qinv_pip', 'Den_qinv_pip'):
+            hist_dir = os.path.join(name, hist_name)
+            os.makedirs(os.path.join(directory, hist_dir))
+            data = np.random.poisson(1000, nbins).astype(float)
+            np.save(os.path.join(directory, hist_dir, 'data.npy'), data)
+            np.save(os.path.join(directory, hist_dir, 'errors.npy'), np.sqrt(data))
+            np.save(os.path.join(directory, hist_dir, 'axis0.npy'), edges)
+            histograms[hist_name] = {'dir': hist_dir, 'title': hist_name,
+                                     'shape': [nbins], 'dtype': 'float64'}
+        analyses.append({'name': name, 'metadata': None,
+                         'kt_bins': {}, 'histograms': histograms})
+
+    with open(os.path.join(directory, MANIFEST_FILENAME), 'w') as f:
+        json.dump({'format': STORE_FORMAT_VERSION, 'name': 'femtolist',
+                   'source': None, 'analyses': analyses}, f)
+
+
+def ratio_sum(analysis):
+    num, den = analysis.qinv_pair
+    return analysis.name, float(np.sum(num.data / den.data))
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_store_map(tmpdir, workers):
+    write_store(str(tmpdir))
+    femtolist = StoreFemtolist(str(tmpdir))
+
+    expected = [ratio_sum(analysis) for analysis in femtolist]
+    assert femtolist.map(ratio_sum, workers=workers) == expected
+
+    names = femtolist.names()[::-1]
+    assert femtolist.map(ratio_sum, names, workers=workers) == expected[::-1]
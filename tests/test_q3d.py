@@ -0,0 +1,226 @@
+#
+# tests/test_q3d.py
+#
+
+import pytest
+import numpy as np
+from pionpion.histogram import ArrayHistogram
+from pionpion.q3d import Q3D
+
+
+def make_q3d(nbins=21, seed=1):
+    np.random.seed(seed)
+    edges = np.linspace(-0.21, 0.21, nbins + 1)
+    centers = (edges[1:] + edges[:-1]) / 2
+    qo, qs, ql = np.meshgrid(centers, centers, centers, indexing='ij')
+    q2 = qo ** 2 + qs ** 2 + ql ** 2
+    den = np.random.poisson(400 * np.exp(-q2 / 0.02)).astype(float)
+    cf = 1 + 0.5 * np.exp(-q2 * (6.0 / 0.1973269788) ** 2)
+    num = np.random.poisson(den * cf).astype(float)
+    return Q3D(ArrayHistogram(num, edges=[edges] * 3),
+               ArrayHistogram(den, edges=[edges] * 3))
+
+
+def test_fit_domain():
+    q3d = make_q3d()
+    domain = q3d.fit_domain()
+
+    expected = (q3d.den.data > 0) & (q3d.ratio_err != 0)
+    assert len(domain) == expected.sum()
+    assert np.array_equal(domain.ratio, q3d.ratio_data[expected])
+    assert np.array_equal(domain.errors, q3d.ratio_err[expected])
+    assert np.array_equal(domain.num, q3d.num.data[expected])
+
+    # coordinates match the flat index of each bin
+    ix, iy, iz = np.unravel_index(domain.index, q3d.num.shape)
+    assert np.array_equal(domain.q[:, 0], q3d.num.x_axis.bin_centers[ix])
+    assert np.array_equal(domain.q[:, 2], q3d.num.z_axis.bin_centers[iz])
+
+    # cached per selection
+    assert q3d.fit_domain() is domain
+    small = q3d.fit_domain(q_max=0.1, min_counts=5, dtype=np.float32)
+    assert small is not domain
+    assert small.q.dtype == np.float32
+    assert np.all(np.abs(small.q) <= 0.1)
+    assert np.all(small.den >= 5) and np.all(small.num >= 5)
+    with pytest.raises(ValueError):
+        small.ratio[0] = 0.0
+
+
+def test_from_arrays():
+    q3d = make_q3d()
+    edges = q3d.num.x_axis.edges
+    fast = Q3D.from_arrays(q3d.num.data, q3d.den.data, edges, do_sanity_check=True)
+    assert fast.num.data is q3d.num.data
+    assert np.array_equal(fast.ratio_data, q3d.ratio_data)
+    assert np.array_equal(fast.ratio_err, q3d.ratio_err)
+
+    # empty bins give zero ratio, and do not fail construction
+    num, den = np.array(q3d.num.data), np.array(q3d.den.data)
+    num[0, 0, 0] = den[0, 0, 0] = 0.0
+    assert Q3D.from_arrays(num, den, [edges] * 3).ratio_data[0, 0, 0] == 0.0
+
+    with pytest.raises(ValueError):
+        Q3D(ArrayHistogram(q3d.num.data, edges=[edges] * 3),
+            ArrayHistogram(q3d.den.data, edges=[edges, edges, edges * 1.01]))
+    with pytest.raises(ValueError):
+        Q3D.from_arrays(q3d.num.data, q3d.den.data[:-1], [edges[:-1]] + [edges] * 2,
+                        do_sanity_check=True)
+
+
+@pytest.mark.parametrize('tables', [False, True])
+def test_summed_volume_projections(tables):
+    q3d = make_q3d()
+    ratio = np.where(np.isfinite(q3d.ratio.data), q3d.ratio.data, 0.0)
+    err2 = np.where(np.isfinite(q3d.ratio.errors), q3d.ratio.errors, 0.0) ** 2
+    if tables:
+        q3d.integrals
+    else:
+        # boxes are summed directly unless the tables are requested
+        assert q3d._table('ratio') is None
+
+    for width in (0.01, 0.05, 0.1):
+        window = (-width, width)
+        s = q3d.ratio.get_slice(None, window, window)
+        assert np.allclose(q3d.projection_out(y_slice=window, z_slice=window),
+                           ratio[s].sum(axis=(1, 2)))
+        assert np.allclose(q3d.projection_out_error(y_slice=window, z_slice=window),
+                           np.sqrt(err2[s].sum(axis=(1, 2))))
+
+        s = q3d.ratio.get_slice(window, window, None)
+        assert np.allclose(q3d.projection_long(x_slice=window, y_slice=window),
+                           ratio[s].sum(axis=(0, 1)))
+        assert np.allclose(q3d.projection_long_error(window, window),
+                           np.sqrt(err2[s].sum(axis=(0, 1))))
+
+        s = q3d.ratio.get_slice(window, (0.0, 0.2), window)
+        assert np.isclose(q3d.integral(window, (0.0, 0.2), window, of='num'),
+                          q3d.num.data[s].sum())
+    # a single bin
+    assert np.isclose(q3d.integral(3, 4, 5, of='den'), q3d.den.data[3, 4, 5])
+    assert (q3d._table('ratio') is not None) == tables
+
+
+def test_summed_volume_rounding():
+    q3d = make_q3d(nbins=41)
+    err2 = np.where(np.isfinite(q3d.ratio.errors), q3d.ratio.errors, 0.0) ** 2
+    table = q3d.summed_volume('err2')
+    assert q3d.summed_volume('err2') is table
+
+    # documented bound of the table's rounding error: n * eps * total
+    tolerance = 41 * np.finfo(float).eps * err2.sum()
+    for axis in range(3):
+        for width in (0, 3, 20):
+            s = [slice(20 - width, 21 + width)] * 3
+            s[axis] = slice(None)
+            others = tuple(i for i in range(3) if i != axis)
+            expected = err2[tuple(s)].sum(axis=others)
+            assert np.all(np.abs(table.projection(axis, s) - expected) <= tolerance)
+
+
+@pytest.mark.parametrize('nbins', [20, 21])
+def test_fold(nbins):
+    q3d = make_q3d(nbins)
+    folded = q3d.fold('side_long')
+    assert folded.folded == 'side_long'
+    assert folded.num.shape == (nbins, (nbins + 1) // 2, (nbins + 1) // 2)
+    assert np.all(folded.num.y_axis.bin_centers > 0)
+    assert q3d.fold('side_long') is folded
+
+    # totals are unchanged, errors add in quadrature
+    assert np.isclose(folded.num.data.sum(), q3d.num.data.sum())
+    assert np.isclose((folded.den.errors ** 2).sum(), (q3d.den.errors ** 2).sum())
+
+    # a bin at positive (side, long) collects its three mirror bins
+    n = nbins
+    i, j, k = 3, n - 2, n - 4
+    fj, fk = j - n // 2, k - n // 2
+    expected = sum(q3d.num.data[i, jj, kk] for jj in (j, n - 1 - j) for kk in (k, n - 1 - k))
+    assert folded.num.data[i, fj, fk] == expected
+    assert np.isclose(folded.ratio.data[i, fj, fk],
+                      expected / sum(q3d.den.data[i, jj, kk]
+                                     for jj in (j, n - 1 - j) for kk in (k, n - 1 - k)))
+
+    octant = q3d.fold('octant')
+    assert octant.num.shape == ((n + 1) // 2, ) * 3
+    assert np.isclose(octant.den.data.sum(), q3d.den.data.sum())
+    # fits run on the folded domain as on the full cube
+    assert len(octant.fit_domain()) < len(q3d.fit_domain())
+
+    with pytest.raises(ValueError):
+        q3d.fold('out')
+
+
+def test_project_model():
+    from lmfit import Parameters
+    from pionpion.fit import fitfunc_3d
+
+    q3d = make_q3d()
+    params = Parameters()
+    params.add('norm', value=1.1)
+    params.add('lam', value=0.5)
+    params.add('r_out', value=5.0)
+    params.add('r_side', value=4.0)
+    params.add('r_long', value=6.0)
+
+    window = ((-0.05, 0.05), (3, 9))
+    x, curve = q3d.project_model(params, 1, window)
+    assert np.array_equal(x, q3d.ratio.y_axis.bin_centers)
+
+    # brute force: evaluate every point of the window separately
+    s = q3d.ratio.get_slice(window[0], None, window[1])
+    xs = q3d.ratio.x_axis.bin_centers[s[0]]
+    zs = q3d.ratio.z_axis.bin_centers[s[2]]
+    expected = [fitfunc_3d(params, np.array([[qo, qs, ql] for qo in xs for ql in zs])).sum()
+                for qs in x]
+    assert np.allclose(curve, expected)
+
+    x, curve = q3d.project_model(params, 0, samples=50)
+    assert len(x) == len(curve) == 50
+    assert x[0] == q3d.ratio.x_axis.edges[0]
+    peak = params['norm'].value * (1 + params['lam'].value) * q3d.ratio.shape[1] * q3d.ratio.shape[2]
+    assert np.all(curve < peak)
+
+
+def test_projections_2d():
+    q3d = make_q3d()
+    projections = q3d.projections_2d(widths=(1, 3))
+    assert len(projections) == 6
+
+    middle = q3d.ratio.z_axis.find_bin(0.0)
+    out_side = projections['out_side', 3]
+    assert out_side.bins == (middle - 3, middle + 4)
+    num = q3d.num.data[:, :, middle - 3:middle + 4].sum(axis=2)
+    den = q3d.den.data[:, :, middle - 3:middle + 4].sum(axis=2)
+    assert np.allclose(out_side.num, num)
+    assert np.allclose(out_side.den, den)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        assert np.allclose(out_side.ratio, np.where(den != 0, num / den, 0.0))
+
+    side_long = projections['side_long', 1]
+    assert side_long.num.shape == q3d.num.shape[1:]
+    assert np.allclose(side_long.den, q3d.den.data[middle - 1:middle + 2].sum(axis=0))
+
+    ratio = np.where(np.isfinite(q3d.ratio.data), q3d.ratio.data, 0.0)
+    assert np.allclose(q3d.projection_out_long((2, 5)), ratio[:, 2:5, :].sum(axis=1))
+
+    with pytest.raises(ValueError):
+        q3d.projections_2d(planes=('out_out', ))
+
+    # slab sums do not build (and switch integral to) summed-volume tables
+    assert q3d._table('num') is None and q3d._table('den') is None
+
+
+def test_check_consistency_against_root():
+    ROOT = pytest.importorskip('ROOT')
+    from pionpion.rootview import to_root_histogram
+
+    q3d = make_q3d()
+    num_root = to_root_histogram(q3d.num, 'num')
+    den_root = to_root_histogram(q3d.den, 'den')
+    Q3D(num_root, den_root)
+
+    # a view which does not match its ROOT histogram
+    q3d.num._ptr = den_root
+    with pytest.raises(ValueError):
+        q3d.check_consistency()
@@ -0,0 +1,68 @@
+#
+# tests/test_sparse.py
+#
+
+import pytest
+import numpy as np
+from pionpion.histogram import ArrayHistogram
+from pionpion.sparse import SparseHistogram3D
+from pionpion.q3d import Q3D
+
+
+def make_hists(nbins=41, seed=2):
+    np.random.seed(seed)
+    edges = np.linspace(-0.41, 0.41, nbins + 1)
+    centers = (edges[1:] + edges[:-1]) / 2
+    qo, qs, ql = np.meshgrid(centers, centers, centers, indexing='ij')
+    q2 = qo ** 2 + qs ** 2 + ql ** 2
+    den = np.random.poisson(300 * np.exp(-q2 / 0.01)).astype(float)
+    num = np.random.poisson(den * (1 + 0.5 * np.exp(-q2 * 900))).astype(float)
+    return (ArrayHistogram(num, edges=[edges] * 3), ArrayHistogram(den, edges=[edges] * 3))
+
+
+def test_sparse_histogram():
+    num, den = make_hists()
+    sparse = SparseHistogram3D.from_histogram(num, core_q=0.1)
+    assert sparse.nbytes < num.data.nbytes / 2
+    assert np.all(np.abs(sparse.x_axis.bin_centers[sparse.core[0]]) <= 0.1)
+
+    full = sparse.to_histogram()
+    assert np.array_equal(full.data, num.data)
+    assert np.array_equal(full.errors, num.errors)
+
+    # boxes straddling the core and sparse regions
+    for box in [((-0.2, 0.05), None, (0.0, 0.3)), ((0.15, 0.4), (-0.4, -0.2), (-0.1, 0.1))]:
+        s = num.get_slice(*box)
+        assert np.array_equal(sparse.dense(*box).data, num.data[s])
+        assert np.array_equal(sparse[box], num.data[s])
+        for axis in range(3):
+            others = tuple(i for i in range(3) if i != axis)
+            assert np.allclose(sparse.projection(axis, *box), num.data[s].sum(axis=others))
+        assert np.isclose(sparse.sum(*box), num.data[s].sum())
+    assert np.array_equal(sparse[3, :, 5], num.data[3, :, 5])
+
+    ratio = SparseHistogram3D.from_histogram(num) / SparseHistogram3D.from_histogram(den)
+    expected = num / den
+    filled = den.data != 0
+    dense_ratio = ratio.to_histogram()
+    assert np.allclose(dense_ratio.data[filled], expected.data[filled])
+    assert np.allclose(dense_ratio.errors[filled], expected.errors[filled])
+
+    with pytest.raises(ValueError):
+        sparse / SparseHistogram3D.from_histogram(den, core_q=0.2)
+
+
+def test_q3d_from_sparse():
+    num, den = make_hists()
+    snum, sden = (SparseHistogram3D.from_histogram(h, core_q=0.1) for h in (num, den))
+
+    q3d = Q3D.from_sparse(snum, sden)
+    assert q3d.num.shape == tuple(s.stop - s.start for s in snum.core)
+    s = snum.core
+    assert np.array_equal(q3d.den.data, den.data[s])
+
+    wide = Q3D.from_sparse(snum, sden, q_max=0.2)
+    assert np.array_equal(wide.num.data, num.data[num.get_slice((-0.2, 0.2), (-0.2, 0.2), (-0.2, 0.2))])
+
+    # the whole histogram
+    assert np.array_equal(Q3D(snum, sden).ratio_data, Q3D(num, den).ratio_data)
@@ -0,0 +1,73 @@
+#
+# tests/test_sweep.py
+#
+
+import lmfit
+import numpy as np
+import post_analysis.fitting.gaussian as gaussian
+from post_analysis.fitting.sweep import SweepTask, fit_sweep, measure_cold_start
+
+CENTRALITIES = [(0, 5), (5, 10), (10, 20)]
+KT_BINS = [(0.2, 0.3), (0.3, 0.4), (0.4, 0.5), (0.5, 0.6)]
+
+
+def make_tasks(model):
+    np.random.seed(0)
+    x = np.linspace(0.004, 0.16, 40)
+    tasks = []
+    for cent in CENTRALITIES:
+        for kt in KT_BINS:
+            radius = 9.0 - 3.0 * np.mean(kt) - 0.08 * np.mean(cent)
+            den = np.random.poisson(1e5, x.size).astype(float)
+            num = np.random.poisson(den * model.gauss(x, radius, 0.4, 1.02)).astype(float)
+            y = num / den
+            e = y * np.sqrt(1 / num + 1 / den)
+
+            def fit(params, args=(x, y, e)):
+                return lmfit.minimize(model.as_resid, params, args=args)
+
+            tasks.append(SweepTask((cent, kt), cent, kt, fit))
+    return tasks
+
+
+def test_sweep_warm_start():
+    model = gaussian.GaussianModelFSI
+    tasks = make_tasks(model)
+    sweep = fit_sweep(tasks[::-1], model.guess())
+
+    # results in task order, first fit in sweep order from the default guess
+    assert list(sweep.results) == [t.key for t in tasks[::-1]]
+    assert sweep.seeds[tasks[0].key] is None
+    assert sweep.seeds[tasks[1].key] == tasks[0].key
+    assert sweep.seeds[tasks[len(KT_BINS)].key] == tasks[0].key
+    assert not sweep.fallbacks
+
+    # warm-start totals are reported without the cold benchmark
+    assert sweep.cold_nfev is None and sweep.nfev_saved is None
+    assert sweep.nwarm == len(tasks) - 1 and sweep.ndefault == 1
+    assert 0 < sweep.warm_nfev < sweep.nfev
+    assert 'warm-started: %d fits' % sweep.nwarm in sweep.report()
+
+    benchmark = measure_cold_start(sweep, tasks, model.guess())
+    assert benchmark.nfev_saved > 0
+    assert 'saved' in benchmark.report()
+
+    for task in tasks:
+        cold = task.fit(model.guess())
+        warm = sweep.results[task.key]
+        radius = cold.params['radius']
+        assert abs(warm.params['radius'].value - radius.value) < 0.01 * radius.stderr
+
+
+def test_sweep_fallback():
+    model = gaussian.GaussianModelFSI
+    tasks = make_tasks(model)[:3]
+
+    # reject every fit started from a seed
+    def is_converged(result):
+        return result.init_vals[2] == model.guess()['radius'].value
+
+    sweep = fit_sweep(tasks, model.guess(), is_converged=is_converged)
+    assert sweep.fallbacks == [t.key for t in tasks[1:]]
+    for task in tasks:
+        assert is_converged(sweep.results[task.key])
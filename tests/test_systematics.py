@@ -0,0 +1,96 @@
+#
+# tests/test_systematics.py
+#
+
+import csv
+import pytest
+import numpy as np
+from post_analysis.fitting.gaussian import GaussianModelFSI
+from post_analysis.fitting.systematics import (
+    variation_grid,
+    run_systematics,
+    failures,
+    spread,
+    write_csv,
+)
+
+
+def make_data(n):
+    np.random.seed(5)
+    x = np.linspace(0.0025, 1.2475, 250)
+    data = {}
+    for i in range(n):
+        den = np.random.poisson(40000, x.size).astype(float)
+        num = np.random.poisson(den * 0.9 * GaussianModelFSI.gauss(x, 5.0 + i, 0.5, 1.0)).astype(float)
+        data['analysis_%d' % i] = (x, num, den)
+    return data
+
+
+def test_variation_grid():
+    grid = variation_grid((0.16, 0.12), [(0.8, 1.1), (0.6, 0.9)], models=('GaussianModelFSI', 'GaussianModel'))
+    assert len(grid) == 8
+    assert grid[0] == ('GaussianModelFSI', (0.0, 0.16), (0.8, 1.1))
+    with pytest.raises(ValueError):
+        variation_grid((0.16, ), [(0.8, 1.1)], models=('Unknown', ))
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_run_systematics(workers, tmp_path):
+    data = make_data(2)
+    grid = variation_grid((0.16, 0.12), [(0.8, 1.1), (0.6, 0.9)], models=('GaussianModelFSI', 'GaussianModelCoulomb'))
+    rows = run_systematics(data, grid, workers=workers)
+
+    assert len(rows) == 2 * len(grid)
+    assert [r['analysis'] for r in rows[:len(grid)]] == ['analysis_0'] * len(grid)
+    assert all(r['success'] for r in rows)
+    fsi = [r for r in rows if r['model'] == 'GaussianModelFSI']
+    for r in fsi:
+        expected = 5.0 + int(r['analysis'][-1])
+        assert abs(r['radius'] - expected) < 5 * r['radius_err']
+        # normalized to the norm range
+        assert abs(r['norm'] - 1.0) < 0.01
+
+    summary = spread(rows)
+    assert len(summary) == 2 * 3
+    radius = summary[0]
+    assert radius['parameter'] == 'radius' and radius['nvariations'] == len(grid)
+    assert radius['min'] <= radius['reference'] <= radius['max']
+    assert radius['max_deviation'] >= radius['std'] > 0
+
+    path = str(tmp_path / 'rows.csv')
+    write_csv(rows, path)
+    with open(path) as f:
+        assert len(list(csv.DictReader(f))) == len(rows)
+
+
+def test_failed_variations():
+    data = make_data(1)
+    # nothing to normalize to beyond the histogram range
+    grid = variation_grid((0.16, ), [(5.0, 6.0), (0.8, 1.1)], models=('GaussianModelFSI', ))
+    rows = run_systematics(data, grid, workers=1)
+
+    assert len(rows) == 2
+    assert not rows[0]['success'] and 'Empty normalization range' in rows[0]['error']
+    assert np.isnan(rows[0]['radius'])
+    assert rows[1]['success'] and rows[1]['error'] == ''
+    assert failures(rows) == [rows[0]]
+
+    radius = spread(rows)[0]
+    assert radius['reference'] == rows[1]['radius']
+    assert radius['reference_variation'] == 1
+    assert radius['nvariations'] == 1 and radius['nfailed'] == 1
+
+
+def test_failed_variations_any_exception(monkeypatch):
+    from post_analysis.fitting import systematics
+
+    def singular_fit(x, num, den, variation):
+        raise np.linalg.LinAlgError("Singular matrix")
+
+    # workers are forked with the patched fit
+    monkeypatch.setattr(systematics, 'fit_variation', singular_fit)
+    grid = variation_grid((0.16, 0.12), [(0.8, 1.1)], models=('GaussianModelFSI', ))
+    rows = run_systematics(make_data(2), grid, workers=2)
+
+    assert len(rows) == 4 and len(failures(rows)) == 4
+    assert rows[0]['error'] == "LinAlgError('Singular matrix')"